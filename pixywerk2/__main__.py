@@ -8,17 +8,18 @@
 import argparse
 import logging
 import os
-import shutil
 import sys
 import time
 
-from typing import Dict, List, cast
+from typing import List
 
-from .processchain import ProcessorChains
-from .processors.processors import PassthroughException
-from .metadata import MetaTree
-from .template_tools import date_iso8601, file_list, file_name, file_content, file_metadata, time_iso8601, file_raw
-from .pygments import pygments_get_css, pygments_markup_contents_html
+from . import profiler
+from .assets import LINK_MODES
+from .build import Builder, Site, site_options
+from .compress import DEFAULT_MIN_SIZE, DEFAULT_TYPES, FORMATS, available_formats
+from .output import DEFAULT_BUFFER_SIZE
+from .rendercache import DEFAULT_MAX_SIZE, prune, stats
+from .serve import serve
 
 logger = logging.getLogger()
 
@@ -41,6 +42,66 @@ def get_args(args: List[str]) -> argparse.Namespace:
     parser.add_argument("-d", "--dry-run", help="Perform a dry-run.", action="store_true")
     parser.add_argument("-v", "--verbose", help="Output verbosely.", action="store_true")
     parser.add_argument("--processors", help="Specify a path to a processor configuration file.", default=None)
+    parser.add_argument(
+        "--manifest", help="The manifest used for incremental builds (default: output.manifest.json)", default=None
+    )
+    parser.add_argument(
+        "-f", "--force", help="Rebuild every file, even if the manifest says it is unchanged.", action="store_true"
+    )
+    parser.add_argument(
+        "-j", "--jobs", help="Number of worker processes to render with, 0 for one per CPU.", type=int, default=1
+    )
+    parser.add_argument("--cache-dir", help="The directory for build caches (default: output.cache)", default=None)
+    parser.add_argument(
+        "--cache-size",
+        help="The size limit of the render cache in MiB, 0 to disable it (default: {})".format(
+            DEFAULT_MAX_SIZE // (1024 * 1024)
+        ),
+        type=int,
+        default=DEFAULT_MAX_SIZE // (1024 * 1024),
+    )
+    parser.add_argument(
+        "--buffer-size", help="The size in bytes of output write chunks.", type=int, default=DEFAULT_BUFFER_SIZE
+    )
+    parser.add_argument(
+        "--link-mode",
+        help="How files which pass through unprocessed are published (default: copy)",
+        choices=LINK_MODES,
+        default="copy",
+    )
+    parser.add_argument(
+        "-w", "--watch", help="Keep running and rebuild whenever the source tree changes.", action="store_true"
+    )
+    parser.add_argument("--poll", help="Watch by polling instead of using inotify.", action="store_true")
+    parser.add_argument(
+        "--debounce", help="Seconds to wait for a burst of changes to settle (default: 0.1)", type=float, default=0.1
+    )
+    parser.add_argument(
+        "--serve", help="Serve the site on this port, rendering pages as they are requested.", type=int, default=None
+    )
+    parser.add_argument("--bind", help="The address to serve on (default: 127.0.0.1)", default="127.0.0.1")
+    parser.add_argument(
+        "--compress",
+        help="Write precompressed sidecars of text outputs in this format (may be repeated).",
+        choices=FORMATS.keys(),
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "--compress-min-size",
+        help="Outputs smaller than this many bytes are not compressed.",
+        type=int,
+        default=DEFAULT_MIN_SIZE,
+    )
+    parser.add_argument(
+        "--compress-types", help="Comma separated mime-types to compress.", default=",".join(DEFAULT_TYPES)
+    )
+    parser.add_argument(
+        "--profile",
+        help="Profile the build, writing output.profile.json and a Chrome trace to output.trace.json.",
+        action="store_true",
+    )
+    parser.add_argument("--profile-top", help="The number of slowest files to list.", type=int, default=10)
     # parser.add_argument("--prescript", help="Specify one or more prescripts to run (in order specified) with context of the compile.", default=[], action="append")
     # parser.add_argument("--postscript", help="Specify one or more postsscripts to run (in order specified) with context of the compile.", default=[], action="append")
     result = parser.parse_args(args)
@@ -53,81 +114,74 @@ def get_args(args: List[str]) -> argparse.Namespace:
         result.template = os.path.join(result.root, "templates")
         result.excludes = [result.template]
 
+    if result.jobs < 1:
+        result.jobs = os.cpu_count() or 1
+
+    if not result.manifest:
+        result.manifest = os.path.normpath(result.output) + ".manifest.json"
+
+    result.compress_types = [x.strip() for x in result.compress_types.split(",") if x.strip()]
+    for fmt in result.compress:
+        if fmt not in available_formats():
+            print("warning: the module for {} compression is not installed, skipping it".format(fmt))
+
+    if not result.cache_dir:
+        result.cache_dir = os.path.normpath(result.output) + ".cache"
+
     return result
 
 
+def cache_command(args: List[str]) -> int:
+    parser = argparse.ArgumentParser(
+        "pixywerk2 cache", description="Inspect or prune the render cache of a build cache directory."
+    )
+    parser.add_argument("command", help="What to do.", choices=("stats", "prune"))
+    parser.add_argument("cache_dir", help="The build cache directory (by default output.cache)")
+    parser.add_argument(
+        "--max-size",
+        help="Prune to this size in MiB, 0 to empty the cache (default: {})".format(DEFAULT_MAX_SIZE // (1024 * 1024)),
+        type=int,
+        default=DEFAULT_MAX_SIZE // (1024 * 1024),
+    )
+    result = parser.parse_args(args)
+    path = os.path.join(result.cache_dir, "render")
+    if result.command == "prune":
+        removed, freed = prune(path, result.max_size * 1024 * 1024)
+        print("removed {} entries, freed {} bytes".format(removed, freed))
+    summary = stats(path)
+    print("{}: {} entries, {} bytes".format(path, summary["entries"], summary["bytes"]))
+    if summary["entries"]:
+        print(
+            "last used between {} and {}".format(
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(summary["oldest"])),
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(summary["newest"])),
+            )
+        )
+    return 0
+
+
 def main() -> int:
+    if sys.argv[1:2] == ["cache"]:
+        return cache_command(sys.argv[2:])
     try:
         args = get_args(sys.argv[1:])
     except FileNotFoundError as ex:
         print("error finding arguments: {}".format(ex))
         return 1
     setup_logging(args.verbose)
+    profiler.enable(args.profile)
     if os.path.exists(args.output) and args.clean:
         bak = "{}.bak-{}".format(args.output, int(time.time()))
         print("cleaning target {} -> {}".format(args.output, bak))
         os.rename(args.output, bak)
 
-    process_chains = ProcessorChains(args.processors)
-
-    default_metadata = {
-        "templates": args.template,
-        "template": "default.jinja2",
-        "dir-template": "default-dir.jinja2",
-        "filters": {},
-        "build-time": time.time(),
-        "uuid-oid-root": "pixywerk",
-        "summary": "",
-        "description": "",
-        "author": "",
-        "author_email": "",
-    }
-    meta_tree = MetaTree(args.root, default_metadata)
-    file_list_cache = cast(Dict, {})
-    file_cont_cache = cast(Dict, {})
-    file_name_cache = cast(Dict, {})
-    file_raw_cache = cast(Dict, {})
-    default_metadata["globals"] = {
-        "get_file_list": file_list(args.root, file_list_cache),
-        "get_file_name": file_name(args.root, meta_tree, process_chains, file_name_cache),
-        "get_file_content": file_content(args.root, meta_tree, process_chains, file_cont_cache),
-        "get_raw": file_raw(args.root, file_raw_cache),
-        "get_file_metadata": file_metadata(meta_tree),
-        "get_time_iso8601": time_iso8601("UTC"),
-        "get_date_iso8601": date_iso8601("UTC"),
-        "pygments_get_css": pygments_get_css,
-        "pygments_markup_contents_html": pygments_markup_contents_html,
-    }
-
-    for root, _, files in os.walk(args.root):
-        workroot = os.path.relpath(root, args.root)
-        if workroot == ".":
-            workroot = ""
-        target_dir = os.path.join(args.output, workroot)
-        print("mkdir -> {}".format(target_dir))
-        if not args.dry_run:
-            try:
-                os.mkdir(target_dir)
-            except FileExistsError:
-                if args.safe:
-                    print("error, target directory exists, aborting")
-                    return 1
-        for f in files:
-            # fixme global generic filters
-            if f.endswith(".meta") or f.endswith("~"):
-                continue
-            metadata = meta_tree.get_metadata(os.path.join(workroot, f))
-            chain = process_chains.get_chain_for_filename(os.path.join(root, f), ctx=metadata)
-            print("process {} -> {}".format(os.path.join(root, f), os.path.join(target_dir, chain.output_filename)))
-            if not args.dry_run:
-                try:
-                    with open(os.path.join(target_dir, chain.output_filename), "w") as outfile:
-                        for line in chain.output:
-                            outfile.write(line)
-                except PassthroughException:
-                    shutil.copyfile(os.path.join(root, f), os.path.join(target_dir, chain.output_filename))
-
-    return 0
+    if args.serve is not None:
+        site = Site(**site_options(args))
+        ignore = [args.output, args.manifest, args.cache_dir]
+        return serve(site, args.bind, args.serve, [args.root, args.template], ignore, args.poll, args.debounce)
+    if args.watch:
+        return Builder(args).watch(args.poll, args.debounce)
+    return Builder(args).run()
 
 
 if __name__ == "__main__":
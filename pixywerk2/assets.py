@@ -0,0 +1,112 @@
+"""Fast, zero-copy where possible, publishing of files which pass through unprocessed."""
+
+import logging
+import os
+import shutil
+
+from typing import Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+LINK_MODES = ("copy", "reflink", "hardlink", "auto")
+
+# from linux/fs.h
+FICLONE = 0x40049409
+
+
+def destination_current(source_st: os.stat_result, target: str) -> bool:
+    """Return True if the target already holds the source (same inode, or the same size and mtime).
+
+    Arguments:
+        source_st (os.stat_result): The stat of the source.
+        target (str): The path of the target.
+
+    """
+    try:
+        target_st = os.stat(target)
+    except FileNotFoundError:
+        return False
+    if (target_st.st_dev, target_st.st_ino) == (source_st.st_dev, source_st.st_ino):
+        return True
+    return target_st.st_size == source_st.st_size and target_st.st_mtime_ns == source_st.st_mtime_ns
+
+
+def _hardlink(source: str, target: str) -> None:
+    tmp_target = target + ".pwlink"
+    if os.path.lexists(tmp_target):
+        os.unlink(tmp_target)
+    os.link(source, tmp_target)
+    os.replace(tmp_target, target)
+
+
+def _reflink(source: str, target: str) -> None:
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(source, "rb") as infile, open(target, "wb") as outfile:
+        fcntl.ioctl(outfile.fileno(), FICLONE, infile.fileno())
+
+
+def _copy(source: str, target: str, size: int) -> None:
+    if not hasattr(os, "copy_file_range"):
+        shutil.copyfile(source, target)
+        return
+    with open(source, "rb") as infile, open(target, "wb") as outfile:
+        remaining = size
+        while remaining > 0:
+            try:
+                copied = os.copy_file_range(infile.fileno(), outfile.fileno(), remaining)
+            except OSError:
+                # e.g. EXDEV on older kernels, or a filesystem without support
+                infile.seek(size - remaining)
+                shutil.copyfileobj(infile, outfile)
+                return
+            if copied == 0:
+                break
+            remaining -= copied
+
+
+def publish_asset(source: str, target: str, mode: str = "copy") -> Tuple[str, int]:
+    """Publish a source file unchanged at the target path.
+
+    Arguments:
+        source (str): The path of the source file.
+        target (str): The path of the output file.
+        mode (str, optional): One of ``copy`` (in-kernel copy_file_range), ``reflink`` (copy-on-write clone, falling
+            back to a copy), ``hardlink`` (falling back to a copy, e.g. across filesystems) or ``auto`` (reflink, then
+            copy).
+
+    Returns:
+        tuple: how the file was published (``skipped``, ``linked`` or ``copied``) and the number of bytes involved.
+
+    """
+    source_st = os.stat(source)
+    if destination_current(source_st, target):
+        return "skipped", 0
+
+    # an out of date target may still be a hardlink to an earlier source, which must not be written through
+    if os.path.lexists(target):
+        os.unlink(target)
+
+    if mode == "hardlink":
+        try:
+            _hardlink(source, target)
+            return "linked", source_st.st_size
+        except OSError as ex:
+            logger.debug("hardlink %s -> %s failed (%s), copying", source, target, ex)
+    elif mode in ("reflink", "auto"):
+        try:
+            _reflink(source, target)
+            os.utime(target, ns=(source_st.st_atime_ns, source_st.st_mtime_ns))
+            return "linked", source_st.st_size
+        except OSError as ex:
+            logger.debug("reflink %s -> %s failed (%s), copying", source, target, ex)
+
+    _copy(source, target, source_st.st_size)
+    # keep the mtime so the next build can tell the target is current
+    os.utime(target, ns=(source_st.st_atime_ns, source_st.st_mtime_ns))
+    return "copied", source_st.st_size
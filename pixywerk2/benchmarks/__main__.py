@@ -0,0 +1,77 @@
+"""Run the benchmarks: python -m pixywerk2.benchmarks [options]"""
+
+import argparse
+import json
+import sys
+
+from typing import List
+
+from .bench import compare, run_benchmarks
+from .sitegen import SiteShape
+
+
+def get_args(args: List[str]) -> argparse.Namespace:
+    defaults = SiteShape()
+    parser = argparse.ArgumentParser("Benchmark pixywerk2 builds of a synthetic site.")
+    parser.add_argument("--pages", help="The number of pages.", type=int, default=defaults.pages)
+    parser.add_argument("--depth", help="The number of directory levels.", type=int, default=defaults.depth)
+    parser.add_argument("--fanout", help="The number of directories per level.", type=int, default=defaults.fanout)
+    parser.add_argument(
+        "--meta-density", help="The fraction of pages with a .meta.", type=float, default=defaults.meta_density
+    )
+    parser.add_argument(
+        "--markdown-ratio", help="The fraction of Markdown pages.", type=float, default=defaults.markdown_ratio
+    )
+    parser.add_argument(
+        "--include-depth", help="The depth of template includes.", type=int, default=defaults.include_depth
+    )
+    parser.add_argument("--code-blocks", help="Pygments code blocks per page.", type=int, default=defaults.code_blocks)
+    parser.add_argument("--paragraphs", help="Paragraphs per page.", type=int, default=defaults.paragraphs)
+    parser.add_argument("--seed", help="The random seed.", type=int, default=defaults.seed)
+    parser.add_argument("--repeat", help="Repetitions of in-process timings.", type=int, default=3)
+    parser.add_argument("-j", "--jobs", help="Worker processes for the full builds.", type=int, default=1)
+    parser.add_argument("--workdir", help="Keep the generated site and outputs here.", default=None)
+    parser.add_argument("-o", "--output", help="Save the results to this JSON file.", default=None)
+    parser.add_argument("--compare", help="Compare the results with a previously saved JSON file.", default=None)
+    return parser.parse_args(args)
+
+
+def main() -> int:
+    args = get_args(sys.argv[1:])
+    shape = SiteShape(
+        pages=args.pages,
+        depth=args.depth,
+        fanout=args.fanout,
+        meta_density=args.meta_density,
+        markdown_ratio=args.markdown_ratio,
+        include_depth=args.include_depth,
+        code_blocks=args.code_blocks,
+        paragraphs=args.paragraphs,
+        seed=args.seed,
+    )
+    results = run_benchmarks(shape, args.repeat, args.workdir, args.jobs)
+
+    for name, result in sorted(results["results"].items()):
+        line = "{:40} {:9.4f}s {:10.1f} {}/s".format(name, result["seconds"], result["per_second"], result["unit"])
+        if "peak_rss_kb" in result:
+            line += "  peak RSS {:.1f}MiB".format(result["peak_rss_kb"] / 1024)
+        print(line)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as outfile:
+            json.dump(results, outfile, indent=2, sort_keys=True)
+        print("results written to {}".format(args.output))
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as infile:
+            baseline = json.load(infile)
+        if baseline.get("shape") != results["shape"]:
+            print("warning: the baseline was run on a differently shaped site")
+        print("{:40} {:>10} {:>10} {:>8}".format("benchmark", "before", "after", "change"))
+        for name, before, after, change in compare(baseline, results):
+            print("{:40} {:9.4f}s {:9.4f}s {:+7.1f}%".format(name, before, after, change))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
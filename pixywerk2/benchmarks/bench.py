@@ -0,0 +1,175 @@
+"""Time the stages of a build of a synthetic site, and compare the results of two runs."""
+
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .. import profiler
+from ..build import Site
+from ..metadata import MetaTree
+from ..processchain import ProcessorChains
+from .sitegen import SiteShape, generate_site
+
+RESULTS_VERSION = 1
+
+
+def _best(func: Callable[[], None], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def _sources(root: str) -> List[str]:
+    sources = []
+    for dirpath, _, files in os.walk(root):
+        for name in files:
+            if not name.endswith(".meta") and not name.endswith("~"):
+                sources.append(os.path.relpath(os.path.join(dirpath, name), root))
+    return sorted(sources)
+
+
+def _result(seconds: float, items: int, unit: str, peak_rss_kb: Optional[int] = None) -> Dict:
+    result = {"seconds": seconds, "items": items, "per_second": items / seconds if seconds else 0.0, "unit": unit}
+    if peak_rss_kb is not None:
+        result["peak_rss_kb"] = peak_rss_kb
+    return result
+
+
+def _build(root: str, output: str, extra: Tuple[str, ...] = ()) -> Tuple[float, int]:
+    # a whole build in a fresh interpreter, so imports count and the peak RSS is the build's own
+    command = [sys.executable, "-m", "pixywerk2", root, output] + list(extra)
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    # os.waitstatus_to_exitcode only exists from Python 3.9
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+    if process.returncode != 0:
+        raise RuntimeError("build failed: {}".format(" ".join(command)))
+    return elapsed, usage.ru_maxrss
+
+
+def run_benchmarks(shape: SiteShape, repeat: int = 3, workdir: Optional[str] = None, jobs: int = 1) -> Dict:
+    """Generate a site and time metadata lookups, chain construction, each processor and whole builds.
+
+    Arguments:
+        shape (SiteShape): The parameters of the site.
+        repeat (int, optional): The number of times to repeat each in-process measurement (the best is kept).
+        workdir (str, optional): The directory to generate the site and its output in (default: a temporary one)
+        jobs (int, optional): The number of worker processes for the whole builds.
+
+    Returns:
+        dict: the results, ready to be saved as JSON.
+
+    """
+    tmpdir = workdir or tempfile.mkdtemp(prefix="pixywerk2-bench-")
+    root = os.path.join(tmpdir, "src")
+    output = os.path.join(tmpdir, "publish")
+    # start from scratch, so the cold build really is cold
+    for path in (root, output, output + ".cache", os.path.join(tmpdir, "cache"), os.path.join(tmpdir, "render")):
+        shutil.rmtree(path, ignore_errors=True)
+    if os.path.exists(output + ".manifest.json"):
+        os.remove(output + ".manifest.json")
+    try:
+        counts = generate_site(root, shape)
+        sources = _sources(root)
+        templates = os.path.join(root, "templates")
+        results: Dict[str, Dict] = {}
+
+        def cold_metadata() -> None:
+            tree = MetaTree(root, {"uuid-oid-root": "bench"})
+            for source in sources:
+                tree.get_metadata(source)
+
+        warm_tree = MetaTree(root, {"uuid-oid-root": "bench"})
+
+        def warm_metadata() -> None:
+            warm_tree.new_build()
+            for source in sources:
+                warm_tree.get_metadata(source)
+
+        results["metadata.cold"] = _result(_best(cold_metadata, repeat), len(sources), "files")
+        warm_metadata()
+        results["metadata.warm"] = _result(_best(warm_metadata, repeat), len(sources), "files")
+
+        chains = ProcessorChains()
+        metadata = {x: warm_tree.get_metadata(x) for x in sources}
+
+        def get_chains() -> None:
+            for source in sources:
+                chain = chains.get_chain_for_filename(os.path.join(root, source), ctx=metadata[source])
+                chain.output_filename  # pylint: disable=pointless-statement
+
+        results["chains"] = _result(_best(get_chains, repeat), len(sources), "files")
+
+        # render every file in process with the profiler on, for the time spent in each processor
+        site = Site(root, templates, cache_dir=os.path.join(tmpdir, "cache"))
+        render_dir = os.path.join(tmpdir, "render")
+        profiler.reset()
+        profiler.enable()
+        try:
+            start = time.perf_counter()
+            for source in sources:
+                os.makedirs(os.path.join(render_dir, os.path.dirname(source)), exist_ok=True)
+                site.render(source, os.path.join(render_dir, source))
+            render_time = time.perf_counter() - start
+            totals = profiler.report()["totals"]
+        finally:
+            profiler.enable(False)
+            profiler.reset()
+        results["render"] = _result(render_time, len(sources), "files")
+        for name, total in totals.get("processor", {}).items():
+            results["processor." + name] = _result(total["wall"], total["calls"], "calls")
+        for name, total in totals.get("template", {}).items():
+            results["template." + name] = _result(total["wall"], total["calls"], "calls")
+
+        extra = ("-j", str(jobs))
+        elapsed, rss = _build(root, output, extra)
+        results["build.cold"] = _result(elapsed, counts["pages"], "pages", rss)
+        elapsed, rss = _build(root, output, extra)
+        results["build.warm"] = _result(elapsed, counts["pages"], "pages", rss)
+        elapsed, rss = _build(root, output, extra + ("--force",))
+        results["build.forced"] = _result(elapsed, counts["pages"], "pages", rss)
+    finally:
+        if workdir is None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return {
+        "version": RESULTS_VERSION,
+        "shape": shape._asdict(),
+        "counts": counts,
+        "jobs": jobs,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "results": results,
+    }
+
+
+def compare(old: Dict, new: Dict) -> List[Tuple[str, float, float, float]]:
+    """Compare the timings of two runs.
+
+    Arguments:
+        old (dict): The baseline results.
+        new (dict): The new results.
+
+    Returns:
+        list: (name, old seconds, new seconds, change in percent) for each benchmark in both runs.
+
+    """
+    rows = []
+    for name in sorted(set(old["results"]) & set(new["results"])):
+        before = old["results"][name]["seconds"]
+        after = new["results"][name]["seconds"]
+        rows.append((name, before, after, (after - before) / before * 100 if before else 0.0))
+    return rows
@@ -0,0 +1,134 @@
+"""Generate synthetic pixywerk source trees of a given shape, for benchmarking."""
+
+import json
+import os
+import random
+
+from typing import Dict, List, NamedTuple
+
+CODE_SAMPLE = '''def fibonacci(count):
+    """Return the first count Fibonacci numbers."""
+    result = [0, 1]
+    while len(result) < count:
+        result.append(result[-1] + result[-2])
+    return result[:count]
+'''
+
+WORDS = (
+    "static site generator template metadata directory render page content markdown cache build output file index "
+    "chain processor glob stream layout fragment feed asset style script image author summary title tag post"
+).split()
+
+
+class SiteShape(NamedTuple):
+    """The parameters of a synthetic site."""
+
+    pages: int = 200
+    # the number of directory levels below the root
+    depth: int = 3
+    # directories per level
+    fanout: int = 3
+    # the fraction of pages (and directories) with their own .meta
+    meta_density: float = 0.5
+    # the fraction of pages written in Markdown, the rest are .thtml
+    markdown_ratio: float = 0.5
+    # the depth of the chain of templates the page template includes
+    include_depth: int = 2
+    # the number of Pygments highlighted code blocks in each page
+    code_blocks: int = 1
+    # the number of paragraphs in each page
+    paragraphs: int = 5
+    seed: int = 0
+
+
+def _directories(shape: SiteShape) -> List[str]:
+    dirs = [""]
+    level = [""]
+    for depth in range(shape.depth):
+        level = [os.path.join(parent, "d{}_{}".format(depth, i)) for parent in level for i in range(shape.fanout)]
+        dirs.extend(level)
+    return dirs
+
+
+def _sentence(rng: random.Random, words: int = 12) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _write(path: str, content: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as outfile:
+        outfile.write(content)
+
+
+def _templates(root: str, shape: SiteShape) -> None:
+    templates = os.path.join(root, "templates")
+    for level in range(shape.include_depth):
+        if level + 1 < shape.include_depth:
+            body = '<div class="level{0}">{{% include "partials/include_{1}.jinja2" %}}</div>\n'.format(
+                level, level + 1
+            )
+        else:
+            body = (
+                '<nav>{% for x in get_file_list("*.thtml", sort_order="file_name") %}{{ x.file_name }} {% endfor %}'
+                "</nav>\n"
+            )
+        _write(os.path.join(templates, "partials", "include_{}.jinja2".format(level)), body)
+    include = '{% include "partials/include_0.jinja2" %}' if shape.include_depth else ""
+    _write(
+        os.path.join(templates, "default.jinja2"),
+        "<!DOCTYPE html>\n<html><head><title>{{ metadata.title }}</title>\n"
+        "<style>{{ pygments_get_css() }}</style></head>\n"
+        "<body>" + include + "\n<main>{{ content }}</main>\n"
+        "<footer>{{ metadata.author }} {{ get_time_iso8601(metadata['build-time']) }}</footer></body></html>\n",
+    )
+
+
+def _page(rng: random.Random, shape: SiteShape, markdown: bool) -> str:
+    parts = []
+    for paragraph in range(shape.paragraphs):
+        if markdown:
+            parts.append("## Section {}\n\n{}\n\n* {}\n* {}\n".format(paragraph, _sentence(rng, 40), *WORDS[:2]))
+        else:
+            parts.append("<h2>Section {}</h2>\n<p>{}</p>\n".format(paragraph, _sentence(rng, 40)))
+    for _ in range(shape.code_blocks):
+        parts.append(
+            "{% set code %}" + CODE_SAMPLE + '{% endset %}\n{{ pygments_markup_contents_html(code, "python") }}\n'
+        )
+    return "\n".join(parts)
+
+
+def generate_site(root: str, shape: SiteShape = SiteShape()) -> Dict:
+    """Write a synthetic source tree.
+
+    Arguments:
+        root (str): The directory to write the tree to (created if missing).
+        shape (SiteShape, optional): The parameters of the site.
+
+    Returns:
+        dict: the counts of what was written.
+
+    """
+    rng = random.Random(shape.seed)
+    dirs = _directories(shape)
+    _templates(root, shape)
+    _write(
+        os.path.join(root, ".meta"),
+        json.dumps({"author": "Benchmark", "uuid-oid-root": "benchmark/", "site_root": "https://example.com/"}),
+    )
+    counts = {"pages": 0, "markdown": 0, "meta": 1, "directories": len(dirs)}
+    for rel_dir in dirs[1:]:
+        if rng.random() < shape.meta_density:
+            _write(os.path.join(root, rel_dir, ".meta"), json.dumps({"section": os.path.basename(rel_dir)}))
+            counts["meta"] += 1
+    for number in range(shape.pages):
+        rel_dir = dirs[number % len(dirs)]
+        markdown = rng.random() < shape.markdown_ratio
+        name = "page{}.{}".format(number, "md" if markdown else "thtml")
+        path = os.path.join(root, rel_dir, name)
+        _write(path, _page(rng, shape, markdown))
+        if rng.random() < shape.meta_density:
+            _write(path + ".meta", json.dumps({"title": _sentence(rng, 4), "post_time": number}))
+            counts["meta"] += 1
+        counts["pages"] += 1
+        counts["markdown"] += markdown
+    return counts
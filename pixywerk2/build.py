@@ -0,0 +1,578 @@
+"""Build a pixywerk source tree into an output tree, optionally spreading the rendering across worker processes."""
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, cast
+
+from . import fingerprint, profiler
+from .assets import publish_asset
+from .collection import FileCollection
+from .compress import Compressor
+from .content import ContentStore
+from .dependencies import DependencyRecord, recording
+from .fileindex import FileIndex
+from .images import VariantWriter, available as images_available
+from .manifest import BuildManifest, metadata_digest
+from .metadata import MetaTree
+from .output import DEFAULT_BUFFER_SIZE, write_output
+from .processchain import ProcessorChain, ProcessorChains
+from .processors.processors import PassthroughException
+from .pygments import pygments_get_css, pygments_highlighter
+from .rendercache import DEFAULT_MAX_SIZE, RenderCache, prune
+from .template_tools import (
+    asset_url,
+    date_iso8601,
+    file_list,
+    file_name,
+    file_content,
+    file_metadata,
+    time_iso8601,
+    file_raw,
+    image_size,
+    image_variants,
+)
+from .watch import changes, make_watcher
+
+ASSET_MANIFEST = "asset-manifest.json"
+
+
+class BuildTask(NamedTuple):
+    """A single source file which needs to be rendered."""
+
+    source_name: str
+    output_name: str
+    target: str
+    chain_type: str
+    meta_digest: str
+    mime: str
+    # (output name, target, mime) of each output of the chains which branch off the file's chain
+    branches: Tuple[Tuple[str, str, str], ...] = ()
+
+
+class RenderResult(NamedTuple):
+    """The outcome of rendering a single source file."""
+
+    deps: DependencyRecord
+    # how the output was produced: rendered, or for passthrough files copied, linked or skipped
+    method: str
+    size: int
+    elapsed: float
+    worker: int
+    # profiling data recorded in a worker process, to merge into the parent's
+    profile: Optional[Dict] = None
+
+
+class Site:
+    """The state needed to render files from a source tree: metadata tree, processor chains and template globals."""
+
+    def __init__(
+        self,
+        root: str,
+        templates: str,
+        processors: Optional[str] = None,
+        build_time: Optional[float] = None,
+        cache_dir: Optional[str] = None,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        link_mode: str = "copy",
+        index: Optional[FileIndex] = None,
+        cache_size: int = DEFAULT_MAX_SIZE,
+        refresh_cache: bool = False,
+    ):
+        """Initialize the site.
+
+        Arguments:
+            root (str): The root of the source tree.
+            templates (str): The template directory.
+            processors (str, optional): The path to a processor chain configuration file.
+            build_time (float, optional): The time stamp of the build (default: now)
+            cache_dir (str, optional): The directory to keep caches which persist between builds in.
+            buffer_size (int, optional): The size of the chunks outputs are written in.
+            link_mode (str, optional): How passthrough files are published (see assets.publish_asset).
+            index (FileIndex, optional): An index of the source tree (default: scan the tree now)
+            cache_size (int, optional): The size limit of the render cache in bytes, 0 to not cache rendering.
+            refresh_cache (bool, optional): Render every step again instead of using the render cache.
+
+        """
+        if build_time is None:
+            build_time = time.time()
+        if index is None:
+            index = FileIndex(root)
+        self.root = root
+        self.index = index
+        self.buffer_size = buffer_size
+        self.link_mode = link_mode
+        self.render_cache = None
+        # highlighted code fragments are kept on disk alongside the render cache, and pruned with it
+        self.highlight_cache = None
+        # as are the generated variants of images
+        self.image_cache = None
+        if cache_dir and cache_size > 0:
+            self.highlight_cache = os.path.join(cache_dir, "pygments")
+            self.image_cache = os.path.join(cache_dir, "images")
+            self.render_cache = RenderCache(
+                os.path.join(cache_dir, "render"),
+                root,
+                index,
+                cache_size,
+                lookup=not refresh_cache,
+                values={"build-time": build_time},
+            )
+        self.process_chains = ProcessorChains(processors, self.render_cache)
+        self.default_metadata = {
+            "templates": templates,
+            "template": "default.jinja2",
+            "dir-template": "default-dir.jinja2",
+            "filters": {},
+            "build-time": build_time,
+            "uuid-oid-root": "pixywerk",
+            "summary": "",
+            "description": "",
+            "author": "",
+            "author_email": "",
+            "template-cache": os.path.join(cache_dir, "templates") if cache_dir else None,
+            # the Jinja2 environments of the site, see template_env.get_environment
+            "template-environments": {},
+        }
+        self.meta_tree = MetaTree(root, self.default_metadata, index)
+        self.collection = FileCollection(root, self.meta_tree, index, self.process_chains)
+        self.content = ContentStore()
+        self.file_name_cache = cast(Dict, {})
+        self.file_raw_cache = cast(Dict, {})
+        self.asset_url_cache = cast(Dict, {})
+        globals_ = {
+            "get_file_list": file_list(self.collection),
+            "get_file_name": file_name(root, self.meta_tree, self.process_chains, self.file_name_cache),
+            "get_file_content": file_content(root, self.meta_tree, self.process_chains, self.content),
+            "get_raw": file_raw(root, self.file_raw_cache),
+            "asset_url": asset_url(root, self.meta_tree, self.process_chains, self.asset_url_cache),
+            "get_file_metadata": file_metadata(self.meta_tree),
+            "get_image_variants": image_variants(root, self.meta_tree, self.process_chains),
+            "get_image_size": image_size(root),
+            "get_time_iso8601": time_iso8601("UTC"),
+            "get_date_iso8601": date_iso8601("UTC"),
+            "pygments_get_css": pygments_get_css,
+            "pygments_markup_contents_html": pygments_highlighter(self.highlight_cache),
+        }
+        self.default_metadata["globals"] = {x: profiler.profiled(x)(y) for x, y in globals_.items()}
+
+    def refresh(self, changed: Optional[Iterable[str]] = None) -> None:
+        """Rescan the source tree and drop the per-build caches, keeping compiled templates and metadata warm.
+
+        Arguments:
+            changed (iterable, optional): The paths which changed, so only their directories are rescanned (default:
+                rescan the whole tree).
+
+        """
+        if changed is None:
+            self.index.scan()
+        else:
+            self.index.update(changed)
+        self.meta_tree.new_build()
+        self.collection.clear()
+        self.content.clear()
+        self.file_name_cache.clear()
+        self.file_raw_cache.clear()
+        self.asset_url_cache.clear()
+        if self.render_cache is not None:
+            self.render_cache.new_build()
+
+    def get_chain(self, source_name: str, metadata: Dict) -> ProcessorChain:
+        """Get the processor chain for a source file (which is only opened once its output is read).
+
+        Arguments:
+            source_name (str): The path of the source file, relative to the root.
+            metadata (dict): The metadata for the source file.
+
+        Returns:
+            ProcessorChain: the chain.
+
+        """
+        return self.process_chains.get_chain_for_filename(os.path.join(self.root, source_name), ctx=metadata)
+
+    def output_filename(self, source_name: str, metadata: Dict) -> str:
+        """Get the name a source file is published under, without opening it.
+
+        Arguments:
+            source_name (str): The path of the source file, relative to the root.
+            metadata (dict): The metadata for the source file.
+
+        Returns:
+            str: the output file name (without its directory)
+
+        """
+        return self.process_chains.output_filename(os.path.join(self.root, source_name), metadata)
+
+    def render(
+        self, source_name: str, target: str, branch_targets: Sequence[str] = ()
+    ) -> Tuple[DependencyRecord, str, int]:
+        """Render a source file into its output, and the outputs of the chains which branch off its chain.
+
+        Arguments:
+            source_name (str): The path of the source file, relative to the root.
+            target (str): The path to write the output to.
+            branch_targets (list, optional): The paths to write the output of each branch to (see
+                ProcessorChain.branches).
+
+        Returns:
+            tuple: the files and globs touched while rendering, how the output was produced and its size.
+
+        """
+        metadata = self.meta_tree.get_metadata(source_name)
+        source_path = os.path.join(self.root, source_name)
+        with recording() as deps:
+            chain = self.get_chain(source_name, metadata)
+            if self.process_chains.is_passthrough(chain.file_type):
+                method, size = publish_asset(source_path, target, self.link_mode)
+            else:
+                # a file already rendered for get_file_content during this build is not rendered again
+                output = self.content.lookup(source_name)
+                if output is None:
+                    with self.content.rendering(source_name):
+                        method, size = self._write(chain, source_path, target)
+                else:
+                    method, size = "rendered", write_output(target, output, self.buffer_size)
+            # the branches reuse the steps the chain already ran
+            for branch, branch_target in zip(chain.branches, branch_targets):
+                if self.process_chains.is_passthrough(branch.file_type):
+                    publish_asset(source_path, branch_target, self.link_mode)
+                else:
+                    self._write(branch, source_path, branch_target)
+        if method == "rendered":
+            self.content.written(source_name, target, deps)
+        return deps, method, size
+
+    def _write(self, chain: ProcessorChain, source_path: str, target: str) -> Tuple[str, int]:
+        try:
+            return "rendered", write_output(target, chain.output, self.buffer_size)
+        except PassthroughException:
+            return publish_asset(source_path, target, self.link_mode)
+
+
+def _timed_render(site: Site, task: BuildTask) -> RenderResult:
+    start = time.perf_counter()
+    with profiler.span("render", "file", file=task.source_name):
+        deps, method, size = site.render(task.source_name, task.target, [x[1] for x in task.branches])
+    return RenderResult(deps, method, size, time.perf_counter() - start, os.getpid())
+
+
+_worker_site: Optional[Site] = None
+
+
+def _init_worker(options: Dict, index: FileIndex, digests: Dict, profile: bool) -> None:
+    global _worker_site  # pylint: disable=global-statement
+    fingerprint.preload(digests)
+    profiler.enable(profile)
+    _worker_site = Site(index=index, **options)
+
+
+def _render_in_worker(task: BuildTask) -> RenderResult:
+    result = _timed_render(cast(Site, _worker_site), task)
+    if profiler.enabled():
+        result = result._replace(profile=profiler.drain())
+    return result
+
+
+def site_options(args: argparse.Namespace, build_time: Optional[float] = None) -> Dict:
+    """Return the keyword arguments to build a Site from the parsed command line arguments.
+
+    Arguments:
+        args (argparse.Namespace): The parsed command line arguments.
+        build_time (float, optional): The time stamp of the build (default: now)
+
+    Returns:
+        dict: the keyword arguments.
+
+    """
+    return {
+        "root": args.root,
+        "templates": args.template,
+        "processors": args.processors,
+        "build_time": build_time,
+        "cache_dir": args.cache_dir,
+        "buffer_size": args.buffer_size,
+        "link_mode": args.link_mode,
+        "cache_size": args.cache_size * 1024 * 1024,
+        "refresh_cache": args.force,
+    }
+
+
+class Builder:
+    """Plan and run a build of a source tree into an output tree."""
+
+    def __init__(self, args: argparse.Namespace):
+        """Initialize the builder.
+
+        Arguments:
+            args (argparse.Namespace): The parsed command line arguments.
+
+        """
+        self.args = args
+        self.build_time = time.time()
+        # everything a worker process needs to build an identical Site
+        self.site_options = site_options(args, self.build_time)
+        self.site = Site(**self.site_options)
+        self.manifest = BuildManifest(args.manifest, args.root, args.output, self.site.index)
+        self.skipped = 0
+        # the output paths and mime-types of the files skipped as unchanged by the last plan
+        self.current: List[Tuple[str, str]] = []
+        # source path -> fingerprinted output path, for the fingerprinted assets found by the last plan
+        self.assets: Dict[str, str] = {}
+        self.warned_images = False
+
+    def plan(self) -> Optional[List[BuildTask]]:
+        """Walk the source tree, create the output directories and find the files which need rendering.
+
+        Returns:
+            list: The files to render, in walk order, or None if the build should be aborted.
+
+        """
+        args = self.args
+        tasks = cast(List[BuildTask], [])
+        seen = cast(List, [])
+        self.skipped = 0
+        self.current = []
+        self.assets = {}
+        self.site.meta_tree.new_build()
+        for workroot, _, files in self.site.index.walk():
+            root = os.path.join(args.root, workroot)
+            target_dir = os.path.join(args.output, workroot)
+            print("mkdir -> {}".format(target_dir))
+            if not args.dry_run:
+                try:
+                    os.mkdir(target_dir)
+                except FileExistsError:
+                    if args.safe:
+                        print("error, target directory exists, aborting")
+                        return None
+            for f in files:
+                # fixme global generic filters
+                if f.endswith(".meta") or f.endswith("~"):
+                    continue
+                source_name = os.path.join(workroot, f)
+                metadata = self.site.meta_tree.get_metadata(source_name)
+                chain = self.site.get_chain(source_name, metadata)
+                output_name = os.path.join(workroot, chain.output_filename)
+                target = os.path.join(target_dir, chain.output_filename)
+                meta_digest = metadata_digest(metadata)
+                branches: List[Tuple[str, str, str]] = []
+                for branch in chain.branches:
+                    name = branch.output_filename
+                    branches.append((os.path.join(workroot, name), os.path.join(target_dir, name), branch.output_mime))
+                seen.append(output_name)
+                seen.extend(x[0] for x in branches)
+                if output_name != source_name and self.site.process_chains.is_passthrough(chain.file_type):
+                    self.assets[source_name] = output_name
+                if not args.force and all(
+                    self.manifest.is_current(x, source_name, chain.file_type, meta_digest)
+                    for x in [output_name] + [y[0] for y in branches]
+                ):
+                    self.skipped += 1
+                    self.current.append((target, chain.output_mime))
+                    self.current.extend(x[1:] for x in branches)
+                    if args.verbose:
+                        print("skip {} (unchanged)".format(os.path.join(root, f)))
+                    continue
+                print("process {} -> {}".format(os.path.join(root, f), target))
+                tasks.append(
+                    BuildTask(
+                        source_name,
+                        output_name,
+                        target,
+                        chain.file_type,
+                        meta_digest,
+                        chain.output_mime,
+                        tuple(branches),
+                    )
+                )
+        if not args.dry_run:
+            self.manifest.prune(seen)
+        return tasks
+
+    def _render(self, tasks: List[BuildTask], jobs: int) -> Iterator[RenderResult]:
+        if jobs <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                yield _timed_render(self.site, task)
+            return
+        initargs = (self.site_options, self.site.index, fingerprint.snapshot(), profiler.enabled())
+        chunksize = max(1, len(tasks) // (jobs * 8))
+        with multiprocessing.Pool(jobs, initializer=_init_worker, initargs=initargs) as pool:
+            yield from pool.imap(_render_in_worker, tasks, chunksize)
+
+    def run(self, jobs: Optional[int] = None) -> int:
+        """Run the build.
+
+        Arguments:
+            jobs (int, optional): The number of worker processes to render with (default: from the arguments)
+
+        Returns:
+            int: the exit code.
+
+        """
+        if jobs is None:
+            jobs = self.args.jobs
+        start = time.perf_counter()
+        with profiler.span("plan", "build"):
+            tasks = self.plan()
+        if tasks is None:
+            return 1
+
+        workers: Dict[int, List[float]] = {}
+        published = {"copied": 0, "linked": 0, "skipped": 0}
+        compressor = None
+        variants = None
+        if self.args.compress and not self.args.dry_run:
+            compressor = Compressor(self.args.compress, self.args.compress_min_size, self.args.compress_types)
+            # sidecars of unchanged outputs are only rewritten if they are missing or out of date
+            for target, mime in self.current:
+                compressor.submit(target, mime)
+        if not self.args.dry_run:
+            variants = VariantWriter(self.site.image_cache, self.args.link_mode, max(1, jobs))
+            # results arrive in task order regardless of which worker rendered them
+            for task, result in zip(tasks, self._render(tasks, jobs)):
+                # every output of the file is rebuilt together, from the same inputs
+                for output_name in [task.output_name] + [x[0] for x in task.branches]:
+                    self.manifest.record(
+                        output_name,
+                        task.source_name,
+                        task.chain_type,
+                        task.meta_digest,
+                        result.deps,
+                        hash_source=result.method == "rendered",
+                    )
+                workers.setdefault(result.worker, [0, 0.0])
+                workers[result.worker][0] += 1
+                workers[result.worker][1] += result.elapsed
+                if result.method in published:
+                    published[result.method] += 1 if result.method == "skipped" else result.size
+                if compressor is not None:
+                    compressor.submit(task.target, task.mime)
+                    for _, target, mime in task.branches:
+                        compressor.submit(target, mime)
+                self.submit_variants(variants, task)
+                if result.profile is not None:
+                    profiler.merge(result.profile)
+            self.manifest.save()
+            self.save_assets()
+            with profiler.span("images", "build"):
+                variants.close()
+            if self.site.image_cache is not None:
+                prune(self.site.image_cache, self.args.cache_size * 1024 * 1024)
+            if self.site.render_cache is not None:
+                self.site.render_cache.prune()
+            if self.site.highlight_cache is not None:
+                prune(self.site.highlight_cache, self.args.cache_size * 1024 * 1024)
+        if compressor is not None:
+            with profiler.span("compress", "build"):
+                compressor.close()
+
+        if jobs > 1:
+            for number, (_, (count, busy)) in enumerate(sorted(workers.items())):
+                print(
+                    "worker {}: {} files in {:.2f}s ({:.1f} files/s)".format(
+                        number, count, busy, count / busy if busy else 0.0
+                    )
+                )
+        print(
+            "passthrough: {} bytes copied, {} bytes linked, {} files already current".format(
+                published["copied"], published["linked"], published["skipped"]
+            )
+        )
+        if variants is not None and (variants.generated or variants.reused):
+            print(
+                "images: {} variants generated ({} bytes), {} reused from the cache".format(
+                    variants.generated, variants.bytes_out, variants.reused
+                )
+            )
+        if compressor is not None:
+            print(
+                "compressed {} files ({}): {} -> {} bytes".format(
+                    compressor.files, ", ".join(compressor.formats), compressor.bytes_in, compressor.bytes_out
+                )
+            )
+        print(
+            "{} files rebuilt, {} files skipped in {:.2f}s".format(
+                len(tasks), self.skipped, time.perf_counter() - start
+            )
+        )
+        if profiler.enabled():
+            self.write_profile()
+        return 0
+
+    def submit_variants(self, variants: VariantWriter, task: BuildTask) -> None:
+        """Queue the resized variants of a rendered image, if its chain declares any.
+
+        Arguments:
+            variants (VariantWriter): The writer to queue them on.
+            task (BuildTask): The task the image was published by.
+
+        """
+        metadata = self.site.meta_tree.get_metadata(task.source_name)
+        wanted = self.site.process_chains.variants(task.chain_type, os.path.basename(task.source_name), metadata)
+        if not wanted:
+            return
+        if not images_available():
+            if not self.warned_images:
+                print("warning: Pillow is not installed, image variants are not generated")
+                self.warned_images = True
+            return
+        variants.submit(os.path.join(self.args.root, task.source_name), os.path.dirname(task.target), wanted)
+
+    def write_profile(self) -> None:
+        """Write the profiling report and trace next to the output, and print the slowest files."""
+        prefix = os.path.normpath(self.args.output)
+        profiler.write(prefix + ".profile.json", prefix + ".trace.json")
+        profiler.print_summary(self.args.profile_top)
+        print("profile written to {0}.profile.json, trace to {0}.trace.json".format(prefix))
+        profiler.reset()
+
+    def save_assets(self) -> None:
+        """Write the map of fingerprinted assets to asset-manifest.json in the output, if there are any."""
+        path = os.path.join(self.args.output, ASSET_MANIFEST)
+        if not self.assets:
+            return
+        state = json.dumps(self.assets, indent=2, sort_keys=True)
+        try:
+            with open(path, "r", encoding="utf-8") as infile:
+                if infile.read() == state:
+                    return
+        except FileNotFoundError:
+            pass
+        with open(path, "w", encoding="utf-8") as outfile:
+            outfile.write(state)
+
+    def watch(self, polling: bool = False, debounce: float = 0.1) -> int:
+        """Build, then rebuild whenever the source or template directories change, until interrupted.
+
+        Rebuilds happen in this process so the metadata tree, compiled templates and processors stay warm, only the
+        directories which changed are rescanned, and the manifest limits each rebuild to the outputs affected by the
+        change.
+
+        Arguments:
+            polling (bool, optional): Watch by polling stat results instead of using inotify.
+            debounce (float, optional): How long to wait for a burst of changes to end, in seconds.
+
+        Returns:
+            int: the exit code.
+
+        """
+        result = self.run()
+        if result != 0:
+            return result
+        ignore = [self.args.output, self.args.manifest, self.args.cache_dir]
+        watcher = make_watcher([self.args.root, self.args.template], ignore, polling)
+        print("watching {} for changes with {}".format(self.args.root, type(watcher).__name__))
+        try:
+            for changed in changes(watcher, debounce):
+                print("{} paths changed, rebuilding".format(len(changed)))
+                self.site.refresh(changed)
+                self.manifest.new_build()
+                self.run(jobs=1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+        return 0
@@ -0,0 +1,169 @@
+"""Indexed collections of source files, which answer the sorted and filtered listings behind get_file_list."""
+
+import json
+import os
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import profiler
+from .dependencies import DependencyRecord, record_file, recording
+from .fileindex import FileIndex
+from .metadata import MetaTree
+from .processchain import ProcessorChains
+from .utils import glob_files
+
+# entry keys which come from the file itself rather than its metadata
+FILE_KEYS = frozenset(("file_path", "file_name", "output_name", "mtime", "ctime", "size", "ext"))
+
+
+def _field(entry: Dict, key: str) -> Any:
+    if key in FILE_KEYS:
+        return entry.get(key)
+    return entry["metadata"].get(key)
+
+
+def _matches(entry: Dict, where: Optional[Dict], contains: Optional[Dict]) -> bool:
+    if where:
+        for key, value in where.items():
+            if _field(entry, key) != value:
+                return False
+    if contains:
+        for key, value in contains.items():
+            field = _field(entry, key)
+            if field is None or value not in field:
+                return False
+    return True
+
+
+class FileCollection:
+    """Lists the files matching a glob, with their metadata attached, and caches sorted and filtered views of them.
+
+    The entries for each glob are built once and each distinct (glob, sort key, direction, filters) view is sorted
+    once, so a listing repeated on every page costs one sort per build.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        metatree: MetaTree,
+        index: Optional[FileIndex] = None,
+        processor_chains: Optional[ProcessorChains] = None,
+    ):
+        """Initialize the collection.
+
+        Arguments:
+            root (str): The root of the source tree.
+            metatree (MetaTree): The metadata tree to attach metadata from.
+            index (FileIndex, optional): An index of the source tree to answer glob and stat queries from.
+            processor_chains (ProcessorChains, optional): The chains to resolve the output name of each file with.
+
+        """
+        self._root = root
+        self._metatree = metatree
+        self._index = index
+        self._processor_chains = processor_chains
+        self._entries: Dict[str, Tuple[List[Dict], DependencyRecord]] = {}
+        self._views: Dict[Tuple, List[Dict]] = {}
+
+    def clear(self) -> None:
+        """Forget all entries and views, so the next query sees the current state of the tree."""
+        self._entries = {}
+        self._views = {}
+
+    def entries(self, path_glob: str) -> List[Dict]:
+        """Return the entries for the files matching a glob, in path order.
+
+        Arguments:
+            path_glob (str): The glob, relative to the root.
+
+        Returns:
+            list: A dictionary for each file, with its metadata under the ``metadata`` key and, when the collection
+                has processor chains, the name it is published under as ``output_name``.
+
+        """
+        if path_glob in self._entries:
+            profiler.count("collection.entries.hit")
+            self._entries[path_glob][1].replay()
+            return self._entries[path_glob][0]
+        profiler.count("collection.entries.miss")
+
+        with recording() as deps:
+            if self._index is not None:
+                matches = self._index.glob(path_glob)
+            else:
+                matches = glob_files(self._root, path_glob)
+            entries = []
+            for rel in matches:
+                # the entry carries the file's stat, so a listing showing or sorted by it depends on the file
+                record_file(os.path.join(self._root, rel))
+                st = self._index.stat(rel) if self._index is not None else os.stat(os.path.join(self._root, rel))
+                entries.append(
+                    {
+                        "file_path": rel,
+                        "file_name": os.path.basename(rel),
+                        "mtime": st.st_mtime,
+                        "ctime": st.st_ctime,
+                        "size": st.st_size,
+                        "ext": os.path.splitext(rel)[1],
+                        "metadata": self._metatree.get_metadata(rel),
+                    }
+                )
+            if self._processor_chains is not None:
+                names = self._processor_chains.output_filenames(
+                    (os.path.join(self._root, x["file_path"]), x["metadata"]) for x in entries
+                )
+                for entry, name in zip(entries, names):
+                    entry["output_name"] = name
+        self._entries[path_glob] = (entries, deps)
+        return entries
+
+    def query(
+        self,
+        path_glob: str,
+        sort_order: str = "ctime",
+        reverse: bool = False,
+        where: Optional[Dict] = None,
+        contains: Optional[Dict] = None,
+        offset: int = 0,
+        limit: int = 0,
+    ) -> List[Dict]:
+        """Return a sorted, filtered and sliced view of the files matching a glob.
+
+        Arguments:
+            path_glob (str): The glob, relative to the root.
+            sort_order (str, optional): A file key (see FILE_KEYS) or any metadata key to sort by (default: ctime)
+            reverse (bool, optional): Sort in descending order.
+            where (dict, optional): Only include files where each key is equal to the given value.
+            contains (dict, optional): Only include files where each key contains the given value (e.g. a tag).
+            offset (int, optional): The number of entries to skip from the top of the view.
+            limit (int, optional): The maximum number of entries to return, 0 for unlimited.
+
+        Returns:
+            list: the matching entries.
+
+        """
+        entries = self.entries(path_glob)
+        key = (
+            path_glob,
+            sort_order,
+            reverse,
+            json.dumps(where, sort_keys=True, default=str) if where else None,
+            json.dumps(contains, sort_keys=True, default=str) if contains else None,
+        )
+        if key in self._views:
+            profiler.count("collection.views.hit")
+        else:
+            profiler.count("collection.views.miss")
+            selected = [x for x in entries if _matches(x, where, contains)]
+            present = [x for x in selected if _field(x, sort_order) is not None]
+            missing = [x for x in selected if _field(x, sort_order) is None]
+            try:
+                present.sort(key=lambda x: _field(x, sort_order), reverse=reverse)
+            except TypeError:
+                present.sort(key=lambda x: str(_field(x, sort_order)), reverse=reverse)
+            # files without the sort key always go last
+            self._views[key] = present + missing
+
+        view = self._views[key]
+        end = offset + limit if limit > 0 else len(view)
+        return view[offset:end]
@@ -0,0 +1,169 @@
+"""Write precompressed sidecars (``.gz``, and ``.zst``/``.br`` when their modules are installed) next to outputs."""
+
+import concurrent.futures
+import gzip
+import io
+import os
+
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+from .utils import replacing
+
+DEFAULT_MIN_SIZE = 256
+
+DEFAULT_TYPES = (
+    "text/html",
+    "text/css",
+    "text/plain",
+    "text/xml",
+    "text/javascript",
+    "application/javascript",
+    "application/json",
+    "application/xml",
+    "application/atom+xml",
+    "application/rss+xml",
+    "image/svg+xml",
+)
+
+
+def _gzip(data: bytes) -> bytes:
+    # mtime=0 keeps the sidecar identical between builds of the same output (gzip.compress only takes it from 3.8)
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=9, mtime=0) as outfile:
+        outfile.write(data)
+    return buf.getvalue()
+
+
+def _zstd(data: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=19).compress(data)
+
+
+def _brotli(data: bytes) -> bytes:
+    return brotli.compress(data, quality=11)
+
+
+# format -> (sidecar extension, compression function, available)
+FORMATS: Dict[str, Tuple[str, Callable[[bytes], bytes], bool]] = {
+    "gzip": (".gz", _gzip, True),
+    "zstd": (".zst", _zstd, zstandard is not None),
+    "brotli": (".br", _brotli, brotli is not None),
+}
+
+
+def available_formats() -> List[str]:
+    """Return the compression formats which can be used in this environment."""
+    return [x for x, (_, _, available) in FORMATS.items() if available]
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def write_sidecars(path: str, formats: Iterable[str]) -> Tuple[int, int]:
+    """Write a compressed sidecar of a file for each format, unless the sidecar is already current.
+
+    A sidecar is given the mtime of the file it was compressed from, so an unchanged output is not compressed again.
+
+    Arguments:
+        path (str): The path of the file to compress.
+        formats (iterable): The formats to write (see FORMATS).
+
+    Returns:
+        tuple: the number of bytes read and written, (0, 0) if every sidecar was current.
+
+    """
+    st = os.stat(path)
+    data: Optional[bytes] = None
+    read = written = 0
+    for fmt in formats:
+        extension, compress, _ = FORMATS[fmt]
+        sidecar = path + extension
+        try:
+            if os.stat(sidecar).st_mtime_ns == st.st_mtime_ns:
+                continue
+        except FileNotFoundError:
+            pass
+        if data is None:
+            with open(path, "rb") as infile:
+                data = infile.read()
+            read = len(data)
+        compressed = compress(data)
+        with replacing(sidecar) as tmp_sidecar:
+            with open(tmp_sidecar, "wb") as outfile:
+                outfile.write(compressed)
+            os.utime(tmp_sidecar, ns=(st.st_atime_ns, st.st_mtime_ns))
+        written += len(compressed)
+    return read, written
+
+
+class Compressor:
+    """Compress outputs on a thread pool (zlib, zstandard and brotli release the GIL) while the build carries on."""
+
+    def __init__(
+        self,
+        formats: Iterable[str],
+        min_size: int = DEFAULT_MIN_SIZE,
+        types: Iterable[str] = DEFAULT_TYPES,
+        workers: Optional[int] = None,
+    ):
+        """Initialize the compressor.
+
+        Arguments:
+            formats (iterable): The formats to write (see FORMATS); formats whose module is missing are ignored.
+            min_size (int, optional): Outputs smaller than this many bytes are not compressed.
+            types (iterable, optional): The MIME types to compress.
+            workers (int, optional): The number of compression threads (default: one per CPU)
+
+        """
+        self.formats = [x for x in formats if FORMATS[x][2]]
+        self.min_size = min_size
+        self.types = frozenset(types)
+        self.files = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._pool = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="pixywerk2-compress")
+        self._pending: List[concurrent.futures.Future] = []
+
+    def wants(self, mime: str) -> bool:
+        """Return True if outputs of a MIME type are compressed."""
+        return mime.split(";")[0].strip() in self.types
+
+    def submit(self, path: str, mime: str) -> None:
+        """Queue an output for compression, or remove its stale sidecars if it no longer qualifies.
+
+        Arguments:
+            path (str): The path of the output.
+            mime (str): The MIME type of the output, from ProcessorChain.output_mime.
+
+        """
+        if not self.formats:
+            return
+        if not self.wants(mime) or os.path.getsize(path) < self.min_size:
+            for fmt in self.formats:
+                _remove(path + FORMATS[fmt][0])
+            return
+        self._pending.append(self._pool.submit(write_sidecars, path, self.formats))
+
+    def close(self) -> None:
+        """Wait for the queued outputs to be compressed and shut the pool down."""
+        for future in concurrent.futures.as_completed(self._pending):
+            read, written = future.result()
+            if read:
+                self.files += 1
+                self.bytes_in += read
+                self.bytes_out += written
+        self._pending = []
+        self._pool.shutdown()
@@ -0,0 +1,125 @@
+"""The rendered content of source files, shared by ``get_file_content`` and the build so each is rendered once."""
+
+import contextlib
+import os
+import threading
+
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .dependencies import DependencyRecord
+
+
+class InclusionCycleError(Exception):
+    """A file includes itself, directly or through other files, with get_file_content."""
+
+    def __init__(self, cycle: List[str]):
+        """Initialize the error.
+
+        Arguments:
+            cycle (list): The files in the cycle, starting and ending with the same file.
+
+        """
+        # the cycle itself is the argument, so the error survives being pickled back from a worker process
+        super().__init__(cycle)
+        self.cycle = cycle
+
+    def __str__(self) -> str:
+        return "inclusion cycle: {}".format(" -> ".join(self.cycle))
+
+
+class ContentStore:
+    """Holds the rendered content of each source file for the length of a build.
+
+    Content rendered for ``get_file_content`` is kept in memory until the build writes the file's own output, which
+    reuses it; after that, further requests read the written output instead of keeping the content in memory. A file
+    being rendered while it is already being rendered further up the same call stack raises InclusionCycleError.
+    """
+
+    def __init__(self) -> None:
+        """Initialize an empty store."""
+        self._content: Dict[str, Tuple[str, DependencyRecord]] = {}
+        self._written: Dict[str, Tuple[str, DependencyRecord]] = {}
+        self._local = threading.local()
+
+    def clear(self) -> None:
+        """Forget all content, at the start of another build."""
+        self._content = {}
+        self._written = {}
+
+    def _stack(self) -> List[str]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextlib.contextmanager
+    def rendering(self, source_name: str) -> Iterator[None]:
+        """Mark a file as being rendered for the duration of the context.
+
+        Arguments:
+            source_name (str): The path of the source file, relative to the root.
+
+        Raises:
+            InclusionCycleError: if the file is already being rendered.
+
+        """
+        source_name = os.path.normpath(source_name)
+        stack = self._stack()
+        if source_name in stack:
+            start = stack.index(source_name)
+            raise InclusionCycleError(stack[start:] + [source_name])
+        stack.append(source_name)
+        try:
+            yield
+        finally:
+            stack.pop()
+
+    def lookup(self, source_name: str) -> Optional[str]:
+        """Return the rendered content of a file if it was rendered during this build, replaying its dependencies.
+
+        Arguments:
+            source_name (str): The path of the source file, relative to the root.
+
+        Returns:
+            str: the content, or None.
+
+        """
+        source_name = os.path.normpath(source_name)
+        if source_name in self._content:
+            content, deps = self._content[source_name]
+            deps.replay()
+            return content
+        if source_name in self._written:
+            path, deps = self._written[source_name]
+            try:
+                with open(path, "r", encoding="utf-8", newline="") as infile:
+                    content = infile.read()
+            except FileNotFoundError:
+                del self._written[source_name]
+                return None
+            deps.replay()
+            return content
+        return None
+
+    def add(self, source_name: str, content: str, deps: DependencyRecord) -> None:
+        """Keep the rendered content of a file.
+
+        Arguments:
+            source_name (str): The path of the source file, relative to the root.
+            content (str): The rendered content.
+            deps (DependencyRecord): The files and globs touched while rendering it.
+
+        """
+        self._content[os.path.normpath(source_name)] = (content, deps)
+
+    def written(self, source_name: str, path: str, deps: DependencyRecord) -> None:
+        """Note that the output of a file was written, so its content can be read back instead of kept in memory.
+
+        Arguments:
+            source_name (str): The path of the source file, relative to the root.
+            path (str): The path the output was written to.
+            deps (DependencyRecord): The files and globs touched while rendering it.
+
+        """
+        source_name = os.path.normpath(source_name)
+        self._content.pop(source_name, None)
+        self._written[source_name] = (path, deps)
@@ -0,0 +1,107 @@
+"""Record the files and globs an output touches while it is rendered.
+
+Recordings nest: while a page is being rendered any file it pulls in (a template, a ``.meta`` file, an embedded source)
+is added to every active recording, so an outer page also depends on everything its embedded pages depend on.
+"""
+
+import contextlib
+import json
+import os
+import threading
+
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+_local = threading.local()
+
+
+class DependencyRecord:
+    """The set of files and globs touched while rendering a single output."""
+
+    def __init__(self) -> None:
+        """Initialize an empty record."""
+        self.files: Set[str] = set()
+        self.globs: Set[str] = set()
+        # name -> JSON encoded value of each volatile value read (see record_value)
+        self.values: Dict[str, str] = {}
+
+    def replay(self) -> None:
+        """Add everything in this record to the currently active recordings."""
+        for record in _stack():
+            record.files.update(self.files)
+            record.globs.update(self.globs)
+            record.values.update(self.values)
+
+
+def _stack() -> List[DependencyRecord]:
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+@contextlib.contextmanager
+def recording(record: Optional[DependencyRecord] = None) -> Iterator[DependencyRecord]:
+    """Record dependencies for the duration of the context.
+
+    Arguments:
+        record (DependencyRecord, optional): A record to add to, e.g. to go on recording work done lazily after an
+            earlier context ended (default: a new record)
+
+    Yields:
+        DependencyRecord: the record which collects the dependencies.
+
+    """
+    if record is None:
+        record = DependencyRecord()
+    stack = _stack()
+    stack.append(record)
+    try:
+        yield record
+    finally:
+        stack.pop()
+
+
+def record_file(path: str) -> None:
+    """Note that the active recordings depend on a file (which need not exist).
+
+    Arguments:
+        path (str): The path of the file.
+
+    """
+    stack = _stack()
+    if not stack:
+        return
+    path = os.path.normpath(path)
+    for record in stack:
+        record.files.add(path)
+
+
+def record_glob(pattern: str) -> None:
+    """Note that the active recordings depend on the set of files matching a glob.
+
+    Arguments:
+        pattern (str): The glob, relative to the source root.
+
+    """
+    for record in _stack():
+        record.globs.add(pattern)
+
+
+def encode_value(value: Any) -> str:
+    """Return the JSON encoding a recorded value is kept and compared as (unencodable values become strings)."""
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def record_value(name: str, value: Any) -> None:
+    """Note that the active recordings read a value which is not determined by their inputs, e.g. the build time.
+
+    Arguments:
+        name (str): The name of the value, e.g. ``build-time`` or ``stat:<path>``.
+        value: The value read.
+
+    """
+    stack = _stack()
+    if not stack:
+        return
+    encoded = encode_value(value)
+    for record in stack:
+        record.values[name] = encoded
@@ -0,0 +1,236 @@
+"""An in-memory index of the source tree, built with a single scan, which answers stat, type and glob queries."""
+
+import fnmatch
+import mimetypes
+import os
+import re
+import stat
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+_MAGIC = re.compile("[*?[]")
+
+
+class FileEntry:
+    """A file or directory in the index."""
+
+    __slots__ = ("path", "name", "stat", "is_dir", "_mime")
+
+    def __init__(self, path: str, name: str, st: os.stat_result, is_dir: bool):
+        """Initialize the entry.
+
+        Arguments:
+            path (str): The path of the entry relative to the root ("" for the root itself).
+            name (str): The base name of the entry.
+            st (os.stat_result): The stat of the entry.
+            is_dir (bool): True if the entry is a directory.
+
+        """
+        self.path = path
+        self.name = name
+        self.stat = st
+        self.is_dir = is_dir
+        self._mime: Optional[str] = None
+
+    @property
+    def mime(self) -> str:
+        """Return the guessed mime-type of the entry (the same guess as utils.guess_mime, without any syscalls)."""
+        if self._mime is None:
+            if self.is_dir:
+                self._mime = "directory"
+            else:
+                self._mime = mimetypes.guess_type(self.name)[0] or "application/octet-stream"
+        return self._mime
+
+
+class FileIndex:
+    """Scan a source tree once with os.scandir and answer filesystem queries about it from memory."""
+
+    def __init__(self, root: str):
+        """Initialize the index and scan the tree.
+
+        Arguments:
+            root (str): The root of the source tree.
+
+        """
+        self._root = root
+        self._abs_root = os.path.abspath(root)
+        self._entries: Dict[str, FileEntry] = {}
+        self._children: Dict[str, List[str]] = {}
+        self.scan()
+
+    def scan(self) -> None:
+        """(Re)scan the whole tree."""
+        self._entries = {}
+        self._children = {}
+        self._entries[""] = FileEntry("", "", os.stat(self._root), True)
+        self._scan_dir("")
+
+    def update(self, paths: Iterable[str]) -> None:
+        """Rescan only the directories which contain the given paths, keeping the rest of the index.
+
+        New subdirectories are scanned in full and removed ones are dropped along with everything under them.
+
+        Arguments:
+            paths (iterable): The native paths which changed (e.g. as reported by a watch.Watcher).
+
+        """
+        dirs = set()
+        for path in paths:
+            rel = self._relative(path)
+            if rel is None:
+                continue
+            if not rel:
+                self.scan()
+                return
+            rel_dir = os.path.dirname(rel)
+            while rel_dir and not os.path.isdir(os.path.join(self._root, rel_dir)):
+                rel_dir = os.path.dirname(rel_dir)
+            dirs.add(rel_dir)
+        # parents sort before their children, so a removed directory is dropped before it would be rescanned
+        for rel_dir in sorted(dirs):
+            if rel_dir in self._children:
+                self._scan_dir(rel_dir, recursive=False)
+
+    def _drop(self, rel_dir: str) -> None:
+        prefix = rel_dir + os.sep
+        for rel in [x for x in self._children if x == rel_dir or x.startswith(prefix)]:
+            del self._children[rel]
+        for rel in [x for x in self._entries if x.startswith(prefix)]:
+            del self._entries[rel]
+
+    def _scan_dir(self, rel_dir: str, recursive: bool = True) -> None:
+        names = []
+        subdirs = []
+        with os.scandir(os.path.join(self._root, rel_dir)) as it:
+            for dirent in it:
+                try:
+                    st = dirent.stat()
+                except FileNotFoundError:
+                    # dangling symlink
+                    continue
+                rel = os.path.join(rel_dir, dirent.name)
+                is_dir = stat.S_ISDIR(st.st_mode)
+                self._entries[rel] = FileEntry(rel, dirent.name, st, is_dir)
+                names.append(dirent.name)
+                # like os.walk, do not descend into symlinked directories
+                if is_dir and not dirent.is_symlink():
+                    subdirs.append(rel)
+        names.sort()
+        present = set(names)
+        for name in self._children.get(rel_dir, []):
+            rel = os.path.join(rel_dir, name)
+            if name not in present:
+                self._entries.pop(rel, None)
+            if rel in self._children and rel not in subdirs:
+                self._drop(rel)
+        self._children[rel_dir] = names
+        for subdir in sorted(subdirs):
+            if recursive or subdir not in self._children:
+                self._scan_dir(subdir)
+
+    def get(self, rel_path: str) -> Optional[FileEntry]:
+        """Return the entry for a path relative to the root, or None if it does not exist."""
+        return self._entries.get(rel_path.strip("/"))
+
+    def _relative(self, path: str) -> Optional[str]:
+        rel = os.path.relpath(os.path.abspath(path), self._abs_root)
+        if rel == os.curdir:
+            return ""
+        if rel == os.pardir or rel.startswith(os.pardir + os.sep):
+            return None
+        return rel
+
+    def covers(self, path: str) -> bool:
+        """Return True if a native path lies inside the indexed tree."""
+        return self._relative(path) is not None
+
+    def get_os_path(self, path: str) -> Optional[FileEntry]:
+        """Return the entry for a native path, or None if it does not exist or is outside the tree."""
+        rel = self._relative(path)
+        if rel is None:
+            return None
+        return self._entries.get(rel)
+
+    def stat(self, rel_path: str) -> os.stat_result:
+        """Return the stat of a path relative to the root.
+
+        Raises:
+            FileNotFoundError: if the path is not in the index
+
+        """
+        entry = self.get(rel_path)
+        if entry is None:
+            raise FileNotFoundError("{} not in the source tree".format(rel_path))
+        return entry.stat
+
+    def isdir(self, rel_path: str) -> bool:
+        """Return True if the path relative to the root is a directory."""
+        entry = self.get(rel_path)
+        return entry is not None and entry.is_dir
+
+    def mime(self, rel_path: str) -> str:
+        """Return the guessed mime-type of a path relative to the root."""
+        entry = self.get(rel_path)
+        if entry is None:
+            return "application/octet-stream"
+        return entry.mime
+
+    def listdir(self, rel_dir: str) -> Tuple[List[str], List[str]]:
+        """Return the sorted subdirectory and file names in a directory relative to the root (empty if unknown)."""
+        dirs = []
+        files = []
+        for name in self._children.get(rel_dir.strip("/"), []):
+            if self._entries[os.path.join(rel_dir, name)].is_dir:
+                dirs.append(name)
+            else:
+                files.append(name)
+        return dirs, files
+
+    def walk(self) -> Iterator[Tuple[str, List[str], List[str]]]:
+        """Walk the tree top down, like os.walk, but with sorted names and paths relative to the root.
+
+        Yields:
+            tuple: the directory, its subdirectory names and its file names.
+
+        """
+        pending = [""]
+        while pending:
+            rel_dir = pending.pop(0)
+            dirs, files = self.listdir(rel_dir)
+            yield rel_dir, dirs, files
+            pending[0:0] = [os.path.join(rel_dir, x) for x in dirs if os.path.join(rel_dir, x) in self._children]
+
+    def glob(self, path_glob: str) -> List[str]:
+        """Find the source files matching a glob, with the same matching rules as utils.glob_files.
+
+        Arguments:
+            path_glob (str): the glob, relative to the root
+
+        Returns:
+            list: the sorted paths of the matching files, relative to the root
+
+        """
+        candidates = [""]
+        for part in [x for x in path_glob.split("/") if x and x != os.curdir]:
+            matched = []
+            for rel_dir in candidates:
+                names = self._children.get(rel_dir)
+                if names is None:
+                    continue
+                if _MAGIC.search(part):
+                    hidden = part.startswith(".")
+                    names = [x for x in names if fnmatch.fnmatch(x, part) and (hidden or not x.startswith("."))]
+                elif part in names:
+                    names = [part]
+                else:
+                    names = []
+                matched.extend(os.path.join(rel_dir, x) for x in names)
+            candidates = matched
+
+        result = []
+        for rel in candidates:
+            if self._entries[rel].is_dir or rel.endswith(".meta") or rel.endswith("~"):
+                continue
+            result.append(rel)
+        return sorted(result)
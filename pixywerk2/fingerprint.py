@@ -0,0 +1,65 @@
+"""Content-hash fingerprints for asset file names, e.g. ``style.css`` -> ``style.3f9a1c2b.css``.
+
+Fingerprinting is opt in, with ``"fingerprint": true`` in the metadata of a file (or of its directory), or with
+``fingerprint: true`` in the configuration of a chain. The digest of each file is computed once and kept for as long as
+the file's mtime and size stay the same, so every page which links an asset reuses it.
+"""
+
+import os
+
+from typing import Dict, Tuple
+
+from . import profiler
+from .manifest import file_digest
+
+DIGEST_LENGTH = 8
+
+# path -> (mtime_ns, size, digest)
+_digests: Dict[str, Tuple[int, int, str]] = {}
+
+
+def content_digest(path: str) -> str:
+    """Return the content digest of a file, hashing it only if it changed since the last call.
+
+    Arguments:
+        path (str): The path of the file.
+
+    Returns:
+        str: the hex digest.
+
+    """
+    st = os.stat(path)
+    cached = _digests.get(path)
+    if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        profiler.count("fingerprint.hit")
+        return cached[2]
+    profiler.count("fingerprint.miss")
+    digest = file_digest(path)
+    _digests[path] = (st.st_mtime_ns, st.st_size, digest)
+    return digest
+
+
+def fingerprinted_name(name: str, digest: str, length: int = DIGEST_LENGTH) -> str:
+    """Insert a digest into a file name, before its extension.
+
+    Arguments:
+        name (str): The file name.
+        digest (str): The hex digest of the file's content.
+        length (int, optional): The number of digest characters to use.
+
+    Returns:
+        str: the fingerprinted name.
+
+    """
+    base, ext = os.path.splitext(name)
+    return "{}.{}{}".format(base, digest[:length], ext)
+
+
+def snapshot() -> Dict[str, Tuple[int, int, str]]:
+    """Return a copy of the known digests, to hand to worker processes."""
+    return dict(_digests)
+
+
+def preload(digests: Dict[str, Tuple[int, int, str]]) -> None:
+    """Add digests computed elsewhere (e.g. by the parent process) to the known digests."""
+    _digests.update(digests)
@@ -0,0 +1,262 @@
+"""Resized variants of images (``photo.small.jpg``, ``photo.small.webp``...), generated on a process pool.
+
+Variants are opt in, with the ``image-variants`` and ``image-webp`` metadata keys, and need Pillow; without it images
+are only published as they are. Each variant is kept in a cache directory under a key made of the content digest of
+its source and its resize parameters, so an unchanged image is never decoded again. The pixel dimensions of a variant
+are computed from the header of its source, so templates can use them before (or without) the variant being written.
+"""
+
+import concurrent.futures
+import hashlib
+import os
+import time
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover
+    Image = None
+    ImageOps = None
+
+from . import fingerprint, profiler
+from .assets import publish_asset
+from .utils import replacing
+
+CACHE_VERSION = 1
+DEFAULT_QUALITY = 85
+
+# EXIF orientations which rotate the image by 90 or 270 degrees
+_TRANSPOSED = (5, 6, 7, 8)
+_EXIF_ORIENTATION = 0x0112
+
+_FORMATS = {".jpg": "jpeg", ".jpeg": "jpeg", ".png": "png"}
+
+# path -> (mtime_ns, size, (width, height))
+_sizes: Dict[str, Tuple[int, int, Tuple[int, int]]] = {}
+
+
+class Variant(NamedTuple):
+    """A resized variant of an image, as configured in the metadata."""
+
+    name: str
+    # the bounding box of the variant, either may be None to only constrain the other
+    width: Optional[int]
+    height: Optional[int]
+    # the Pillow format, and the extension of the output file
+    format: str
+    extension: str
+    quality: int
+
+
+def available() -> bool:
+    """Return True if Pillow is installed, so variants can be generated."""
+    return Image is not None
+
+
+def variants_for(file_name: str, ctx: Optional[Dict] = None) -> List[Variant]:
+    """Return the variants configured for an image.
+
+    Arguments:
+        file_name (str): The name of the image.
+        ctx (dict, optional): The metadata for the image.
+
+    Returns:
+        list: the variants, in configuration order, each followed by its WebP version if ``image-webp`` is set.
+
+    """
+    ctx = ctx or {}
+    extension = os.path.splitext(file_name)[1]
+    fmt = _FORMATS.get(extension.lower())
+    if fmt is None:
+        return []
+    variants = []
+    for name, spec in ctx.get("image-variants", {}).items():
+        quality = spec.get("quality", DEFAULT_QUALITY)
+        variants.append(Variant(name, spec.get("width"), spec.get("height"), fmt, extension, quality))
+        if ctx.get("image-webp"):
+            variants.append(Variant(name, spec.get("width"), spec.get("height"), "webp", ".webp", quality))
+    return variants
+
+
+def variant_filename(file_name: str, variant: Variant) -> str:
+    """Return the name a variant of an image is published under, e.g. ``photo.small.webp`` for ``photo.jpg``.
+
+    Arguments:
+        file_name (str): The name of the image.
+        variant (Variant): The variant.
+
+    Returns:
+        str: the name of the variant.
+
+    """
+    return "{}.{}{}".format(os.path.splitext(file_name)[0], variant.name, variant.extension)
+
+
+def variant_size(size: Tuple[int, int], variant: Variant) -> Tuple[int, int]:
+    """Return the pixel dimensions of a variant: the image scaled to fit its bounding box, never enlarged.
+
+    Arguments:
+        size (tuple): The width and height of the image.
+        variant (Variant): The variant.
+
+    Returns:
+        tuple: the width and height of the variant.
+
+    """
+    width, height = size
+    scale = 1.0
+    if variant.width:
+        scale = min(scale, variant.width / width)
+    if variant.height:
+        scale = min(scale, variant.height / height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def image_size(path: str) -> Tuple[int, int]:
+    """Return the width and height of an image as displayed (after its EXIF orientation), reading only its header.
+
+    Arguments:
+        path (str): The path of the image.
+
+    Returns:
+        tuple: the width and height.
+
+    """
+    st = os.stat(path)
+    cached = _sizes.get(path)
+    if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    with Image.open(path) as image:
+        width, height = image.size
+        if image.getexif().get(_EXIF_ORIENTATION, 1) in _TRANSPOSED:
+            width, height = height, width
+    _sizes[path] = (st.st_mtime_ns, st.st_size, (width, height))
+    return width, height
+
+
+def cache_key(digest: str, size: Tuple[int, int], variant: Variant) -> str:
+    """Return the cache key of a variant.
+
+    Arguments:
+        digest (str): The content digest of the source image.
+        size (tuple): The width and height of the variant.
+        variant (Variant): The variant.
+
+    Returns:
+        str: the hex key.
+
+    """
+    params = "{}\0{}\0{}x{}\0{}\0{}".format(CACHE_VERSION, digest, size[0], size[1], variant.format, variant.quality)
+    return hashlib.sha1(params.encode("utf-8")).hexdigest()
+
+
+def render_variants(source: str, outputs: List[Tuple[Tuple[int, int], str, int, str]]) -> int:
+    """Decode an image once and write resized variants of it (run in a worker process).
+
+    Arguments:
+        source (str): The path of the image.
+        outputs (list): (size, format, quality, path) of each variant to write.
+
+    Returns:
+        int: the number of bytes written.
+
+    """
+    written = 0
+    with Image.open(source) as image:
+        if image.format == "JPEG":
+            # let the decoder downscale by a power of two, as long as the result is still larger than every variant
+            width = max(x[0][0] for x in outputs)
+            height = max(x[0][1] for x in outputs)
+            if image.getexif().get(_EXIF_ORIENTATION, 1) in _TRANSPOSED:
+                width, height = height, width
+            image.draft("RGB", (width, height))
+        image = ImageOps.exif_transpose(image)
+        for size, fmt, quality, path in outputs:
+            resized = image if image.size == size else image.resize(size, Image.LANCZOS)
+            if fmt == "jpeg" and resized.mode not in ("RGB", "L"):
+                resized = resized.convert("RGB")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with replacing(path) as tmp_path:
+                resized.save(tmp_path, format=fmt.upper(), quality=quality)
+            written += os.path.getsize(path)
+    return written
+
+
+class VariantWriter:
+    """Publish the variants of images, generating the ones missing from the cache on a process pool."""
+
+    def __init__(self, cache_dir: Optional[str] = None, link_mode: str = "copy", workers: Optional[int] = None):
+        """Initialize the writer.
+
+        Arguments:
+            cache_dir (str, optional): The directory to keep generated variants in (default: write them straight to
+                the output, every time).
+            link_mode (str, optional): How cached variants are published (see assets.publish_asset).
+            workers (int, optional): The number of worker processes (default: one per CPU)
+
+        """
+        self.cache_dir = cache_dir
+        self.link_mode = link_mode
+        self.workers = workers
+        self.generated = 0
+        self.bytes_out = 0
+        self.reused = 0
+        self._pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
+        # each pending future, with the (cached path, target) pairs to publish once it is done
+        self._pending: List[Tuple[concurrent.futures.Future, List[Tuple[str, str]]]] = []
+
+    def _publish(self, path: str, target: str) -> None:
+        if path != target:
+            publish_asset(path, target, self.link_mode)
+
+    def submit(self, source: str, target_dir: str, variants: List[Variant]) -> None:
+        """Publish the variants of an image into a directory, queueing the ones which have to be generated.
+
+        Arguments:
+            source (str): The path of the image.
+            target_dir (str): The directory the image is published in.
+            variants (list): The variants to publish (see variants_for).
+
+        """
+        if not variants or not available():
+            return
+        size = image_size(source)
+        digest = fingerprint.content_digest(source) if self.cache_dir else ""
+        outputs = []
+        publish = []
+        for variant in variants:
+            target = os.path.join(target_dir, variant_filename(os.path.basename(source), variant))
+            dimensions = variant_size(size, variant)
+            path = target
+            if self.cache_dir:
+                key = cache_key(digest, dimensions, variant)
+                path = os.path.join(self.cache_dir, key[:2], key[2:])
+                if os.path.exists(path):
+                    profiler.count("images.hit")
+                    self._publish(path, target)
+                    # entries are pruned least recently used first; only the access time is bumped, since published
+                    # copies are checked against the entry's mtime (kept to the nanosecond, time.time_ns needs 3.7)
+                    os.utime(path, ns=(int(time.time() * 1e9), os.stat(path).st_mtime_ns))
+                    self.reused += 1
+                    continue
+            profiler.count("images.miss")
+            outputs.append((dimensions, variant.format, variant.quality, path))
+            publish.append((path, target))
+        if not outputs:
+            return
+        if self._pool is None:
+            self._pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+        self._pending.append((self._pool.submit(render_variants, source, outputs), publish))
+
+    def close(self) -> None:
+        """Wait for the queued variants to be generated, publish them and shut the pool down."""
+        for future, publish in self._pending:
+            self.bytes_out += future.result()
+            self.generated += len(publish)
+            for path, target in publish:
+                self._publish(path, target)
+        self._pending = []
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
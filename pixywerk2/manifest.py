@@ -0,0 +1,216 @@
+"""Persistent record of the outputs of a build, used to skip files whose inputs have not changed."""
+
+import hashlib
+import json
+import logging
+import os
+
+from typing import Dict, Iterable, List, Mapping, Optional
+
+from .dependencies import DependencyRecord
+from .fileindex import FileIndex
+from .metadata import Metadata
+from .utils import GlobMatches, replacing
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 2
+
+# Metadata keys which differ between builds without affecting the rendered output.
+VOLATILE_KEYS = frozenset(("globals", "filters", "build-time", "stat", "template-cache", "template-environments"))
+
+
+def file_digest(path: str, block_size: int = 1 << 20) -> str:
+    """Return the hex digest of the contents of a file.
+
+    Arguments:
+        path (str): The path of the file to hash.
+        block_size (int, optional): The size of the blocks to read the file in.
+
+    Returns:
+        str: the hex digest
+
+    """
+    hasher = hashlib.sha1()
+    with open(path, "rb") as infile:
+        for block in iter(lambda: infile.read(block_size), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def metadata_digest(metadata: Mapping) -> str:
+    """Return a stable hex digest of a merged metadata blob, ignoring volatile keys.
+
+    Arguments:
+        metadata (dict): The metadata for a file, as returned by MetaTree.get_metadata.
+
+    Returns:
+        str: the hex digest
+
+    """
+    if isinstance(metadata, Metadata):
+        # the derived fields are determined by the stored ones, so they need not be computed
+        metadata = metadata.stored()
+    blob = {key: metadata[key] for key in metadata if key not in VOLATILE_KEYS}
+    encoded = json.dumps(blob, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha1(encoded).hexdigest()
+
+
+class BuildManifest:
+    """Records, for each output, the inputs that produced it so unchanged files can be skipped on rebuild.
+
+    Besides its own source, an output records every file (templates, ``.meta`` files, embedded sources) and every
+    ``get_file_list`` glob its rendering touched, so a change to any of those rebuilds exactly the outputs that
+    depend on it.
+    """
+
+    def __init__(self, path: str, root: str, output: str, index: Optional[FileIndex] = None):
+        """Initialize the manifest, loading the previous state if it exists.
+
+        Arguments:
+            path (str): The path of the manifest file.
+            root (str): The root of the source tree.
+            output (str): The root of the output tree.
+            index (FileIndex, optional): An index of the source tree to answer stat and glob queries from.
+
+        """
+        self._path = path
+        self._root = root
+        self._output = output
+        self._index = index
+        self._entries: Dict[str, Dict] = {}
+        self._signatures: Dict[str, Optional[List]] = {}
+        self._matches = GlobMatches(root, index)
+        self.load()
+
+    def new_build(self) -> None:
+        """Forget the file signatures and glob matches seen so far, at the start of another build in this process."""
+        self._signatures = {}
+        self._matches.clear()
+
+    def load(self) -> None:
+        """Load the manifest from disk, discarding it if it is unreadable or from another version."""
+        self._entries = {}
+        try:
+            with open(self._path, "r", encoding="utf-8") as infile:
+                state = json.load(infile)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logger.warning("ignoring unreadable build manifest %s", self._path)
+            return
+        if state.get("version") != MANIFEST_VERSION:
+            return
+        self._entries = state.get("outputs", {})
+
+    def save(self) -> None:
+        """Write the manifest to disk atomically."""
+        state = {"version": MANIFEST_VERSION, "outputs": self._entries}
+        with replacing(self._path) as tmp_path, open(tmp_path, "w", encoding="utf-8") as outfile:
+            json.dump(state, outfile, sort_keys=True)
+
+    def is_current(self, output_name: str, source_name: str, chain_type: str, meta_digest: str) -> bool:
+        """Determine if an output is up to date with respect to its recorded inputs.
+
+        The source is only hashed when its size matches but its mtime does not, so touched-but-unchanged files are
+        still skipped.
+
+        Arguments:
+            output_name (str): The path of the output, relative to the output root.
+            source_name (str): The path of the source, relative to the source root.
+            chain_type (str): The processor chain type used to build the output.
+            meta_digest (str): The digest of the merged metadata for the source.
+
+        Returns:
+            bool: True if the output can be skipped.
+
+        """
+        entry = self._entries.get(output_name)
+        if entry is None:
+            return False
+        if entry["source"] != source_name or entry["chain"] != chain_type or entry["metadata"] != meta_digest:
+            return False
+        if not os.path.exists(os.path.join(self._output, output_name)):
+            return False
+        st = self._source_stat(source_name)
+        if entry["size"] != st.st_size:
+            return False
+        if entry["mtime"] != st.st_mtime:
+            if entry["hash"] is None or entry["hash"] != file_digest(os.path.join(self._root, source_name)):
+                return False
+            entry["mtime"] = st.st_mtime
+        return self._dependencies_current(entry)
+
+    def _source_stat(self, source_name: str) -> os.stat_result:
+        if self._index is not None:
+            return self._index.stat(source_name)
+        return os.stat(os.path.join(self._root, source_name))
+
+    def _signature(self, path: str) -> Optional[List]:
+        # stat each dependency at most once per build, missing files have a signature of None
+        if path not in self._signatures:
+            if self._index is not None and self._index.covers(path):
+                found = self._index.get_os_path(path)
+                self._signatures[path] = None if found is None else [found.stat.st_mtime, found.stat.st_size]
+            else:
+                try:
+                    st = os.stat(path)
+                    self._signatures[path] = [st.st_mtime, st.st_size]
+                except FileNotFoundError:
+                    self._signatures[path] = None
+        return self._signatures[path]
+
+    def _dependencies_current(self, entry: Dict) -> bool:
+        for path, signature in entry.get("files", {}).items():
+            if self._signature(path) != signature:
+                return False
+        for pattern, matches in entry.get("globs", {}).items():
+            if self._matches.get(pattern) != matches:
+                return False
+        return True
+
+    def record(
+        self,
+        output_name: str,
+        source_name: str,
+        chain_type: str,
+        meta_digest: str,
+        deps: Optional[DependencyRecord] = None,
+        hash_source: bool = True,
+    ) -> None:
+        """Record the inputs for a freshly built output.
+
+        Arguments:
+            output_name (str): The path of the output, relative to the output root.
+            source_name (str): The path of the source, relative to the source root.
+            chain_type (str): The processor chain type used to build the output.
+            meta_digest (str): The digest of the merged metadata for the source.
+            deps (DependencyRecord, optional): The files and globs touched while rendering the output.
+            hash_source (bool, optional): Whether to hash the source; large passthrough files are not hashed, so
+                touching them republishes them (which is cheap when the output is already current).
+
+        """
+        source_path = os.path.join(self._root, source_name)
+        st = self._source_stat(source_name)
+        self._entries[output_name] = {
+            "source": source_name,
+            "mtime": st.st_mtime,
+            "size": st.st_size,
+            "hash": file_digest(source_path) if hash_source else None,
+            "chain": chain_type,
+            "metadata": meta_digest,
+        }
+        if deps is not None:
+            self._entries[output_name]["files"] = {x: self._signature(x) for x in sorted(deps.files)}
+            self._entries[output_name]["globs"] = {x: self._matches.get(x) for x in sorted(deps.globs)}
+
+    def prune(self, seen: Iterable[str]) -> None:
+        """Forget outputs which were not encountered in the latest build.
+
+        Arguments:
+            seen (iterable): The output names which are still produced by the source tree.
+
+        """
+        keep = set(seen)
+        for output_name in [x for x in self._entries if x not in keep]:
+            del self._entries[output_name]
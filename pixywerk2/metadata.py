@@ -1,15 +1,21 @@
 """Constructs a tree-like object containing the metadata for a given path, and caches said metadata."""
 
+import collections.abc
 import fnmatch
 import logging
 import mimetypes
 import os
+import re
+import stat
 import uuid
 
-from typing import Dict, Optional, Union, List, Tuple, Any, cast
+from typing import Callable, Dict, Iterator, Optional, Set, Union, List, Tuple, Any
 
 import jstyleson
 
+from . import profiler
+from .dependencies import record_file, record_value
+from .fileindex import FileIndex
 from .utils import guess_mime
 
 # setup mimetypes with some extra ones
@@ -25,16 +31,10 @@ class MetaCacheMiss(Exception):
 
 
 class MetaCache:
-    """This class provides an in-memory cache for metadata tree."""
+    """This class provides an in-memory cache for parsed metadata files, validated by their modification time."""
 
-    def __init__(self, max_age: float = 200.0):
-        """Initialize the cache.
-
-        Arguments:
-            max_age (int): the number of seconds to age-out cache items
-
-        """
-        self._max_age = max_age
+    def __init__(self) -> None:
+        """Initialize the cache."""
         self._cache: Dict[str, Tuple[float, Any]] = {}
 
     def get(self, key: str, new_time_stamp: float) -> Any:
@@ -42,19 +42,19 @@ class MetaCache:
 
         Arguments:
             key (str): the cache key to retieve
-            new_time_stamp (int): The time to use to compare the stored time with
+            new_time_stamp (int): The current modification time of the item's source
 
         Returns:
             :obj:misc: The previously stored value.
 
         Raises:
-            MetaCacheMiss: on missing key, or on aged out
+            MetaCacheMiss: on missing key, or if the source has been modified since the item was stored
 
         """
         if key not in self._cache:
             raise MetaCacheMiss("no item for key {}".format(key))
 
-        if self._cache[key][0] + self._max_age <= new_time_stamp:
+        if new_time_stamp <= self._cache[key][0]:
             return self._cache[key][1]
 
         raise MetaCacheMiss("cache expired for key {}".format(key))
@@ -65,21 +65,225 @@ class MetaCache:
         Arguments:
             key (str): the key to store the cache item under
             value (:obj:misc): the value to store
-            time_stamp (float): the time stamp to store the item under
+            time_stamp (float): the modification time of the item's source
 
         """
         self._cache[key] = (time_stamp, value)
 
 
+class _DirectoryMetadata:
+    """The merged metadata for a directory, along with what is needed to validate and apply it."""
+
+    __slots__ = ("generation", "stamp", "blob", "wildcards", "meta_paths")
+
+    def __init__(self, generation: int, stamp: Tuple, blob: Dict, meta_paths: Tuple[str, ...]):
+        self.generation = generation
+        self.stamp = stamp
+        self.blob = blob
+        self.meta_paths = meta_paths
+        self.wildcards: List[Tuple[Callable, Dict]] = []
+        for wild in blob.get("wildcard_metadata", []):
+            pattern = re.compile(fnmatch.translate(os.path.normcase(wild[0])))
+            self.wildcards.append((pattern.match, wild[1]))
+
+
+_EMPTY: Dict = {}
+
+STAT_FIELDS = ("st_mtime", "st_ctime", "st_atime", "st_mode", "st_size", "st_ino")
+
+# fields derived from the path of a file, computed on first access; they take precedence over stored values, except
+# mime-type which only applies when no metadata sets it
+DERIVED = ("dir", "file_name", "file_path", "relpath", "uuid", "os-path", "guessed-type", "mime-type", "stat")
+_DERIVED = frozenset(DERIVED)
+# derived fields which describe the file itself rather than its path, so whatever reads them depends on the file
+_FROM_FILE = frozenset(("guessed-type", "stat"))
+# volatile fields (see manifest.VOLATILE_KEYS) which are left out of the metadata digest but can be shown by a
+# template, so their values are recorded when read (see volatile_name)
+_RECORDED = frozenset(("build-time", "stat"))
+
+
+def stat_fields(st: os.stat_result) -> Dict:
+    """Return the ``stat`` field of the metadata of a file.
+
+    Arguments:
+        st (os.stat_result): The stat result of the file.
+
+    Returns:
+        dict: the fields in STAT_FIELDS, without their ``st_`` prefix.
+
+    """
+    return {x.replace("st_", ""): getattr(st, x) for x in STAT_FIELDS}
+
+
+def volatile_name(key: str, ospath: str) -> str:
+    """Return the name the value of a volatile field is recorded under: the key, qualified by the file for ``stat``.
+
+    Arguments:
+        key (str): The metadata key.
+        ospath (str): The native path of the file the metadata belongs to.
+
+    Returns:
+        str: the name to pass to dependencies.record_value.
+
+    """
+    return "stat:" + os.path.normpath(ospath) if key == "stat" else key
+
+
+class Metadata(collections.abc.MutableMapping):
+    """The metadata of a file, as a read-through mapping over its layers.
+
+    Values set on the mapping come first, then the file's own layer (matching ``wildcard_metadata`` and its own
+    ``.meta``), then the merged metadata of its directory, which is shared by every file in it rather than copied. The
+    fields in DERIVED are computed when first read and kept.
+    """
+
+    __slots__ = ("_values", "_own", "_parent", "_hidden", "_tree", "_rel_path", "_ospath", "_stat")
+
+    def __init__(self, tree: "MetaTree", rel_path: str, ospath: str, st: os.stat_result, parent: Dict, own: Dict):
+        """Initialize the metadata.
+
+        Arguments:
+            tree (MetaTree): The tree the file belongs to.
+            rel_path (str): The path of the file, relative to the root.
+            ospath (str): The native path of the file.
+            st (os.stat_result): The stat result of the file.
+            parent (dict): The merged metadata of the file's directory (not modified).
+            own (dict): The metadata specific to the file (not modified).
+
+        """
+        self._values: Dict = {}
+        self._own = own
+        self._parent = parent
+        self._hidden: Set[str] = set()
+        self._tree = tree
+        self._rel_path = rel_path
+        self._ospath = ospath
+        self._stat = st
+
+    def _stored(self, key: str) -> bool:
+        return key in self._own or key in self._parent
+
+    def __getitem__(self, key: str) -> Any:
+        if key in _FROM_FILE:
+            record_file(self._ospath)
+        value = self._get(key)
+        if key in _RECORDED:
+            record_value(volatile_name(key, self._ospath), value)
+        return value
+
+    def _get(self, key: str) -> Any:
+        if key in self._values:
+            return self._values[key]
+        if key in self._hidden:
+            raise KeyError(key)
+        if key in _DERIVED and (key != "mime-type" or not self._stored(key)):
+            value = self._values[key] = self._derive(key)
+            return value
+        if key in self._own:
+            return self._own[key]
+        return self._parent[key]
+
+    def __contains__(self, key: object) -> bool:
+        if key in self._values:
+            return True
+        if key in self._hidden:
+            return False
+        return key in _DERIVED or key in self._own or key in self._parent
+
+    def _derive(self, key: str) -> Any:
+        if key == "dir":
+            return os.path.dirname(self._rel_path)
+        if key == "file_name":
+            return os.path.basename(self._rel_path)
+        if key == "file_path":
+            return self._rel_path
+        if key == "relpath":
+            return os.path.relpath("/", "/" + self["dir"])
+        if key == "uuid":
+            return uuid.uuid3(uuid.NAMESPACE_OID, self["uuid-oid-root"] + self._ospath)
+        if key == "os-path":
+            return os.path.dirname(self._ospath)
+        if key == "guessed-type":
+            return guess_mime(self._ospath, self._tree._index)  # pylint: disable=protected-access
+        if key == "mime-type":
+            return self["guessed-type"]
+        return stat_fields(self._stat)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self._values[key] = value
+        self._hidden.discard(key)
+
+    def __delitem__(self, key: str) -> None:
+        if key not in self:
+            raise KeyError(key)
+        self._values.pop(key, None)
+        self._hidden.add(key)
+
+    def __iter__(self) -> Iterator[str]:
+        seen: Set[str] = set()
+        for layer in (self._parent, self._own, DERIVED, self._values):
+            for key in layer:
+                if key not in seen and key not in self._hidden:
+                    seen.add(key)
+                    yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return "Metadata({!r})".format(self._rel_path)
+
+    def copy(self) -> Dict:
+        """Return a plain dictionary of every field, computing the derived ones."""
+        return dict(self)
+
+    def overlay(self, **values: Any) -> "Metadata":
+        """Return a copy with some fields set, which shares this metadata's layers and computes nothing.
+
+        Arguments:
+            values: The fields to set on the copy.
+
+        Returns:
+            Metadata: the copy; this metadata is not modified.
+
+        """
+        meta = Metadata(self._tree, self._rel_path, self._ospath, self._stat, self._parent, self._own)
+        meta._values = dict(self._values, **values)
+        meta._hidden = self._hidden - values.keys()
+        return meta
+
+    def stored(self) -> Dict:
+        """Return the fields which are not derived from the path of the file, without computing anything.
+
+        Returns:
+            dict: the merged stored fields, plus ``file_path`` and ``os-path`` which determine the derived fields.
+
+        """
+        blob = dict(self._parent)
+        blob.update(self._own)
+        blob.update((x, y) for x, y in self._values.items() if x not in _DERIVED)
+        for key in self._hidden:
+            blob.pop(key, None)
+        blob["file_path"] = self._rel_path
+        blob["os-path"] = os.path.dirname(self._ospath)
+        return blob
+
+
 class MetaTree:
-    """This provides an interface to loading and caching tree metadata for a given directory tree."""
+    """This provides an interface to loading and caching tree metadata for a given directory tree.
+
+    The merged metadata of each directory is memoized, and the metadata of a file is a Metadata mapping layered over
+    it, so retrieving the metadata for a file costs its own ``.meta`` file (if any), regardless of how deep it is in
+    the tree, and nothing is copied.
+    """
 
-    def __init__(self, root: str, default_metadata: Optional[Dict] = None):
+    def __init__(self, root: str, default_metadata: Optional[Dict] = None, index: Optional[FileIndex] = None):
         """Initialize the metadata tree object.
 
         Arguments:
             root (str): The path to the root of the file tree to operate on.
             default_metadata (dict, optional): The default metadata to apply to the tree
+            index (FileIndex, optional): An index of the tree to answer stat queries from instead of the filesystem
 
         """
         self._cache = MetaCache()
@@ -89,66 +293,107 @@ class MetaTree:
         if root[-1] != "/":
             root += "/"
         self._root = root
-
-    def get_metadata(self, rel_path: str) -> Dict:
+        self._index = index
+        self._dirs: Dict[str, _DirectoryMetadata] = {}
+        self._generation = 0
+
+    def new_build(self) -> None:
+        """Revalidate the memoized directory metadata (against the .meta mtimes) on next use."""
+        self._generation += 1
+
+    def _stat(self, rel_path: str) -> os.stat_result:
+        if self._index is not None:
+            return self._index.stat(rel_path)
+        return os.stat(os.path.join(self._root, rel_path))
+
+    def _load_meta(self, rel_path: str) -> Tuple[Dict, Optional[float]]:
+        path = os.path.join(self._root, rel_path)
+        try:
+            st_meta = self._stat(rel_path)
+        except FileNotFoundError:
+            return {}, None
+        try:
+            meta = self._cache.get(path, st_meta.st_mtime)
+            profiler.count("metadata.meta.hit")
+            return meta, st_meta.st_mtime
+        except MetaCacheMiss:
+            profiler.count("metadata.meta.miss")
+        with open(path, "r") as infile:
+            meta = jstyleson.load(infile)
+        self._cache.put(path, meta, st_meta.st_mtime)
+        return meta, st_meta.st_mtime
+
+    def _get_dir_metadata(self, rel_dir: str) -> _DirectoryMetadata:
+        entry = self._dirs.get(rel_dir)
+        if entry is not None and entry.generation == self._generation:
+            profiler.count("metadata.dir.hit")
+            return entry
+
+        if rel_dir:
+            parent = self._get_dir_metadata(os.path.dirname(rel_dir))
+            parent_blob, parent_stamp, parent_paths = parent.blob, parent.stamp, parent.meta_paths
+        else:
+            parent_blob, parent_stamp, parent_paths = self._default_metadata, (), ()
+
+        meta, mtime = self._load_meta(os.path.join(rel_dir, ".meta"))
+        stamp = parent_stamp + (mtime,)
+        if entry is not None and entry.stamp == stamp:
+            profiler.count("metadata.dir.hit")
+            entry.generation = self._generation
+            return entry
+        profiler.count("metadata.dir.miss")
+
+        blob = dict(parent_blob)
+        blob.update(meta)
+        meta_path = os.path.join(self._root, rel_dir, ".meta")
+        entry = _DirectoryMetadata(self._generation, stamp, blob, parent_paths + (meta_path,))
+        self._dirs[rel_dir] = entry
+        return entry
+
+    @profiler.profiled("get_metadata", "metadata")
+    def get_metadata(self, rel_path: str) -> Metadata:
         """Retrieve the metadata for a given path
 
-        The general procedure is to iterate the tree, at each level
-m        load .meta (JSON formatted dictionary) for that level, and
-        then finally load the path.meta, and merge these dictionaries
-        in descendant order.
+        The metadata of the containing directory (the default metadata merged with the .meta (JSON formatted
+        dictionary) of every level from the root down) is combined with any matching ``wildcard_metadata`` and
+        finally the path's own .meta.
 
         Arguments:
             rel_path (str): The path to retrieve the metadata for (relative to root)
 
         Returns:
-            dict: A dictionary of metadata for that path tree.
+            Metadata: A mapping of metadata for that path tree.
 
         """
-        metablob = dict(self._default_metadata)
-        # iterate path components from root to target path
-        comps = [self._root] + rel_path.split("/")
-        fullpath = ""
+        rel_path = rel_path.strip("/")
         ospath = os.path.join(self._root, rel_path)
-        for pth in comps:
-            fullpath = os.path.join(fullpath, pth)
-            st = os.stat(fullpath)
-
-            if os.path.isdir(fullpath):
-                cachekey = os.path.join(fullpath, ".meta")
+        own = _EMPTY
+        if not rel_path:
+            parent = self._get_dir_metadata("")
+            for meta_path in parent.meta_paths:
+                record_file(meta_path)
+            st = self._stat(rel_path)
+        else:
+            parent = self._get_dir_metadata(os.path.dirname(rel_path))
+            for meta_path in parent.meta_paths:
+                record_file(meta_path)
+
+            st = self._stat(rel_path)
+            name = os.path.normcase(os.path.basename(rel_path))
+            for match, wild_meta in parent.wildcards:
+                if match(name):
+                    if own is _EMPTY:
+                        own = {}
+                    own.update(wild_meta)
+
+            if stat.S_ISDIR(st.st_mode):
+                own_meta = os.path.join(rel_path, ".meta")
             else:
-                cachekey = fullpath + ".meta"
-            meta = cast(Dict, {})
-            try:
-                st_meta = os.stat(cachekey)
-                meta = self._cache.get(cachekey, st_meta.st_mtime)
-            except FileNotFoundError:
-                st_meta = None  # type: ignore
-            except MetaCacheMiss:
-                meta = {}
-
-            if not meta and st_meta:
-                meta = jstyleson.load(open(cachekey, "r"))
-                self._cache.put(cachekey, meta, st_meta.st_mtime)
-
-            if fullpath == ospath and "wildcard_metadata" in metablob:
-                for wild in metablob["wildcard_metadata"]:
-                    if fnmatch.fnmatch(pth, wild[0]):
-                        metablob.update(wild[1])
-
-            metablob.update(meta)
-
-        # return final dict
-        metablob["dir"], metablob["file_name"] = os.path.split(rel_path)
-        metablob["file_path"] = rel_path
-        metablob["relpath"] = os.path.relpath("/", "/" + metablob["dir"])
-        metablob["uuid"] = uuid.uuid3(uuid.NAMESPACE_OID, metablob["uuid-oid-root"] + ospath)
-        metablob["os-path"], _ = os.path.split(fullpath)
-        metablob["guessed-type"] = guess_mime(ospath)
-        if "mime-type" not in metablob:
-            metablob["mime-type"] = metablob["guessed-type"]
-        metablob["stat"] = {}
-        for stk in ("st_mtime", "st_ctime", "st_atime", "st_mode", "st_size", "st_ino"):
-            metablob["stat"][stk.replace("st_", "")] = getattr(st, stk)
-
-        return metablob
+                own_meta = rel_path + ".meta"
+            record_file(os.path.join(self._root, own_meta))
+            meta, _ = self._load_meta(own_meta)
+            if meta:
+                own = dict(own)
+                own.update(meta)
+
+        return Metadata(self, rel_path, ospath, st, parent.blob, own)
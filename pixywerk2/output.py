@@ -0,0 +1,68 @@
+"""Write processor chain output to disk in large binary chunks."""
+
+from typing import Any, Iterator
+
+from .utils import replacing
+
+DEFAULT_BUFFER_SIZE = 256 * 1024
+
+
+def iter_chunks(data: Any, buffer_size: int = DEFAULT_BUFFER_SIZE, encoding: str = "utf-8") -> Iterator[bytes]:
+    """Turn processor output into a stream of byte chunks of roughly ``buffer_size`` bytes.
+
+    Arguments:
+        data (misc): A str, bytes, or an iterable (a generator, a file object, a Jinja ``TemplateStream``...) of either.
+        buffer_size (int, optional): The target size of each chunk.
+        encoding (str, optional): The encoding to use for text.
+
+    Yields:
+        bytes: the next chunk
+
+    """
+    if isinstance(data, str):
+        data = data.encode(encoding)
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        view = memoryview(data)
+        for start in range(0, len(view), buffer_size):
+            end = start + buffer_size
+            yield bytes(view[start:end])
+        return
+
+    pending = []
+    pending_size = 0
+    for piece in data:
+        if isinstance(piece, str):
+            piece = piece.encode(encoding)
+        pending.append(piece)
+        pending_size += len(piece)
+        if pending_size >= buffer_size:
+            yield b"".join(pending)
+            pending = []
+            pending_size = 0
+    if pending:
+        yield b"".join(pending)
+
+
+def write_output(path: str, data: Any, buffer_size: int = DEFAULT_BUFFER_SIZE, encoding: str = "utf-8") -> int:
+    """Write processor output to a file, without holding more than about one buffer of it in memory.
+
+    The output is written to a temporary file next to the target and renamed over it, so an existing target is
+    replaced, never written through.
+
+    Arguments:
+        path (str): The path of the file to write.
+        data (misc): A str, bytes, or an iterable of either.
+        buffer_size (int, optional): The size of the chunks to write.
+        encoding (str, optional): The encoding to use for text.
+
+    Returns:
+        int: the number of bytes written
+
+    """
+    written = 0
+    # the target may be a hardlink to a source file (see assets.publish_asset), replace it rather than writing into it
+    with replacing(path) as tmp_path, open(tmp_path, "wb") as outfile:
+        for chunk in iter_chunks(data, buffer_size, encoding):
+            outfile.write(chunk)
+            written += len(chunk)
+    return written
@@ -1,26 +1,118 @@
 """Interface for chains of processors"""
 
+import importlib
 import os
 import os.path
-import random
+import re
 
-from typing import List, Iterable, Optional, Any, Dict, Type, cast
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Any, Dict, Sequence, Tuple, Type, Union, cast
 
 import yaml
 
-from .processors.processors import Processor
+from . import profiler
+from .dependencies import DependencyRecord, recording
+from .manifest import metadata_digest
+from .metadata import Metadata
+from .processors.processors import INPUT_TEXT, Processor, SourceFile, materialize, prepare_input
+from .rendercache import MAX_ENTRY_SIZE, RenderCache
+
+# a step of a chain configuration which branches off another chain type, e.g. ``split (fragment)``
+SPLIT_STEP = re.compile(r"^split\s*\(\s*([^()\s]+)\s*\)$")
+
+
+class Pipeline(NamedTuple):
+    """A chain type compiled from the configuration, shared by every file of that type."""
+
+    chain_type: str
+    # one stateless instance of each processor, shared by every chain
+    processors: Tuple[Processor, ...]
+    # every processor publishes its input unchanged, so the file never needs to be read
+    passthrough: bool
+    # ``fingerprint: true`` in the chain configuration
+    fingerprint: bool
+    # the configured processors which are not implemented
+    missing: Tuple[str, ...]
+    # (position, pipeline) of each ``split (chain)`` step: the pipeline continues from the output of the processors
+    # before the position, and publishes its own output
+    branches: Tuple[Tuple[int, "Pipeline"], ...] = ()
+    # ``suffix: name`` in the chain configuration, inserted before the extension of the output file name
+    suffix: Optional[str] = None
+
+
+class _Intermediate:
+    """The output of the first steps of a chain, as the input of a branch; computed when the branch is first read."""
+
+    __slots__ = ("_chain", "_position")
+
+    def __init__(self, chain: "ProcessorChain", position: int):
+        self._chain = chain
+        self._position = position
+
+    def value(self) -> Union[str, bytes]:
+        """Return the output, computing it if needed."""
+        return self._chain.intermediate(self._position)
+
+    def __iter__(self) -> Iterator[Union[str, bytes]]:
+        yield self.value()
+
+
+def _stored(output: Any, cache: RenderCache, key: str, deps: DependencyRecord) -> Iterator:
+    """Yield the output of the last step of a chain, and store it in the cache once it has all been yielded.
+
+    The output is only kept while it is text and shorter than rendercache.MAX_ENTRY_SIZE, and work the step does lazily
+    while its output is consumed is added to the step's dependencies.
+    """
+    pieces: Optional[List[str]] = []
+    size = 0
+    iterator = iter([output] if isinstance(output, (str, bytes, bytearray, memoryview)) else output)
+    while True:
+        with recording(deps):
+            try:
+                piece = next(iterator)
+            except StopIteration:
+                break
+        if pieces is not None:
+            size += len(piece)
+            if isinstance(piece, str) and size <= MAX_ENTRY_SIZE:
+                pieces.append(piece)
+            else:
+                pieces = None
+        yield piece
+    if pieces is not None:
+        cache.put(key, "".join(pieces), deps)
 
 
 class ProcessorChain:
     """This implements a wrapper for an arbitrary set of processors and an associated file stream."""
 
+    __slots__ = (
+        "_processors",
+        "_cache",
+        "_file_data",
+        "_file_type",
+        "_file_name",
+        "_ctx",
+        "_output_filename",
+        "_output_mime",
+        "_output_ext",
+        "_branches",
+        "_branch_chains",
+        "_start",
+        "_suffix",
+        "_intermediates",
+    )
+
     def __init__(
         self,
-        processors: List[Processor],
+        processors: Sequence[Processor],
         file_name: str,
         file_data: Iterable[str],
         file_type: str,
         ctx: Optional[Dict] = None,
+        cache: Optional[RenderCache] = None,
+        branches: Sequence[Tuple[int, Pipeline]] = (),
+        start: int = 0,
+        suffix: Optional[str] = None,
     ):
         """Initialize the processing stream.
 
@@ -28,15 +120,31 @@ class ProcessorChain:
              processors (list): A list of processor objects.
              file_data (Iterable): An iterable from which to retrieve the input
              file_type (str): the specified file type for consumer information.
+             cache (RenderCache, optional): A cache to look up and store the output of each step in.
+             branches (list, optional): (position, pipeline) of each chain which branches off this one.
+             start (int, optional): The number of leading processors whose output file_data already is (they still
+                 apply to the output name and type); set for branches.
+             suffix (str, optional): A suffix to insert before the extension of the output file name.
 
         """
         self._processors = processors
+        self._cache = cache
         self._file_data = file_data
         self._file_type = file_type
         self._file_name = file_name
         self._ctx: Dict = {}
         if ctx is not None:
             self._ctx = cast(Dict, ctx)
+        # the name transforms are computed on first use
+        self._output_filename: Optional[str] = None
+        self._output_mime: Optional[str] = None
+        self._output_ext: Optional[str] = None
+        self._branches = branches
+        self._branch_chains: Optional[List[ProcessorChain]] = None
+        self._start = start
+        self._suffix = suffix
+        # position -> the output of the processors before it, for the positions branches split off at
+        self._intermediates: Dict[int, Any] = {}
 
     @property
     def output(self) -> Iterable:
@@ -46,13 +154,133 @@ class ProcessorChain:
             :obj:'iterable': the iterable
 
         """
-        prev = self._file_data
-        for processor in self._processors:
+        # the steps before the last branch are shared with the branches, and only run once
+        position = max((self._start + x for x, _ in self._branches), default=self._start)
+        return self._run(self._processors[position:], self.intermediate(position))
+
+    def intermediate(self, position: int) -> Any:
+        """Return the output of the processors before a position, computing it at most once.
+
+        Arguments:
+            position (int): The position in the chain's processors.
+
+        Returns:
+            misc: the source (at the start of the chain), or the output as str or bytes.
+
+        """
+        if position == self._start:
+            return self._file_data
+        if position not in self._intermediates:
+            # keep the output at each split point on the way, for the branches which start there
+            stops = {self._start + x for x, _ in self._branches if self._start < self._start + x < position}
+            done, data = self._start, self._file_data
+            for stop in sorted(stops | {position}):
+                if stop not in self._intermediates:
+                    output = self._run(self._processors[done:stop], data)
+                    self._intermediates[stop] = materialize(output, self._ctx.get("encoding", "utf-8"))
+                done, data = stop, self._intermediates[stop]
+        return self._intermediates[position]
+
+    def _run(self, processors: Sequence[Processor], data: Any) -> Iterable:
+        if isinstance(data, _Intermediate):
+            data = data.value()
+        if self._cache is not None:
+            return self._cached_output(self._cache, processors, data)
+        if profiler.enabled():
+            return profiler.profile_chain(list(processors), data, self._ctx)
+        prev = data
+        encoding = self._ctx.get("encoding", "utf-8")
+        for processor in processors:
             if processor:
-                prev = processor.process(prev, self._ctx)
+                kind = getattr(processor, "input_kind", INPUT_TEXT)
+                prev = processor.process(prepare_input(prev, kind, encoding), self._ctx)
 
         return prev
 
+    def _cached_output(self, cache: RenderCache, processors: Sequence[Processor], data: Any) -> Iterable:
+        # each step's output but the last is materialized, since it is the input the next step is keyed by; the source
+        # itself is keyed by its raw bytes, and each step gets its input in the kind it asks for
+        meta_digest = metadata_digest(self._ctx)
+        encoding = self._ctx.get("encoding", "utf-8")
+        if not isinstance(data, (SourceFile, str, bytes)):
+            data = materialize(data, encoding)
+        steps = [x for x in processors if x]
+        for number, processor in enumerate(steps):
+            name = type(processor).__module__.rsplit(".", 1)[-1]
+            key = cache.key(name, data.buffer() if isinstance(data, SourceFile) else data, meta_digest)
+            output = cache.get(key)
+            if output is None:
+                kind = getattr(processor, "input_kind", INPUT_TEXT)
+                if number == len(steps) - 1:
+                    # the last step streams to the writer, and is stored once it has been consumed; its span covers
+                    # the work it does while its output is consumed
+                    deps = DependencyRecord()
+
+                    def stream() -> Iterable:
+                        with recording(deps):
+                            output = processor.process(prepare_input(data, kind, encoding), self._ctx)
+                        return _stored(output, cache, key, deps)
+
+                    return profiler.stream_span(name, "processor", stream, file=self._ctx.get("file_path"))
+                with profiler.span(name, "processor", file=self._ctx.get("file_path")), recording() as deps:
+                    output = materialize(processor.process(prepare_input(data, kind, encoding), self._ctx), encoding)
+                # entries are JSON, only text output is stored
+                if isinstance(output, str):
+                    cache.put(key, output, deps)
+            data = output
+        return data
+
+    @property
+    def branches(self) -> List["ProcessorChain"]:
+        """Return the chains which branch off this one, and off those in turn, each with its own output.
+
+        A branch starts from the output of the steps of this chain before its ``split`` step, which is computed once
+        for this chain and all its branches.
+
+        Returns:
+            list: the branch chains, in configuration order.
+
+        Raises:
+            NotImplementedError: if a branch uses a processor which is not implemented.
+
+        """
+        if self._branch_chains is None:
+            chains: List[ProcessorChain] = []
+            for position, pipeline in self._branches:
+                if pipeline.missing:
+                    raise NotImplementedError(
+                        "chain {} uses unimplemented processors: {}".format(
+                            pipeline.chain_type, ", ".join(pipeline.missing)
+                        )
+                    )
+                position += self._start
+                data = self._file_data if position == self._start else _Intermediate(self, position)
+                branch = ProcessorChain(
+                    tuple(self._processors[:position]) + pipeline.processors,
+                    self._file_name,
+                    data,
+                    pipeline.chain_type,
+                    self._ctx,
+                    self._cache,
+                    pipeline.branches,
+                    position,
+                    pipeline.suffix,
+                )
+                chains.append(branch)
+                chains.extend(branch.branches)
+            self._branch_chains = chains
+        return self._branch_chains
+
+    @property
+    def file_type(self) -> str:
+        """Return the chain type this chain was configured from
+
+        Returns:
+            str: the chain type
+
+        """
+        return self._file_type
+
     @property
     def output_mime(self) -> str:
         """Return the post-processed MIME value from the processing chain
@@ -61,10 +289,12 @@ class ProcessorChain:
             str: the mime type
 
         """
-        fname = self._file_name
-        for processor in self._processors:
-            fname = processor.mime_type(fname, self._ctx)
-        return fname
+        if self._output_mime is None:
+            fname = self._file_name
+            for processor in self._processors:
+                fname = processor.mime_type(fname, self._ctx)
+            self._output_mime = fname
+        return self._output_mime
 
     @property
     def output_ext(self) -> str:
@@ -73,10 +303,12 @@ class ProcessorChain:
         Returns:
             str: the extension
         """
-        fname = self._file_name
-        for processor in self._processors:
-            fname = processor.extension(fname, self._ctx)
-        return fname
+        if self._output_ext is None:
+            fname = self._file_name
+            for processor in self._processors:
+                fname = processor.extension(fname, self._ctx)
+            self._output_ext = fname
+        return self._output_ext
 
     @property
     def output_filename(self) -> str:
@@ -86,30 +318,45 @@ class ProcessorChain:
             str: the new filename
 
         """
-        fname = os.path.basename(self._file_name)
-        for processor in self._processors:
-            fname = processor.filename(fname, self._ctx)
-        return fname
+        if self._output_filename is None:
+            fname = os.path.basename(self._file_name)
+            for processor in self._processors:
+                fname = processor.filename(fname, self._ctx)
+            if self._suffix:
+                base, ext = os.path.splitext(fname)
+                fname = "{}.{}{}".format(base, self._suffix, ext)
+            self._output_filename = fname
+        return self._output_filename
 
 
 class ProcessorChains:
     """Load a configuration for processor chains, and provide ability to process the chains given a particular input
     file.
+
+    Each chain type is compiled once into a Pipeline, and every processor is instantiated once, so getting the chain
+    for a file only resolves its type. A ``split (chain)`` step in a chain branches off the named chain type at that
+    point (see ProcessorChain.branches).
     """
 
-    def __init__(self, config: Optional[str] = None):
+    def __init__(self, config: Optional[str] = None, cache: Optional[RenderCache] = None):
         """Initialize, with a specified configuration file
 
         Arguments:
             config (str, optional): The path to a yaml formatted configuration file.
+            cache (RenderCache, optional): A cache for the output of the steps of the chains.
 
         """
+        self.cache = cache
         if config is None:  # pragma: no coverage
             config = os.path.join(os.path.dirname(__file__), "defaults", "chains.yaml")
 
-        self.chainconfig = yaml.load(open(config, "r"))
+        self.chainconfig = yaml.safe_load(open(config, "r"))
         self.extensionmap: Dict[str, Any] = {}
         self.processors: Dict[str, Type[Processor]] = {}
+        self.pipelines: Dict[str, Pipeline] = {}
+        instances: Dict[str, Optional[Processor]] = {}
+        # chain type -> (processor names, (position, chain type) of each split)
+        steps: Dict[str, Tuple[List[str], List[Tuple[int, str]]]] = {}
         for ch, conf in self.chainconfig.items():
             if conf["extension"] == "default":
                 self.default = ch
@@ -120,21 +367,59 @@ class ProcessorChains:
                             # log an error or except or something we'll just override for now.
                             pass
                         self.extensionmap[ex] = ch
-            for pr in conf["chain"]:
+            names: List[str] = []
+            splits: List[Tuple[int, str]] = []
+            for pr in conf["chain"] or []:
+                split = SPLIT_STEP.match(pr)
+                if split:
+                    splits.append((len(names), split.group(1)))
+                    continue
+                names.append(pr)
                 if pr in self.processors:
                     continue
-                processor_module = __import__("processors", globals(), locals(), [pr], 1)
-                self.processors[pr] = processor_module.__dict__[pr].processor
-
-    def get_chain_for_filename(self, filename: str, ctx: Optional[Dict] = None) -> ProcessorChain:
-        """Get the ProcessorChain, as configured for a given file by extension.
-
-        Arguments:
-            filename (str): The name of the file to get a chain for.
+                self.processors[pr] = importlib.import_module(".processors." + pr, __package__).processor
+                # processor modules which are only placeholders define processor as None
+                instances[pr] = self.processors[pr]() if self.processors[pr] else None
+            steps[ch] = (names, splits)
+        for ch in self.chainconfig:
+            self._compile(ch, steps, instances, ())
+
+    def _compile(
+        self,
+        chain_type: str,
+        steps: Dict[str, Tuple[List[str], List[Tuple[int, str]]]],
+        instances: Dict[str, Optional[Processor]],
+        parents: Tuple[str, ...],
+    ) -> Pipeline:
+        # branches are compiled before the chains which split into them
+        if chain_type in self.pipelines:
+            return self.pipelines[chain_type]
+        if chain_type in parents:
+            raise ValueError("chain {} splits into itself".format(" -> ".join(parents + (chain_type,))))
+        names, splits = steps[chain_type]
+        branches = []
+        for position, branch_type in splits:
+            if branch_type not in steps:
+                raise ValueError("chain {} splits into unknown chain {}".format(chain_type, branch_type))
+            branch = self._compile(branch_type, steps, instances, parents + (chain_type,))
+            if position and branch.passthrough:
+                raise ValueError(
+                    "chain {} splits into passthrough chain {} after processing".format(chain_type, branch_type)
+                )
+            branches.append((position, branch))
+        conf = self.chainconfig[chain_type]
+        self.pipelines[chain_type] = Pipeline(
+            chain_type,
+            tuple(cast(Processor, instances[x]) for x in names),
+            bool(names) and all(getattr(instances[x], "passthrough", False) for x in names),
+            bool(conf.get("fingerprint")),
+            tuple(x for x in names if instances[x] is None),
+            tuple(branches),
+            conf.get("suffix"),
+        )
+        return self.pipelines[chain_type]
 
-        Returns:
-            ProcessorChain: the constructed processor chain.
-        """
+    def _file_ext(self, filename: str, ctx: Optional[Dict] = None) -> str:
         r = filename.rsplit(".", 1)
         ftype = "default"
         if r:
@@ -145,7 +430,101 @@ class ProcessorChains:
 
         if ctx and "type" in ctx:
             ftype = ctx["type"]
-        return self.get_chain_for_file(open(filename, "r"), ftype, filename, ctx)
+        return ftype
+
+    def _chain_type(self, file_ext: str) -> str:
+        if file_ext not in self.extensionmap or not self.extensionmap[file_ext]:
+            if file_ext in self.chainconfig:
+                return file_ext
+            return "default"
+        return self.extensionmap[file_ext]
+
+    def resolve_type(self, filename: str, ctx: Optional[Dict] = None) -> str:
+        """Get the chain type configured for a given file, without opening it.
+
+        Arguments:
+            filename (str): The name of the file.
+            ctx (dict, optional): The metadata for the file.
+
+        Returns:
+            str: the chain type.
+        """
+        return self._chain_type(self._file_ext(filename, ctx))
+
+    def is_passthrough(self, chain_type: str) -> bool:
+        """Determine if a chain type publishes its input unchanged, so the file never needs to be read.
+
+        Arguments:
+            chain_type (str): The chain type.
+
+        Returns:
+            bool: True if every processor in the chain is a passthrough.
+        """
+        return self.pipelines[chain_type].passthrough
+
+    def variants(self, chain_type: str, filename: str, ctx: Optional[Dict] = None) -> List:
+        """Get the resized variants the chain of a file declares (see processors.image_variants).
+
+        Arguments:
+            chain_type (str): The chain type of the file.
+            filename (str): The name of the file.
+            ctx (dict, optional): The metadata for the file.
+
+        Returns:
+            list: the variants, empty if the chain has no processor which declares any.
+        """
+        for processor in self.pipelines[chain_type].processors:
+            if hasattr(processor, "variants"):
+                return processor.variants(filename, ctx)
+        return []
+
+    def get_chain_for_filename(self, filename: str, ctx: Optional[Dict] = None) -> ProcessorChain:
+        """Get the ProcessorChain, as configured for a given file by extension.
+
+        Arguments:
+            filename (str): The name of the file to get a chain for.
+
+        Returns:
+            ProcessorChain: the constructed processor chain.
+        """
+        source = SourceFile(filename, ctx.get("encoding", "utf-8") if ctx else "utf-8")
+        return self.get_chain_for_file(source, self._file_ext(filename, ctx), filename, ctx)
+
+    def output_filename(self, filename: str, ctx: Optional[Dict] = None) -> str:
+        """Get the name a file is published under, from its path and metadata alone (the file is not opened).
+
+        Arguments:
+            filename (str): The path of the file.
+            ctx (dict, optional): The metadata for the file.
+
+        Returns:
+            str: the output file name (without its directory)
+        """
+        return self.get_chain_for_file((), self._file_ext(filename, ctx), filename, ctx).output_filename
+
+    def all_output_filenames(self, filename: str, ctx: Optional[Dict] = None) -> List[str]:
+        """Get the names of every output of a file, its own followed by those of its branches, without opening it.
+
+        Arguments:
+            filename (str): The path of the file.
+            ctx (dict, optional): The metadata for the file.
+
+        Returns:
+            list: the output file names (without their directory)
+        """
+        chain = self.get_chain_for_file((), self._file_ext(filename, ctx), filename, ctx)
+        return [chain.output_filename] + [x.output_filename for x in chain.branches]
+
+    def output_filenames(self, files: Iterable[Tuple[str, Optional[Dict]]]) -> List[str]:
+        """Get the names a list of files are published under, without opening any of them.
+
+        Arguments:
+            files (iterable): (path, metadata) for each file.
+
+        Returns:
+            list: the output file names, in the same order.
+        """
+        return [self.output_filename(path, ctx) for path, ctx in files]
 
     def get_chain_for_file(
         self, file_obj: Iterable, file_ext: str, file_name: Optional[str] = None, ctx: Optional[Dict] = None
@@ -159,22 +538,26 @@ class ProcessorChains:
         Returns:
             ProcessorChain: the constructed processor chain.
 
-        """
-        if file_ext not in self.extensionmap or not self.extensionmap[file_ext]:
-            if file_ext in self.chainconfig:
-                file_type = file_ext
-            else:
-                file_type = "default"
-        else:
-            file_type = self.extensionmap[file_ext]
+        Raises:
+            NotImplementedError: if the chain uses a processor which is not implemented.
 
-        if not (bool(file_name)):
-            file_name = hex(random.randint(0, 65536))
+        """
+        pipeline = self.pipelines[self._chain_type(file_ext)]
+        if pipeline.missing:
+            raise NotImplementedError(
+                "chain {} uses unimplemented processors: {}".format(pipeline.chain_type, ", ".join(pipeline.missing))
+            )
+        if ctx is not None and pipeline.fingerprint and "fingerprint" not in ctx:
+            # a chain can turn fingerprinting on for all its files, metadata can still turn it off
+            ctx = ctx.overlay(fingerprint=True) if isinstance(ctx, Metadata) else dict(ctx, fingerprint=True)
 
         return ProcessorChain(
-            [self.processors[x]() for x in self.chainconfig[file_type]["chain"]],
-            cast(str, file_name),
+            pipeline.processors,
+            file_name or "",
             file_obj,
-            file_type,
+            pipeline.chain_type,
             ctx,
+            self.cache,
+            pipeline.branches,
+            suffix=pipeline.suffix,
         )
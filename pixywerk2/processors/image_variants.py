@@ -0,0 +1,26 @@
+"""Publish images unchanged, along with the resized variants configured in their metadata."""
+
+from typing import Dict, List, Optional
+
+from .passthrough import PassThrough
+from ..images import Variant, variants_for
+
+
+class ImageVariants(PassThrough):
+    """A passthrough processor for images, which also declares the variants the build writes next to them."""
+
+    def variants(self, oldname: str, ctx: Optional[Dict] = None) -> List[Variant]:
+        """Return the variants of an image.
+
+        Arguments:
+            oldname (str): the name of the image.
+            ctx (dict, optional): A context object generated from the processor configuration
+
+        Returns:
+            list: the variants (see images.variants_for)
+
+        """
+        return variants_for(oldname, ctx)
+
+
+processor = ImageVariants
@@ -2,14 +2,17 @@
 
 from typing import Iterable, Optional, Dict, cast
 
-from jinja2 import Environment, FileSystemLoader
-
 from .passthrough import PassThrough
+from .processors import INPUT_TEXT, read_text
+from ..template_env import get_environment
 
 
 class Jinja2(PassThrough):
     """Pass the input stream through Jinja2 for scritable templating."""
 
+    passthrough = False
+    input_kind = INPUT_TEXT
+
     def process(self, input_file: Iterable, ctx: Optional[Dict] = None) -> Iterable:
         """Return an iterable object of the post-processed file.
 
@@ -22,11 +25,9 @@ class Jinja2(PassThrough):
             iterable: The post-processed output stream
         """
         ctx = cast(Dict, ctx)
-        template_env = Environment(loader=FileSystemLoader(ctx["templates"]), extensions=['jinja2.ext.do'])
-        template_env.globals.update(ctx["globals"])
-        template_env.filters.update(ctx["filters"])
-        tmpl = template_env.from_string("".join([x for x in input_file]))
-        return tmpl.render(metadata=ctx)
+        template_env = get_environment(ctx)
+        tmpl = template_env.cached_from_string(read_text(input_file))
+        return tmpl.generate(metadata=ctx)
 
 
 processor = Jinja2
@@ -6,9 +6,8 @@ import os
 
 from typing import Iterable, Optional, Dict, cast
 
-from jinja2 import Environment, FileSystemLoader
-
-from .processors import Processor
+from .processors import Processor, read_text
+from ..template_env import get_environment
 
 
 class Jinja2PageEmbed(Processor):
@@ -52,12 +51,10 @@ class Jinja2PageEmbed(Processor):
             iterable: The post-processed output stream
         """
         ctx = cast(Dict, ctx)
-        template_env = Environment(loader=FileSystemLoader(ctx["templates"]), extensions=['jinja2.ext.do'])
-        template_env.globals.update(ctx["globals"])
-        template_env.filters.update(ctx["filters"])
+        template_env = get_environment(ctx)
         tmpl = template_env.get_template(ctx["template"])
-        content = "".join([x for x in input_file])
-        return tmpl.render(content=content, metadata=ctx)
+        content = read_text(input_file)
+        return tmpl.generate(content=content, metadata=ctx)
 
     def extension(self, oldname: str, ctx: Optional[Dict] = None) -> str:
         """Return the mimetype of the post-processed file.
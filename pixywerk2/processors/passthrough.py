@@ -2,7 +2,8 @@
 
 import os
 
-from .processors import Processor, PassthroughException
+from .processors import INPUT_PATH, Processor, PassthroughException
+from ..fingerprint import content_digest, fingerprinted_name
 from ..utils import guess_mime
 from typing import Iterable, Optional, Dict, cast
 
@@ -10,6 +11,10 @@ from typing import Iterable, Optional, Dict, cast
 class PassThrough(Processor):
     """A simple passthrough processor that takes input and sends it to output."""
 
+    passthrough = True
+    # nothing is read, the file is published as it is
+    input_kind = INPUT_PATH
+
     def filename(self, oldname: str, ctx: Optional[Dict] = None) -> str:
         """Return the filename of the post-processed file.
 
@@ -21,6 +26,10 @@ class PassThrough(Processor):
             str: the new name for the file
 
         """
+        # only unprocessed files are fingerprinted, the name of a rendered file can't depend on its output
+        if self.passthrough and ctx and ctx.get("fingerprint") and os.path.basename(oldname) == ctx.get("file_name"):
+            digest = content_digest(os.path.join(ctx["os-path"], ctx["file_name"]))
+            return fingerprinted_name(oldname, digest)
         return oldname
 
     def mime_type(self, oldname: str, ctx: Optional[Dict] = None) -> str:
@@ -34,7 +43,11 @@ class PassThrough(Processor):
             str: the new mimetype of the file after processing
 
         """
-        result = cast(str, guess_mime(oldname))
+        if ctx and "guessed-type" in ctx and os.path.basename(oldname) == ctx.get("file_name"):
+            # already guessed (from the file index) while building the metadata
+            result = cast(str, ctx["guessed-type"])
+        else:
+            result = cast(str, guess_mime(oldname))
         if result == "directory":
             result = "DIR"
         return result
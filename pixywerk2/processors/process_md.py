@@ -1,13 +1,66 @@
 """Convert an MD stream into an HTML stream"""
 
+import hashlib
 import io
+import json
 import os
 
-from typing import Iterable, Optional, Dict
+from typing import Iterable, List, Optional, Dict, Tuple
 
 import markdown
 
-from .processors import Processor
+from .processors import Processor, read_text
+from .. import profiler
+from ..utils import LRUCache
+
+DEFAULT_EXTENSIONS = ["extra", "admonition", "wikilinks"]
+HTML_CACHE_SIZE = 1024
+
+# one converter per distinct extension configuration, reused (after a reset) for every document
+_converters: Dict[str, markdown.Markdown] = {}
+# converted HTML by a hash of the configuration and the source
+_html = LRUCache(HTML_CACHE_SIZE)
+
+
+def get_converter(extensions: List[str], configs: Dict) -> Tuple[str, markdown.Markdown]:
+    """Get the converter for an extension configuration, creating it (and loading its extensions) only once.
+
+    Arguments:
+        extensions (list): The names of the Markdown extensions to use.
+        configs (dict): The configuration of each extension, by name.
+
+    Returns:
+        tuple: a key identifying the configuration, and its converter.
+
+    """
+    key = json.dumps([extensions, configs], sort_keys=True)
+    if key not in _converters:
+        _converters[key] = markdown.Markdown(extensions=extensions, extension_configs=configs)
+    return key, _converters[key]
+
+
+def convert(source: str, extensions: List[str], configs: Dict) -> str:
+    """Convert Markdown to HTML, memoizing the result by a hash of the configuration and the source.
+
+    Arguments:
+        source (str): The Markdown source.
+        extensions (list): The names of the Markdown extensions to use.
+        configs (dict): The configuration of each extension, by name.
+
+    Returns:
+        str: the HTML.
+
+    """
+    key, converter = get_converter(extensions, configs)
+    digest = hashlib.sha1((key + "\0" + source).encode("utf-8")).hexdigest()
+    html = _html.get(digest)
+    if html is not None:
+        profiler.count("markdown.hit")
+        return html
+    profiler.count("markdown.miss")
+    html = converter.reset().convert(source)
+    _html.put(digest, html)
+    return html
 
 
 class MarkdownProcessor(Processor):
@@ -62,8 +115,13 @@ class MarkdownProcessor(Processor):
         Returns:
             iterable: The post-processed output stream
         """
-        md = u"".join([x for x in input_file])
-        return io.StringIO(markdown.markdown(md, extensions=["extra", "admonition", "wikilinks"]))
+        md = read_text(input_file)
+        extensions = DEFAULT_EXTENSIONS
+        configs: Dict = {}
+        if ctx:
+            extensions = ctx.get("markdown-extensions", DEFAULT_EXTENSIONS)
+            configs = ctx.get("markdown-extension-configs", {})
+        return io.StringIO(convert(md, extensions, configs))
 
 
 processor = MarkdownProcessor  # pylint: disable=invalid-name
@@ -1,6 +1,16 @@
 import abc
+import mmap
+import os
 
-from typing import Iterable, Optional, Dict
+from typing import Any, Iterable, Iterator, Optional, Dict, Union
+
+# what a processor's process() takes as input_file: an iterable of text, a bytes-like buffer, or the source's path
+INPUT_TEXT = "text"
+INPUT_BYTES = "bytes"
+INPUT_PATH = "path"
+
+# sources at least this large are mapped into memory instead of read
+MMAP_THRESHOLD = 1024 * 1024
 
 
 class PassthroughException(Exception):
@@ -11,7 +21,131 @@ class ProcessorException(Exception):  # pragma: no cover
     """A base exception class to be used by processor objects."""
 
 
+class SourceFile:
+    """The source file at the start of a chain, read (and decoded) at most once, and only when a processor asks."""
+
+    __slots__ = ("path", "encoding", "_data", "_text")
+
+    def __init__(self, path: str, encoding: str = "utf-8"):
+        """Initialize the source.
+
+        Arguments:
+            path (str): The path of the file.
+            encoding (str, optional): The encoding of the file's text.
+
+        """
+        self.path = path
+        self.encoding = encoding
+        self._data: Optional[Union[bytes, memoryview]] = None
+        self._text: Optional[str] = None
+
+    def buffer(self) -> Union[bytes, memoryview]:
+        """Return the content of the file, as a memoryview of a read-only mapping for large files.
+
+        Returns:
+            bytes: the content.
+
+        """
+        if self._data is None:
+            with open(self.path, "rb") as infile:
+                size = os.fstat(infile.fileno()).st_size
+                if size >= MMAP_THRESHOLD:
+                    self._data = memoryview(mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ))
+                else:
+                    self._data = infile.read()
+        return self._data
+
+    def text(self) -> str:
+        """Return the content of the file decoded with its encoding, in one piece.
+
+        Returns:
+            str: the text.
+
+        """
+        if self._text is None:
+            self._text = str(self.buffer(), self.encoding)
+        return self._text
+
+    def __iter__(self) -> Iterator[str]:
+        yield self.text()
+
+
+def read_text(input_file: Iterable) -> str:
+    """Return the whole of a processor's text input as a single string.
+
+    Arguments:
+        input_file (iterable): The input, a str, a SourceFile or an iterable of str.
+
+    Returns:
+        str: the text.
+
+    """
+    if isinstance(input_file, str):
+        return input_file
+    if isinstance(input_file, SourceFile):
+        return input_file.text()
+    return "".join(input_file)
+
+
+def materialize(output: Any, encoding: str = "utf-8") -> Union[str, bytes]:
+    """Return the whole of a processor's output in one piece, as text if it is all text and as bytes otherwise.
+
+    Arguments:
+        output (misc): A str, a bytes-like object, or an iterable of either.
+        encoding (str, optional): The encoding to convert text to bytes with, for output which mixes the two.
+
+    Returns:
+        str or bytes: the output.
+
+    """
+    if isinstance(output, (str, bytes)):
+        return output
+    if isinstance(output, (bytearray, memoryview)):
+        return bytes(output)
+    if isinstance(output, SourceFile):
+        return bytes(output.buffer())
+    pieces = list(output)
+    if all(isinstance(x, str) for x in pieces):
+        return "".join(pieces)
+    return b"".join(x.encode(encoding) if isinstance(x, str) else bytes(x) for x in pieces)
+
+
+def prepare_input(data: Any, kind: str, encoding: str = "utf-8") -> Any:
+    """Convert the input of a step of a chain into what its processor consumes.
+
+    Arguments:
+        data (misc): The source of the chain, or the output of the step before.
+        kind (str): The input kind of the processor (INPUT_TEXT, INPUT_BYTES or INPUT_PATH)
+        encoding (str, optional): The encoding to convert text to bytes with.
+
+    Returns:
+        misc: the input for the processor.
+
+    Raises:
+        ProcessorException: if a processor which takes a path is not the first in its chain.
+
+    """
+    if kind == INPUT_PATH:
+        if isinstance(data, SourceFile):
+            return data.path
+        raise ProcessorException("a processor which takes a path must be the first in its chain")
+    if kind == INPUT_BYTES:
+        if isinstance(data, SourceFile):
+            return data.buffer()
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            return data
+        return read_text(data).encode(encoding)
+    if isinstance(data, SourceFile):
+        return data.text()
+    return data
+
+
 class Processor(abc.ABC):  # pragma: no cover
+    # True if the processor publishes its input unchanged (see PassthroughException)
+    passthrough = False
+    # what process() takes as its input (INPUT_TEXT, INPUT_BYTES or INPUT_PATH), the chain converts it
+    input_kind = INPUT_TEXT
+
     def __init__(self, *args, **kwargs):
         """Initialize the class."""
 
@@ -59,7 +193,8 @@ class Processor(abc.ABC):  # pragma: no cover
         """Return an iterable object of the post-processed file.
 
         Arguments:
-            input_file (iterable): An input stream
+            input_file (iterable): An input stream (a str or an iterable of str, a bytes-like buffer, or the path of
+                the source, as declared by input_kind)
             ctx (dict, optional): A context object generated from the processor configuration
 
         Returns:
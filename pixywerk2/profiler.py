@@ -0,0 +1,306 @@
+"""Optional build profiling: timed spans, cache counters, a JSON report and a Chrome trace-event file.
+
+Profiling is off by default; every hook checks a single module flag before doing any work. Timestamps come from
+``time.perf_counter`` (CLOCK_MONOTONIC on Linux), so spans recorded in worker processes line up with the parent's.
+"""
+
+import collections
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .processors.processors import INPUT_TEXT, prepare_input
+
+# CPU time of the calling thread; time.thread_time is new in Python 3.7, before it the whole process is counted
+_cpu_time = getattr(time, "thread_time", time.process_time)
+
+_enabled = False
+_events: List[Dict] = []
+_counters: Dict[str, int] = collections.Counter()
+# (category, name) -> [calls, wall, cpu]
+_totals: Dict[Tuple[str, str], List[float]] = {}
+
+
+def enable(on: bool = True) -> None:
+    """Turn profiling on (or off)."""
+    global _enabled  # pylint: disable=global-statement
+    _enabled = on
+
+
+def enabled() -> bool:
+    """Return True if profiling is on."""
+    return _enabled
+
+
+def reset() -> None:
+    """Discard everything recorded so far."""
+    global _events, _counters, _totals  # pylint: disable=global-statement
+    _events = []
+    _counters = collections.Counter()
+    _totals = {}
+
+
+def record(
+    name: str, category: str, start: float, wall: float, cpu: float, args: Optional[Dict] = None, event: bool = True
+) -> None:
+    """Add a timed span to the totals and (optionally) to the trace.
+
+    Arguments:
+        name (str): The name of the span.
+        category (str): The category of the span (file, processor, template, metadata, build).
+        start (float): The perf_counter time the span started at.
+        wall (float): The wall time of the span, in seconds.
+        cpu (float): The CPU time of the span, in seconds.
+        args (dict, optional): Extra details for the trace event.
+        event (bool, optional): Whether to add a trace event, as well as adding to the totals.
+
+    """
+    totals = _totals.setdefault((category, name), [0, 0.0, 0.0])
+    totals[0] += 1
+    totals[1] += wall
+    totals[2] += cpu
+    if event:
+        _events.append(
+            {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": start * 1e6,
+                "dur": wall * 1e6,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": dict(args or {}, cpu_ms=cpu * 1e3),
+            }
+        )
+
+
+@contextlib.contextmanager
+def span(name: str, category: str, **args: Any) -> Iterator[None]:
+    """Time the body of the context as a span, if profiling is on.
+
+    Arguments:
+        name (str): The name of the span.
+        category (str): The category of the span.
+        **args: Extra details for the trace event.
+
+    """
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    cpu_start = _cpu_time()
+    try:
+        yield
+    finally:
+        record(name, category, start, time.perf_counter() - start, _cpu_time() - cpu_start, args)
+
+
+def stream_span(name: str, category: str, produce: Callable[[], Iterable], **args: Any) -> Iterable:
+    """Time a call which returns an iterable and the iteration of its result as a single span, if profiling is on.
+
+    The span is recorded once the iterable has been consumed, so it covers work done lazily, e.g. by a processor
+    whose output is streamed.
+
+    Arguments:
+        name (str): The name of the span.
+        category (str): The category of the span.
+        produce (callable): The call, which returns the iterable.
+        **args: Extra details for the trace event.
+
+    Returns:
+        iterable: the result of the call.
+
+    """
+    if not _enabled:
+        return produce()
+    start = time.perf_counter()
+    cpu_start = _cpu_time()
+    try:
+        iterable = produce()
+    finally:
+        acc = [time.perf_counter() - start, _cpu_time() - cpu_start]
+
+    def consume() -> Iterator:
+        try:
+            yield from _timed([iterable] if isinstance(iterable, (str, bytes)) else iterable, acc)
+        finally:
+            record(name, category, start, acc[0], acc[1], args)
+
+    return consume()
+
+
+def profiled(name: str, category: str = "template") -> Callable[[Callable], Callable]:
+    """Decorate a function so each call is timed as a span when profiling is on.
+
+    Arguments:
+        name (str): The name of the span.
+        category (str, optional): The category of the span.
+
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            cpu_start = _cpu_time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, category, start, time.perf_counter() - start, _cpu_time() - cpu_start)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name: str, amount: int = 1) -> None:
+    """Add to a counter (e.g. ``collection.hit``), if profiling is on."""
+    if _enabled:
+        _counters[name] += amount
+
+
+def _timed(iterable: Iterable, acc: List[float]) -> Iterator:
+    # accumulates the time spent producing each item into acc
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        cpu_start = _cpu_time()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            acc[0] += time.perf_counter() - start
+            acc[1] += _cpu_time() - cpu_start
+        yield item
+
+
+def profile_chain(processors: List[Any], data: Iterable, ctx: Dict) -> Iterable:
+    """Run a chain of processors, timing each step, including the work done lazily as its output is consumed.
+
+    Step ``i`` consumes the output of step ``i - 1`` within its own call or iteration, so its self time is the time
+    spent in its call and iteration minus the time spent iterating the output of the step before it.
+
+    Arguments:
+        processors (list): The processors of the chain.
+        data (iterable): The input of the chain.
+        ctx (dict): The metadata of the file being processed.
+
+    Returns:
+        iterable: The output of the chain.
+
+    """
+    steps = [x for x in processors if x]
+    calls = [[0.0, 0.0] for _ in steps]
+    iters = [[0.0, 0.0] for _ in steps]
+    starts = [0.0 for _ in steps]
+
+    def finish() -> None:
+        for i, processor in enumerate(steps):
+            wall = calls[i][0] + iters[i][0] - (iters[i - 1][0] if i else 0.0)
+            cpu = calls[i][1] + iters[i][1] - (iters[i - 1][1] if i else 0.0)
+            name = type(processor).__module__.rsplit(".", 1)[-1]
+            record(name, "processor", starts[i], wall, cpu, {"file": ctx.get("file_path")})
+
+    prev = data
+    for i, processor in enumerate(steps):
+        starts[i] = time.perf_counter()
+        cpu_start = _cpu_time()
+        kind = getattr(processor, "input_kind", INPUT_TEXT)
+        prev = processor.process(prepare_input(prev, kind, ctx.get("encoding", "utf-8")), ctx)
+        calls[i][0] += time.perf_counter() - starts[i]
+        calls[i][1] += _cpu_time() - cpu_start
+        if not isinstance(prev, (str, bytes)):
+            prev = _timed(prev, iters[i])
+
+    if isinstance(prev, (str, bytes)):
+        finish()
+        return prev
+
+    def consume(output: Iterable) -> Iterator:
+        try:
+            yield from output
+        finally:
+            finish()
+
+    return consume(prev)
+
+
+def drain() -> Dict:
+    """Return everything recorded so far and start again, to send the data of a worker process to its parent."""
+    data = {"events": _events, "counters": dict(_counters), "totals": list(_totals.items())}
+    reset()
+    return data
+
+
+def merge(data: Dict) -> None:
+    """Add the data drained from another process.
+
+    Arguments:
+        data (dict): The data returned by drain().
+
+    """
+    _events.extend(data["events"])
+    _counters.update(data["counters"])
+    for key, (calls, wall, cpu) in data["totals"]:
+        totals = _totals.setdefault(tuple(key), [0, 0.0, 0.0])
+        totals[0] += calls
+        totals[1] += wall
+        totals[2] += cpu
+
+
+def report() -> Dict:
+    """Summarize everything recorded.
+
+    Returns:
+        dict: the time spent in each file (slowest first), totals by category and name, and the counters.
+
+    """
+    files = [
+        {"file": x["args"].get("file"), "wall": x["dur"] / 1e6, "cpu": x["args"]["cpu_ms"] / 1e3, "pid": x["pid"]}
+        for x in _events
+        if x["cat"] == "file"
+    ]
+    files.sort(key=lambda x: x["wall"], reverse=True)
+    totals: Dict[str, Dict[str, Dict]] = {}
+    for (category, name), (calls, wall, cpu) in sorted(_totals.items()):
+        totals.setdefault(category, {})[name] = {"calls": calls, "wall": wall, "cpu": cpu}
+    return {"files": files, "totals": totals, "counters": dict(sorted(_counters.items()))}
+
+
+def write(report_path: str, trace_path: str) -> None:
+    """Write the JSON report and the Chrome trace-event file (for chrome://tracing or Perfetto).
+
+    Arguments:
+        report_path (str): The path of the report.
+        trace_path (str): The path of the trace.
+
+    """
+    with open(report_path, "w", encoding="utf-8") as outfile:
+        json.dump(report(), outfile, indent=2, default=str)
+    with open(trace_path, "w", encoding="utf-8") as outfile:
+        json.dump({"traceEvents": _events, "displayTimeUnit": "ms"}, outfile, default=str)
+
+
+def print_summary(top: int = 10) -> None:
+    """Print the slowest files and the time spent in each processor and template function."""
+    summary = report()
+    print("slowest files:")
+    for entry in summary["files"][:top]:
+        print("  {:8.2f}ms {:8.2f}ms cpu  {}".format(entry["wall"] * 1e3, entry["cpu"] * 1e3, entry["file"]))
+    for category in ("processor", "template", "metadata"):
+        for name, totals in sorted(summary["totals"].get(category, {}).items(), key=lambda x: -x[1]["wall"]):
+            print(
+                "{} {}: {} calls, {:.2f}ms ({:.2f}ms cpu)".format(
+                    category, name, totals["calls"], totals["wall"] * 1e3, totals["cpu"] * 1e3
+                )
+            )
+    for name, value in summary["counters"].items():
+        print("{}: {}".format(name, value))
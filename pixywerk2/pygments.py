@@ -1,36 +1,118 @@
-"""Map Pygments into the Template API for inclusion in outputs."""
-from typing import Optional
+"""Map Pygments into the Template API for inclusion in outputs.
+
+Styles, formatters and lexers are looked up once per distinct argument, highlighted fragments are memoized by a hash
+of the code, the lexer and the style (and, with ``pygments_highlighter``, kept on disk between builds), and the CSS for
+each style is generated once.
+"""
+
+import functools
+import hashlib
+import os
+
+from typing import Callable, Optional
 
 import pygments
 import pygments.formatters
+import pygments.lexer
 import pygments.lexers
 import pygments.util
 import pygments.styles
 
+from . import profiler
+from .utils import LRUCache, replacing
 
+# number of highlighted fragments kept in memory
+HIGHLIGHT_CACHE_SIZE = 4096
 
-def pygments_markup_contents_html(input_text: str, file_type: str, style: Optional[str]=None) -> str:
-    """Format input string with Pygments and return HTML."""
+_highlighted = LRUCache(HIGHLIGHT_CACHE_SIZE)
 
-    if style is None:
-        style = 'default'
-    style = pygments.styles.get_style_by_name(style)
-    formatter = pygments.formatters.get_formatter_by_name('html', style=style)
+
+@functools.lru_cache(maxsize=None)
+def _formatter(style: str) -> pygments.formatters.HtmlFormatter:
+    return pygments.formatters.get_formatter_by_name("html", style=pygments.styles.get_style_by_name(style))
+
+
+@functools.lru_cache(maxsize=256)
+def _lexer(file_type: str) -> pygments.lexer.Lexer:
     try:
-        lexer = pygments.lexers.get_lexer_for_filename(file_type)
+        return pygments.lexers.get_lexer_for_filename(file_type)
     except pygments.util.ClassNotFound:
         try:
-            lexer = pygments.lexers.get_lexer_by_name(file_type)
+            return pygments.lexers.get_lexer_by_name(file_type)
         except pygments.util.ClassNotFound:
-            lexer = pygments.lexers.get_lexer_by_mimetype(file_type)
+            return pygments.lexers.get_lexer_for_mimetype(file_type)
+
+
+def _highlight_key(input_text: str, file_type: str, style: str) -> str:
+    hasher = hashlib.sha1("{}\0{}\0{}\0".format(pygments.__version__, file_type, style).encode("utf-8"))
+    hasher.update(input_text.encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def pygments_markup_contents_html(input_text: str, file_type: str, style: Optional[str] = None) -> str:
+    """Format input string with Pygments and return HTML."""
+
+    if style is None:
+        style = "default"
+    key = _highlight_key(input_text, file_type, style)
+    html = _highlighted.get(key)
+    if html is not None:
+        profiler.count("pygments.hit")
+        return html
+    profiler.count("pygments.miss")
+    html = pygments.highlight(input_text, _lexer(file_type), _formatter(style))
+    _highlighted.put(key, html)
+    return html
+
+
+def pygments_highlighter(cache_dir: Optional[str] = None) -> Callable:
+    """Return a ``pygments_markup_contents_html`` which also keeps highlighted fragments on disk between builds.
+
+    Arguments:
+        cache_dir (str, optional): The directory to keep the fragments in (default: only memoize them in memory)
+
+    Returns:
+        function: the template function.
+
+    """
+    if not cache_dir:
+        return pygments_markup_contents_html
+    directory = cache_dir
+
+    def markup_contents_html(input_text: str, file_type: str, style: Optional[str] = None) -> str:
+        if style is None:
+            style = "default"
+        key = _highlight_key(input_text, file_type, style)
+        if key in _highlighted:
+            return pygments_markup_contents_html(input_text, file_type, style)
+        path = os.path.join(directory, key[:2], key[2:])
+        try:
+            with open(path, "r", encoding="utf-8") as infile:
+                html = infile.read()
+            # entries are pruned least recently used first, like the render cache
+            os.utime(path)
+            profiler.count("pygments.disk.hit")
+            _highlighted.put(key, html)
+            return html
+        except FileNotFoundError:
+            pass
+        html = pygments_markup_contents_html(input_text, file_type, style)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with replacing(path) as tmp_path, open(tmp_path, "w", encoding="utf-8") as outfile:
+            outfile.write(html)
+        return html
+
+    return markup_contents_html
+
+
+@functools.lru_cache(maxsize=None)
+def _css(style: str) -> str:
+    return _formatter(style).get_style_defs()
 
-    return pygments.highlight(input_text, lexer, formatter)
 
-def pygments_get_css(style: Optional[str]=None) -> str:
+def pygments_get_css(style: Optional[str] = None) -> str:
     """Return the CSS styles associated with a particular style definition."""
 
     if style is None:
-        style = 'default'
-    style = pygments.styles.get_style_by_name(style)
-    formatter = pygments.formatters.get_formatter_by_name('html', style=style)
-    return formatter.get_style_defs()
+        style = "default"
+    return _css(style)
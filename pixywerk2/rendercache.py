@@ -0,0 +1,247 @@
+"""A persistent, content-addressed cache of the output of each step of a processor chain.
+
+Each step is keyed by the processor, a hash of its input and a digest of the file's metadata, so a step whose input
+has not changed is not run again even when the steps after it must be (the ``jinja2`` and ``process_md`` output of a
+post survives a change to its page template). An entry also records the files and globs its step touched, with the
+content digest of each file and the matches of each glob, and the volatile values it read which are left out of the
+key (the build time, the stat of a file), and is only used while those are unchanged. The last step of a chain still
+streams its output to the writer, and its entry is written once that output has been consumed.
+
+Entries are JSON files under the cache directory; using an entry updates its mtime, so pruning removes the least
+recently used entries first.
+"""
+
+import hashlib
+import json
+import os
+
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from . import fingerprint, profiler
+from .dependencies import DependencyRecord, encode_value
+from .fileindex import FileIndex
+from .metadata import stat_fields
+from .utils import GlobMatches, replacing
+
+CACHE_VERSION = 2
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+# streamed output longer than this many characters is not kept for an entry
+MAX_ENTRY_SIZE = 16 * 1024 * 1024
+
+
+def _entries(path: str) -> List[Tuple[str, float, int]]:
+    # (path, time of last use, size) of every entry in a cache directory
+    found: List[Tuple[str, float, int]] = []
+    if not os.path.isdir(path):
+        return found
+    for shard in os.scandir(path):
+        if not shard.is_dir():
+            continue
+        for entry in os.scandir(shard.path):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                st = entry.stat()
+                # caches whose entries are published by copying mark their use in the access time only
+                found.append((entry.path, max(st.st_atime, st.st_mtime), st.st_size))
+    return found
+
+
+def stats(path: str) -> Dict:
+    """Summarize the contents of a render cache directory.
+
+    Arguments:
+        path (str): The cache directory.
+
+    Returns:
+        dict: the number of entries, their total size in bytes, and the last use of the oldest and newest entries.
+
+    """
+    entries = _entries(path)
+    return {
+        "entries": len(entries),
+        "bytes": sum(x[2] for x in entries),
+        "oldest": min((x[1] for x in entries), default=None),
+        "newest": max((x[1] for x in entries), default=None),
+    }
+
+
+def prune(path: str, max_size: int) -> Tuple[int, int]:
+    """Remove the least recently used entries of a render cache directory until it fits in a size limit.
+
+    Arguments:
+        path (str): The cache directory.
+        max_size (int): The size limit in bytes, 0 to remove every entry.
+
+    Returns:
+        tuple: the number of entries removed and the number of bytes freed.
+
+    """
+    entries = sorted(_entries(path), key=lambda x: x[1])
+    total = sum(x[2] for x in entries)
+    removed = 0
+    freed = 0
+    for entry_path, _, size in entries:
+        if total <= max_size:
+            break
+        try:
+            os.remove(entry_path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+        freed += size
+    return removed, freed
+
+
+class RenderCache:
+    """Stores and validates the output of processor chain steps on disk."""
+
+    def __init__(
+        self,
+        path: str,
+        root: str,
+        index: Optional[FileIndex] = None,
+        max_size: int = DEFAULT_MAX_SIZE,
+        lookup: bool = True,
+        values: Optional[Dict[str, Any]] = None,
+    ):
+        """Initialize the cache.
+
+        Arguments:
+            path (str): The directory to keep the entries in.
+            root (str): The root of the source tree, which recorded globs are relative to.
+            index (FileIndex, optional): An index of the source tree to answer glob queries from.
+            max_size (int, optional): The size in bytes prune() shrinks the cache to.
+            lookup (bool, optional): Whether to use existing entries; when False every step is run and its entry
+                rewritten (e.g. for a forced rebuild).
+            values (dict, optional): The current value of each volatile metadata field shared by the whole build
+                (e.g. ``build-time``), to check the values read by a step against.
+
+        """
+        self.path = path
+        self.max_size = max_size
+        self.lookup = lookup
+        self._root = root
+        self._index = index
+        self._values = values or {}
+        self._matches = GlobMatches(root, index)
+
+    def new_build(self) -> None:
+        """Forget the glob matches seen so far, at the start of another build in this process."""
+        self._matches.clear()
+
+    def key(self, processor: str, data: Union[str, bytes, memoryview], meta_digest: str) -> str:
+        """Return the key of a step.
+
+        Arguments:
+            processor (str): The name of the processor.
+            data (str): The input of the step, text or (for the source of a chain) its raw bytes.
+            meta_digest (str): The digest of the metadata of the file being processed.
+
+        Returns:
+            str: the hex key.
+
+        """
+        hasher = hashlib.sha1("{}\0{}\0{}\0".format(CACHE_VERSION, processor, meta_digest).encode("utf-8"))
+        hasher.update(data.encode("utf-8") if isinstance(data, str) else data)
+        return hasher.hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def _digest(self, path: str) -> Optional[str]:
+        try:
+            return fingerprint.content_digest(path)
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            return None
+
+    def _value(self, name: str) -> Optional[str]:
+        if name.startswith("stat:"):
+            path = name.split(":", 1)[1]
+            entry = self._index.get_os_path(path) if self._index is not None else None
+            try:
+                st = entry.stat if entry is not None else os.stat(path)
+            except FileNotFoundError:
+                return None
+            return encode_value(stat_fields(st))
+        if name in self._values:
+            return encode_value(self._values[name])
+        return None
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the output of a step, if it is cached and everything it depends on is unchanged.
+
+        The files and globs of a used entry are added to the active dependency recordings, as if the step had run.
+
+        Arguments:
+            key (str): The key of the step.
+
+        Returns:
+            str: the output, or None.
+
+        """
+        if not self.lookup:
+            return None
+        path = self._entry_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as infile:
+                entry = json.load(infile)
+        except (FileNotFoundError, ValueError):
+            profiler.count("render_cache.miss")
+            return None
+        if entry.get("version") != CACHE_VERSION or not self._current(entry):
+            profiler.count("render_cache.stale")
+            return None
+        profiler.count("render_cache.hit")
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        deps = DependencyRecord()
+        deps.files.update(entry["files"])
+        deps.globs.update(entry["globs"])
+        deps.values.update(entry["values"])
+        deps.replay()
+        return entry["output"]
+
+    def _current(self, entry: Dict) -> bool:
+        for path, digest in entry["files"].items():
+            if self._digest(path) != digest:
+                return False
+        for pattern, matches in entry["globs"].items():
+            if self._matches.get(pattern) != matches:
+                return False
+        for name, value in entry["values"].items():
+            if self._value(name) != value:
+                return False
+        return True
+
+    def put(self, key: str, output: str, deps: DependencyRecord) -> None:
+        """Store the output of a step.
+
+        Arguments:
+            key (str): The key of the step.
+            output (str): The output of the step.
+            deps (DependencyRecord): The files, globs and volatile values touched while running the step.
+
+        """
+        entry = {
+            "version": CACHE_VERSION,
+            "output": output,
+            "files": {x: self._digest(x) for x in sorted(deps.files)},
+            "globs": {x: self._matches.get(x) for x in sorted(deps.globs)},
+            "values": dict(sorted(deps.values.items())),
+        }
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # several worker processes may write the same entry, each writes its own file and renames it into place
+        with replacing(path) as tmp_path, open(tmp_path, "w", encoding="utf-8") as outfile:
+            json.dump(entry, outfile)
+
+    def prune(self) -> Tuple[int, int]:
+        """Remove the least recently used entries until the cache fits in its size limit.
+
+        Returns:
+            tuple: the number of entries removed and the number of bytes freed.
+
+        """
+        return prune(self.path, self.max_size)
@@ -0,0 +1,296 @@
+"""A development server which renders the page behind each request on demand, instead of building the whole site."""
+
+import http.server
+import logging
+import os
+import posixpath
+import shutil
+import socketserver
+import threading
+import traceback
+import urllib.parse
+
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple, Union
+
+from .build import Site
+from .dependencies import record_file, recording
+from .output import iter_chunks
+from .processors.processors import PassthroughException
+from .watch import changes, make_watcher
+
+logger = logging.getLogger(__name__)
+
+
+class Response(NamedTuple):
+    """A rendered page, with the dependencies which invalidate it."""
+
+    body: bytes
+    mime: str
+    files: Tuple[str, ...]
+    globs: Dict[str, List[str]]
+
+
+class Asset(NamedTuple):
+    """A file which is served straight from the source tree."""
+
+    path: str
+    mime: str
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """An HTTP server which handles each request in a thread (http.server only has one from Python 3.7)."""
+
+    daemon_threads = True
+
+
+def _under(path: str, changed: Set[str]) -> bool:
+    while True:
+        if path in changed:
+            return True
+        parent = os.path.dirname(path)
+        if parent == path:
+            return False
+        path = parent
+
+
+class OnDemandSite:
+    """Map URLs back to source files and render them one at a time, caching the results until their sources change.
+
+    Rendering is serialized behind a lock, since the metadata tree, collections and template caches of a Site are not
+    thread safe; cached pages and passthrough assets are served without taking it.
+    """
+
+    def __init__(self, site: Site):
+        """Initialize the server state.
+
+        Arguments:
+            site (Site): The site to render pages from.
+
+        """
+        self.site = site
+        self.lock = threading.RLock()
+        # output file name -> (source path, 0 for its own output or the number of the branch), for each directory
+        # looked up so far
+        self._dir_maps: Dict[str, Dict[str, Tuple[str, int]]] = {}
+        self._responses: Dict[str, Response] = {}
+
+    def _drop_dir_maps(self, rel_dir: str) -> None:
+        # the map of a directory and of every directory below it
+        prefix = os.path.join(rel_dir, "")
+        for key in [x for x in self._dir_maps if not rel_dir or x == rel_dir or x.startswith(prefix)]:
+            del self._dir_maps[key]
+
+    def invalidate(self, changed: Iterable[str]) -> None:
+        """Rescan the changed directories and forget the pages and output names which depend on the changed paths.
+
+        Arguments:
+            changed (iterable): The changed paths.
+
+        """
+        changed = {os.path.abspath(x) for x in changed}
+        root = os.path.abspath(self.site.root)
+        with self.lock:
+            self.site.refresh(changed)
+            for path in changed:
+                rel = os.path.relpath(path, root)
+                if rel == os.pardir or rel.startswith(os.pardir + os.sep):
+                    continue
+                if rel == os.curdir:
+                    self._dir_maps = {}
+                    break
+                rel_dir, name = os.path.split(rel)
+                if name == ".meta":
+                    # the metadata of a directory applies to every directory below it
+                    self._drop_dir_maps(rel_dir)
+                else:
+                    self._dir_maps.pop(rel_dir, None)
+                # the path may be a directory which was created or removed
+                self._drop_dir_maps(rel)
+            for key, response in list(self._responses.items()):
+                stale = any(_under(x, changed) for x in response.files)
+                if not stale:
+                    stale = any(self.site.index.glob(x) != matches for x, matches in response.globs.items())
+                if stale:
+                    del self._responses[key]
+
+    def _dir_map(self, rel_dir: str) -> Dict[str, Tuple[str, int]]:
+        if rel_dir not in self._dir_maps:
+            dir_map = {}
+            for name in self.site.index.listdir(rel_dir)[1]:
+                if name.endswith(".meta") or name.endswith("~"):
+                    continue
+                source_name = os.path.join(rel_dir, name)
+                names = self.site.process_chains.all_output_filenames(
+                    os.path.join(self.site.root, source_name), self.site.meta_tree.get_metadata(source_name)
+                )
+                for number, output_name in enumerate(names):
+                    dir_map[output_name] = (source_name, number)
+            self._dir_maps[rel_dir] = dir_map
+        return self._dir_maps[rel_dir]
+
+    def _resolve(self, rel_path: str) -> Optional[Tuple[str, int]]:
+        rel_dir, name = os.path.split(rel_path)
+        if not self.site.index.isdir(rel_dir):
+            return None
+        with self.lock:
+            return self._dir_map(rel_dir).get(name)
+
+    def resolve(self, rel_path: str) -> Optional[str]:
+        """Find the source file whose output has the given path.
+
+        Arguments:
+            rel_path (str): The path of the output, relative to the output root.
+
+        Returns:
+            str: the path of the source file relative to the root, or None if no source produces that output.
+
+        """
+        resolved = self._resolve(rel_path)
+        return resolved[0] if resolved else None
+
+    def get(self, rel_path: str) -> Union[Response, Asset, None]:
+        """Return the page or asset for an output path, rendering it if needed.
+
+        Arguments:
+            rel_path (str): The path of the output, relative to the output root.
+
+        Returns:
+            Response or Asset: the page, or None if no source produces that output.
+
+        """
+        response = self._responses.get(rel_path)
+        if response is not None:
+            return response
+
+        with self.lock:
+            resolved = self._resolve(rel_path)
+            if resolved is None:
+                return None
+            source_name, number = resolved
+            source_path = os.path.join(self.site.root, source_name)
+            with recording() as deps:
+                record_file(source_path)
+                metadata = self.site.meta_tree.get_metadata(source_name)
+                chain = self.site.get_chain(source_name, metadata)
+                if number:
+                    chain = chain.branches[number - 1]
+                if self.site.process_chains.is_passthrough(chain.file_type):
+                    return Asset(source_path, chain.output_mime)
+                try:
+                    body = b"".join(iter_chunks(chain.output, self.site.buffer_size))
+                except PassthroughException:
+                    return Asset(source_path, chain.output_mime)
+            response = Response(
+                body,
+                chain.output_mime,
+                tuple(os.path.abspath(x) for x in deps.files),
+                {x: self.site.index.glob(x) for x in deps.globs},
+            )
+            self._responses[rel_path] = response
+            return response
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """Answer GET and HEAD requests from an OnDemandSite."""
+
+    server_version = "pixywerk2"
+    pages: OnDemandSite
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """Serve a GET request."""
+        self._serve(True)
+
+    def do_HEAD(self) -> None:  # pylint: disable=invalid-name
+        """Serve a HEAD request."""
+        self._serve(False)
+
+    def _serve(self, send_body: bool) -> None:
+        url_path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        rel_path = posixpath.normpath(url_path).lstrip("/")
+        if rel_path == ".":
+            rel_path = ""
+        if rel_path.startswith(".."):
+            self.send_error(403)
+            return
+        if url_path.endswith("/") or not rel_path:
+            rel_path = posixpath.join(rel_path, "index.html")
+        elif self.pages.site.index.isdir(rel_path):
+            self.send_response(301)
+            self.send_header("Location", url_path + "/")
+            self.end_headers()
+            return
+
+        try:
+            found = self.pages.get(rel_path)
+        except Exception:  # pylint: disable=broad-except
+            body = traceback.format_exc().encode("utf-8")
+            logger.error("error rendering %s", rel_path, exc_info=True)
+            self._send(500, "text/plain; charset=utf-8", len(body))
+            if send_body:
+                self.wfile.write(body)
+            return
+
+        if found is None:
+            self.send_error(404)
+        elif isinstance(found, Asset):
+            with open(found.path, "rb") as infile:
+                self._send(200, found.mime, os.fstat(infile.fileno()).st_size)
+                if send_body:
+                    shutil.copyfileobj(infile, self.wfile)
+        else:
+            mime = found.mime + "; charset=utf-8" if found.mime.startswith("text/") else found.mime
+            self._send(200, mime, len(found.body))
+            if send_body:
+                self.wfile.write(found.body)
+
+    def _send(self, code: int, mime: str, length: int) -> None:
+        self.send_response(code)
+        self.send_header("Content-Type", mime)
+        self.send_header("Content-Length", str(length))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+
+def serve(
+    site: Site,
+    bind: str,
+    port: int,
+    watch: Iterable[str],
+    ignore: Iterable[str] = (),
+    polling: bool = False,
+    debounce: float = 0.1,
+) -> int:
+    """Serve a site over HTTP until interrupted, rendering pages as they are requested.
+
+    Arguments:
+        site (Site): The site to serve.
+        bind (str): The address to listen on.
+        port (int): The port to listen on.
+        watch (iterable): The directories to watch for changes.
+        ignore (iterable, optional): Paths whose changes are ignored.
+        polling (bool, optional): Watch by polling stat results instead of using inotify.
+        debounce (float, optional): How long to wait for a burst of changes to end, in seconds.
+
+    Returns:
+        int: the exit code.
+
+    """
+    pages = OnDemandSite(site)
+    handler = type("Handler", (RequestHandler,), {"pages": pages})
+    httpd = ThreadingHTTPServer((bind, port), handler)
+    watcher = make_watcher(watch, ignore, polling)
+
+    def invalidate() -> None:
+        for changed in changes(watcher, debounce):
+            pages.invalidate(changed)
+
+    threading.Thread(target=invalidate, name="pixywerk2-watch", daemon=True).start()
+    print("serving {} on http://{}:{}/".format(site.root, bind, httpd.server_address[1]))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        watcher.close()
+    return 0
@@ -0,0 +1,116 @@
+"""Jinja2 environments shared by the template processors of a site."""
+
+import hashlib
+import os
+
+from typing import Any, Dict
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, Template
+
+from . import profiler
+from .dependencies import record_file
+from .utils import LRUCache
+
+# number of compiled source pages (as opposed to page templates) kept in memory per environment
+STRING_CACHE_SIZE = 512
+
+
+class TrackingEnvironment(Environment):
+    """A Jinja2 environment which records every template file it loads as a dependency of the current output.
+
+    Includes, imports and extends all resolve through ``get_template`` or ``select_template``, so page templates and
+    everything they pull in are recorded.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._string_templates = LRUCache(STRING_CACHE_SIZE)
+
+    def get_template(self, *args: Any, **kwargs: Any) -> Any:
+        template = super().get_template(*args, **kwargs)
+        if template.filename:
+            record_file(template.filename)
+        return template
+
+    def select_template(self, *args: Any, **kwargs: Any) -> Any:
+        template = super().select_template(*args, **kwargs)
+        if template.filename:
+            record_file(template.filename)
+        return template
+
+    def cached_from_string(self, source: str) -> Template:
+        """Load a template from a string, compiling each distinct source only once.
+
+        Compiled templates are memoized in memory by a hash of their source, and their bytecode is also kept in the
+        bytecode cache (if any) so unchanged sources are not compiled again on the next build.
+
+        Arguments:
+            source (str): The template source.
+
+        Returns:
+            jinja2.Template: the compiled template.
+
+        """
+        key = hashlib.sha1(source.encode("utf-8")).hexdigest()
+        template = self._string_templates.get(key)
+        if template is not None:
+            profiler.count("template.string.hit")
+            return template
+        profiler.count("template.string.miss")
+
+        if self.bytecode_cache is not None:
+            bucket = self.bytecode_cache.get_bucket(self, key, None, source)
+            code = bucket.code
+            if code is None:
+                code = self.compile(source)
+                bucket.code = code
+                self.bytecode_cache.set_bucket(bucket)
+            template = self.template_class.from_code(self, code, self.make_globals(None), None)
+        else:
+            template = self.from_string(source)
+
+        self._string_templates.put(key, template)
+        return template
+
+
+def get_environment(ctx: Dict) -> TrackingEnvironment:
+    """Return the environment for the template directory, globals and filters of a file, creating it on first use.
+
+    Environments are kept in the ``template-environments`` dict of the metadata, which the Site shares between all
+    its files, so they live as long as the Site does. Without it, a new environment is made on each call.
+
+    Arguments:
+        ctx (dict): The metadata of the file.
+
+    Returns:
+        TrackingEnvironment: the shared environment.
+
+    """
+    templates, globals_, filters, cache_dir = (
+        ctx["templates"],
+        ctx["globals"],
+        ctx["filters"],
+        ctx.get("template-cache"),
+    )
+    environments = ctx.get("template-environments")
+    if environments is None:
+        environments = {}
+    # the environment holds on to the globals and filters, so their ids stay unique while it is kept
+    key = (
+        templates,
+        cache_dir,
+        tuple(sorted((name, id(value)) for name, value in globals_.items())),
+        tuple(sorted((name, id(value)) for name, value in filters.items())),
+    )
+    if key not in environments:
+        bytecode_cache = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(cache_dir)
+        template_env = TrackingEnvironment(
+            loader=FileSystemLoader(templates), extensions=["jinja2.ext.do"], bytecode_cache=bytecode_cache
+        )
+        template_env.globals.update(globals_)
+        template_env.filters.update(filters)
+        environments[key] = template_env
+    return environments[key]
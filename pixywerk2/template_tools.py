@@ -1,41 +1,31 @@
 import datetime
-import glob
-import itertools
 import os
 import pytz
-from typing import Callable, Dict, List, Iterable, Union, cast
+from typing import Callable, Dict, Iterable, List, Optional, Union
 
+from . import images, profiler
+from .collection import FileCollection
+from .content import ContentStore
+from .dependencies import record_file, record_glob, recording
 from .metadata import MetaTree
 from .processchain import ProcessorChains
 
 
-def file_list(root: str, listcache: Dict) -> Callable:
-    def get_file_list(path_glob: str, *, sort_order: str = "ctime", reverse: bool = False, limit: int = 0) -> Iterable:
-        stattable = cast(List, [])
-        if path_glob in listcache:
-            stattable = listcache[path_glob]
-        else:
-            for fil in glob.glob(os.path.join(root, path_glob)):
-                if os.path.isdir(fil):
-                    continue
-                if fil.endswith(".meta") or fil.endswith("~"):
-                    continue
-                st = os.stat(fil)
-                stattable.append(
-                    {
-                        "file_path": os.path.relpath(fil, root),
-                        "file_name": os.path.split(fil)[-1],
-                        "mtime": st.st_mtime,
-                        "ctime": st.st_ctime,
-                        "size": st.st_size,
-                        "ext": os.path.splitext(fil)[1],
-                    }
-                )
-            listcache[path_glob] = stattable
-        ret = sorted(stattable, key=lambda x: x[sort_order], reverse=reverse)
-        if limit > 0:
-            return itertools.islice(ret, limit)
-        return ret
+def file_list(collection: FileCollection) -> Callable:
+    def get_file_list(
+        path_glob: str,
+        *,
+        sort_order: str = "ctime",
+        reverse: bool = False,
+        limit: int = 0,
+        offset: int = 0,
+        where: Optional[Dict] = None,
+        contains: Optional[Dict] = None,
+    ) -> Iterable:
+        record_glob(path_glob)
+        return collection.query(
+            path_glob, sort_order, reverse=reverse, where=where, contains=contains, offset=offset, limit=limit
+        )
 
     return get_file_list
 
@@ -43,31 +33,107 @@ def file_list(root: str, listcache: Dict) -> Callable:
 def file_name(root: str, metatree: MetaTree, processor_chains: ProcessorChains, namecache: Dict) -> Callable:
     def get_file_name(file_name: str) -> Dict:
         if file_name in namecache:
-            return namecache[file_name]
-        metadata = metatree.get_metadata(file_name)
-        chain = processor_chains.get_chain_for_filename(os.path.join(root, file_name), ctx=metadata)
-        namecache[file_name] = chain.output_filename
-        return namecache[file_name]
+            profiler.count("file_name.hit")
+            namecache[file_name][1].replay()
+            return namecache[file_name][0]
+        profiler.count("file_name.miss")
+        with recording() as deps:
+            record_file(os.path.join(root, file_name))
+            metadata = metatree.get_metadata(file_name)
+            name = processor_chains.output_filename(os.path.join(root, file_name), metadata)
+        namecache[file_name] = (name, deps)
+        return namecache[file_name][0]
 
     return get_file_name
 
+
+def asset_url(root: str, metatree: MetaTree, processor_chains: ProcessorChains, urlcache: Dict) -> Callable:
+    def get_asset_url(file_name: str) -> str:
+        if file_name in urlcache:
+            profiler.count("asset_url.hit")
+            urlcache[file_name][1].replay()
+            return urlcache[file_name][0]
+        profiler.count("asset_url.miss")
+        with recording() as deps:
+            # the page must be rebuilt when the asset (and so its fingerprint) changes
+            record_file(os.path.join(root, file_name))
+            metadata = metatree.get_metadata(file_name)
+            name = processor_chains.output_filename(os.path.join(root, file_name), metadata)
+        urlcache[file_name] = (os.path.join(os.path.dirname(file_name), name), deps)
+        return urlcache[file_name][0]
+
+    return get_asset_url
+
+
+def image_variants(root: str, metatree: MetaTree, processor_chains: ProcessorChains) -> Callable:
+    def get_image_variants(file_name: str) -> List[Dict]:
+        # the page must be rebuilt when the image (and so the size of its variants) changes
+        record_file(os.path.join(root, file_name))
+        if not images.available():
+            return []
+        metadata = metatree.get_metadata(file_name)
+        chain_type = processor_chains.resolve_type(os.path.join(root, file_name), metadata)
+        variants = processor_chains.variants(chain_type, os.path.basename(file_name), metadata)
+        if not variants:
+            return []
+        size = images.image_size(os.path.join(root, file_name))
+        result = []
+        for variant in variants:
+            width, height = images.variant_size(size, variant)
+            name = images.variant_filename(os.path.basename(file_name), variant)
+            url = os.path.join(os.path.dirname(file_name), name)
+            result.append(
+                {
+                    "name": variant.name,
+                    "url": url,
+                    "width": width,
+                    "height": height,
+                    "type": "image/" + variant.format,
+                    "srcset": "{} {}w".format(url, width),
+                }
+            )
+        return result
+
+    return get_image_variants
+
+
+def image_size(root: str) -> Callable:
+    def get_image_size(file_name: str) -> Dict:
+        record_file(os.path.join(root, file_name))
+        if not images.available():
+            return {}
+        width, height = images.image_size(os.path.join(root, file_name))
+        return {"width": width, "height": height}
+
+    return get_image_size
+
+
 def file_raw(root: str, contcache: Dict) -> Callable:
     def get_raw(file_name: str) -> str:
+        record_file(os.path.join(root, file_name))
         if file_name in contcache:
             return contcache[file_name]
-        with open(os.path.join(root, file_name), 'r', encoding="utf-8") as f:
+        with open(os.path.join(root, file_name), "r", encoding="utf-8") as f:
             return f.read()
 
     return get_raw
 
-def file_content(root: str, metatree: MetaTree, processor_chains: ProcessorChains, contcache: Dict) -> Callable:
-    def get_file_content(file_name: str) -> Iterable:
-        if file_name in contcache:
-            return contcache[file_name]
-        metadata = metatree.get_metadata(file_name)
-        chain = processor_chains.get_chain_for_filename(os.path.join(root, file_name), ctx=metadata)
-        contcache[file_name] = chain.output
-        return str(chain.output)
+
+def file_content(root: str, metatree: MetaTree, processor_chains: ProcessorChains, store: ContentStore) -> Callable:
+    def get_file_content(file_name: str) -> str:
+        # content read back from the build's output doesn't carry its own source as a dependency
+        record_file(os.path.join(root, file_name))
+        output = store.lookup(file_name)
+        if output is not None:
+            profiler.count("file_content.hit")
+            return output
+        profiler.count("file_content.miss")
+        with store.rendering(file_name), recording() as deps:
+            metadata = metatree.get_metadata(file_name)
+            chain = processor_chains.get_chain_for_filename(os.path.join(root, file_name), ctx=metadata)
+            output = "".join(chain.output)
+        store.add(file_name, output, deps)
+        return output
 
     return get_file_content
 
@@ -87,10 +153,11 @@ def time_iso8601(timezone: str) -> Callable:
 
     return get_time_iso8601
 
+
 def date_iso8601(timezone: str) -> Callable:
     tz = pytz.timezone(timezone)
 
     def get_date_iso8601(time_t: Union[int, float]) -> str:
-        return datetime.datetime.fromtimestamp(time_t, tz).strftime('%Y-%m-%d')
+        return datetime.datetime.fromtimestamp(time_t, tz).strftime("%Y-%m-%d")
 
     return get_date_iso8601
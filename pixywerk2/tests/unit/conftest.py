@@ -0,0 +1,18 @@
+import pytest
+
+
+@pytest.fixture
+def make_tree(tmp_path):
+    """Return a function which writes files (relative path: text or bytes) under tmp_path and returns tmp_path."""
+
+    def make(files):
+        for name, content in files.items():
+            path = tmp_path / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if isinstance(content, bytes):
+                path.write_bytes(content)
+            else:
+                path.write_text(content)
+        return tmp_path
+
+    return make
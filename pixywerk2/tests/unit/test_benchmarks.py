@@ -0,0 +1,21 @@
+import os
+
+from pixywerk2.benchmarks.bench import compare
+from pixywerk2.benchmarks.sitegen import SiteShape, generate_site
+
+
+class TestBenchmarks:
+    def test_generate_site(self, tmp_path):
+        shape = SiteShape(pages=20, depth=2, fanout=2, meta_density=1.0, markdown_ratio=0.5, include_depth=3)
+        counts = generate_site(str(tmp_path), shape)
+        assert counts["pages"] == 20 and counts["directories"] == 7
+        assert counts["meta"] == 1 + 6 + 20
+        assert os.path.exists(tmp_path / "templates" / "partials" / "include_2.jinja2")
+        assert os.path.exists(tmp_path / "d0_1" / "d1_0" / "page5.md") or os.path.exists(
+            tmp_path / "d0_1" / "d1_0" / "page5.thtml"
+        )
+
+    def test_compare(self):
+        old = {"results": {"render": {"seconds": 2.0}, "gone": {"seconds": 1.0}}}
+        new = {"results": {"render": {"seconds": 1.0}, "added": {"seconds": 1.0}}}
+        assert compare(old, new) == [("render", 2.0, 1.0, -50.0)]
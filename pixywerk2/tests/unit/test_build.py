@@ -0,0 +1,91 @@
+import json
+import os
+import re
+
+import pytest
+
+from pixywerk2 import profiler
+from pixywerk2.__main__ import get_args
+from pixywerk2.build import Builder
+from pixywerk2.content import InclusionCycleError
+
+PAGES = {
+    "src/templates/default.jinja2": "<main>{{ content }}</main>",
+    "src/index.thtml": "{% for f in get_file_list('posts/*.md') %}{{ f.file_name }} {% endfor %}",
+    "src/style.css": "body {}",
+}
+PAGES.update({"src/posts/post-{}.md".format(n): "# post {}\n".format(n) for n in range(12)})
+
+
+def _tree(path):
+    return {
+        os.path.relpath(os.path.join(dirpath, name), str(path)): open(os.path.join(dirpath, name), "rb").read()
+        for dirpath, _, names in os.walk(str(path))
+        for name in names
+    }
+
+
+class TestBuilder:
+    def _build(self, tmp_path, *extra, out="out"):
+        args = get_args([str(tmp_path / "src"), str(tmp_path / out)] + list(extra))
+        assert Builder(args).run() == 0
+        return tmp_path / out
+
+    def test_feed_follows_post_stat(self, tmp_path, make_tree):
+        make_tree(
+            {
+                "src/templates/default.jinja2": "{{ content }}",
+                "src/post.md": "# post\n",
+                "src/feed.thtml": "{{ get_file_metadata('post.md').stat.size }}",
+            }
+        )
+        assert (self._build(tmp_path) / "feed.html").read_text() == "7"
+        with open(str(tmp_path / "src" / "post.md"), "a") as post:
+            post.write("more\n")
+        assert (self._build(tmp_path) / "feed.html").read_text() == "12"
+
+    def test_listing_follows_matched_files(self, tmp_path, make_tree):
+        make_tree(
+            {
+                "src/templates/default.jinja2": "{{ content }}",
+                "src/posts/a.md": "a\n",
+                "src/posts/b.md": "b\n",
+                "src/index.thtml": "{% for f in get_file_list('posts/*.md') %}{{ f.size }} {% endfor %}",
+            }
+        )
+        assert (self._build(tmp_path) / "index.html").read_text() == "2 2 "
+        (tmp_path / "src" / "posts" / "b.md").write_text("bbb\n")
+        assert (self._build(tmp_path) / "index.html").read_text() == "2 4 "
+
+    def test_jobs_match_serial_build(self, tmp_path, make_tree, capsys):
+        make_tree(PAGES)
+        serial = _tree(self._build(tmp_path, "-j", "1", out="serial"))
+        assert "worker" not in capsys.readouterr().out
+        parallel = _tree(self._build(tmp_path, "-j", "2", out="parallel"))
+        assert parallel == serial and len(serial) == len(PAGES)
+        counts = [int(x) for x in re.findall(r"^worker \d+: (\d+) files", capsys.readouterr().out, re.M)]
+        assert 1 <= len(counts) <= 2 and sum(counts) == len(PAGES)
+
+    def test_jobs_merge_profiles(self, tmp_path, make_tree):
+        make_tree(PAGES)
+        profiler.reset()
+        profiler.enable()
+        try:
+            self._build(tmp_path, "-j", "2", "--profile")
+        finally:
+            profiler.enable(False)
+            profiler.reset()
+        with open(str(tmp_path / "out.profile.json")) as infile:
+            report = json.load(infile)
+        assert sorted(x["file"] for x in report["files"]) == sorted(x.split("/", 1)[1] for x in PAGES)
+        assert report["totals"]["processor"]["jinja2"]["calls"] >= 13
+
+    def test_jobs_raise_render_errors(self, tmp_path, make_tree):
+        make_tree(PAGES)
+        make_tree({"src/a.cont": "{{ get_file_content('b.cont') }}", "src/b.cont": "{{ get_file_content('a.cont') }}"})
+        with pytest.raises(InclusionCycleError) as error:
+            self._build(tmp_path, "-j", "2")
+        # the error crossed a process boundary intact
+        cycle = error.value.cycle
+        assert sorted(cycle[:-1]) == ["a.cont", "b.cont"] and cycle[0] == cycle[-1]
+        assert str(error.value) == "inclusion cycle: " + " -> ".join(cycle)
@@ -0,0 +1,43 @@
+from pixywerk2.collection import FileCollection
+from pixywerk2.metadata import MetaTree
+from pixywerk2.processchain import ProcessorChains
+
+
+class TestFileCollection:
+    def _collection(self, make_tree, **kwargs):
+        posts = {
+            "a.md": '{"title": "Alpha", "post_time": 3, "tags": ["python"]}',
+            "b.md": '{"title": "Beta", "post_time": 1, "tags": ["rust"]}',
+            "c.md": '{"title": "Gamma", "post_time": 2, "tags": ["python", "rust"], "draft": true}',
+            "d.md": '{"title": "Delta"}',
+        }
+        files = {name + ".meta": meta for name, meta in posts.items()}
+        root = str(make_tree(dict(files, **{name: name for name in posts})))
+        return FileCollection(root, MetaTree(root, {"uuid-oid-root": "test"}), **kwargs)
+
+    def test_sort_by_metadata(self, make_tree):
+        collection = self._collection(make_tree)
+        titles = [x["metadata"]["title"] for x in collection.query("*.md", "post_time")]
+        assert titles == ["Beta", "Gamma", "Alpha", "Delta"]
+        titles = [x["metadata"]["title"] for x in collection.query("*.md", "post_time", reverse=True)]
+        assert titles == ["Alpha", "Gamma", "Beta", "Delta"]
+
+    def test_filters_and_slicing(self, make_tree):
+        collection = self._collection(make_tree)
+        names = [x["file_name"] for x in collection.query("*.md", "title", contains={"tags": "python"})]
+        assert names == ["a.md", "c.md"]
+        names = [x["file_name"] for x in collection.query("*.md", "title", where={"draft": True})]
+        assert names == ["c.md"]
+        names = [x["file_name"] for x in collection.query("*.md", "file_name", offset=1, limit=2)]
+        assert names == ["b.md", "c.md"]
+
+    def test_views_are_cached(self, make_tree):
+        collection = self._collection(make_tree)
+        assert collection.query("*.md", "title") == collection.query("*.md", "title")
+        assert collection.query("*.md", "title")[0] is collection.query("*.md", "title")[0]
+
+    def test_output_names(self, make_tree):
+        make_tree({"style.css": ""})
+        collection = self._collection(make_tree, processor_chains=ProcessorChains())
+        names = [x["output_name"] for x in collection.query("*", "file_name") if not x["file_name"].endswith(".meta")]
+        assert names == ["a.html", "b.html", "c.html", "d.html", "style.css"]
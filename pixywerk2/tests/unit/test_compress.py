@@ -0,0 +1,29 @@
+import gzip
+import os
+
+from pixywerk2.compress import Compressor, write_sidecars
+
+
+class TestCompress:
+    def test_sidecar_skipped_when_current(self, tmp_path):
+        page = tmp_path / "index.html"
+        page.write_text("<p>hello</p>" * 100)
+        read, written = write_sidecars(str(page), ["gzip"])
+        assert read == 1200 and 0 < written < read
+        assert gzip.decompress((tmp_path / "index.html.gz").read_bytes()) == page.read_bytes()
+        # no timestamp in the header, so rebuilding an output rewrites an identical sidecar
+        assert (tmp_path / "index.html.gz").read_bytes()[4:8] == b"\0\0\0\0"
+        assert write_sidecars(str(page), ["gzip"]) == (0, 0)
+
+    def test_allowlist_and_min_size(self, tmp_path):
+        (tmp_path / "big.html").write_text("x" * 1000)
+        (tmp_path / "small.html").write_text("x")
+        (tmp_path / "small.html.gz").write_bytes(b"stale")
+        (tmp_path / "image.png").write_bytes(b"x" * 1000)
+        compressor = Compressor(["gzip"], min_size=100)
+        compressor.submit(str(tmp_path / "big.html"), "text/html; charset=utf-8")
+        compressor.submit(str(tmp_path / "small.html"), "text/html")
+        compressor.submit(str(tmp_path / "image.png"), "image/png")
+        compressor.close()
+        assert compressor.files == 1
+        assert sorted(os.listdir(tmp_path)) == ["big.html", "big.html.gz", "image.png", "small.html"]
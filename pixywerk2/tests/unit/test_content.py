@@ -0,0 +1,44 @@
+import pickle
+
+import pytest
+
+from pixywerk2 import profiler
+from pixywerk2.build import Site
+from pixywerk2.content import InclusionCycleError
+
+
+class TestContentStore:
+    def _site(self, make_tree, files):
+        files = dict({"templates/default.jinja2": "<main>{{ content }}</main>"}, **files)
+        root = make_tree({"src/" + name: text for name, text in files.items()}) / "src"
+        return Site(str(root), str(root / "templates"))
+
+    def test_rendered_once(self, tmp_path, make_tree):
+        embed = "{{ get_file_content('post.md') }}"
+        site = self._site(make_tree, {"index.cont": embed, "other.cont": embed, "post.md": "*{{ 6 * 7 }}*\n"})
+        profiler.reset()
+        profiler.enable()
+        try:
+            site.render("index.cont", str(tmp_path / "index.html"))
+            site.render("post.md", str(tmp_path / "post.html"))
+            site.render("other.cont", str(tmp_path / "other.html"))
+            counters = profiler.report()["counters"]
+        finally:
+            profiler.enable(False)
+            profiler.reset()
+        assert (counters["file_content.miss"], counters["file_content.hit"]) == (1, 1)
+        post = (tmp_path / "post.html").read_text()
+        assert post == "<main><p><em>42</em></p></main>"
+        assert (tmp_path / "index.html").read_text() == "<main>{}</main>".format(post)
+        assert (tmp_path / "other.html").read_text() == "<main>{}</main>".format(post)
+
+    def test_cycle(self, tmp_path, make_tree):
+        site = self._site(
+            make_tree, {"a.cont": "{{ get_file_content('b.cont') }}", "b.cont": "{{ get_file_content('a.cont') }}"}
+        )
+        with pytest.raises(InclusionCycleError) as error:
+            site.render("a.cont", str(tmp_path / "a.html"))
+        assert error.value.cycle == ["a.cont", "b.cont", "a.cont"]
+        assert str(error.value) == "inclusion cycle: a.cont -> b.cont -> a.cont"
+        restored = pickle.loads(pickle.dumps(error.value))
+        assert restored.cycle == error.value.cycle and str(restored) == str(error.value)
@@ -0,0 +1,46 @@
+import shutil
+
+from pixywerk2.fileindex import FileIndex
+from pixywerk2.utils import glob_files, guess_mime
+
+
+class TestFileIndex:
+    def _tree(self, make_tree):
+        names = ["index.thtml", ".hidden", "style.css", "style.css~", "index.thtml.meta"]
+        names += ["posts/" + x for x in ("post-1.md", "post-2.md", "post-2.md.meta", "notes.txt")]
+        root = make_tree(dict({x: x for x in names}, **{"posts/drafts/post-3.md": "draft"}))
+        return FileIndex(str(root))
+
+    def test_glob_matches_filesystem(self, tmp_path, make_tree):
+        index = self._tree(make_tree)
+        for pattern in ("*", "posts/*", "posts/post-*.md", "*/*.md", "*/*/*", ".*", "index.thtml", "missing/*"):
+            assert index.glob(pattern) == glob_files(str(tmp_path), pattern)
+
+    def test_walk_and_mime(self, tmp_path, make_tree):
+        index = self._tree(make_tree)
+        walked = list(index.walk())
+        assert [x[0] for x in walked] == ["", "posts", "posts/drafts"]
+        assert walked[1][2] == ["notes.txt", "post-1.md", "post-2.md", "post-2.md.meta"]
+        assert index.isdir("posts")
+        assert index.mime("style.css") == "text/css"
+        assert guess_mime(str(tmp_path / "posts"), index) == "directory"
+        # answered from the index, so a file removed since the scan is still known
+        (tmp_path / "style.css").unlink()
+        assert guess_mime(str(tmp_path / "style.css"), index) == "text/css"
+        assert guess_mime(str(tmp_path / "missing.css"), index) == "application/octet-stream"
+
+    def test_update_rescans_changed_directories(self, tmp_path, make_tree):
+        index = self._tree(make_tree)
+        untouched = index.get("index.thtml")
+        posts = tmp_path / "posts"
+        (posts / "post-1.md.meta").write_text("{}")
+        shutil.rmtree(str(posts / "drafts"))
+        (posts / "series" / "part-1").mkdir(parents=True)
+        (posts / "series" / "part-1" / "index.md").write_text("part 1")
+        (posts / "series" / ".meta").write_text("{}")
+        index.update([str(posts / "post-1.md.meta"), str(posts / "drafts"), str(posts / "series")])
+        assert list(index.walk()) == list(FileIndex(str(tmp_path)).walk())
+        assert index.get("posts/drafts/post-3.md") is None
+        assert index.get("posts/post-1.md.meta") is not None
+        # the root was not rescanned
+        assert index.get("index.thtml") is untouched
@@ -0,0 +1,25 @@
+from pixywerk2.fingerprint import content_digest, fingerprinted_name
+from pixywerk2.metadata import MetaTree
+from pixywerk2.processchain import ProcessorChains
+
+
+class TestFingerprint:
+    def test_fingerprinted_name(self):
+        assert fingerprinted_name("style.css", "3f9a1c2b4d") == "style.3f9a1c2b.css"
+        assert fingerprinted_name("LICENSE", "3f9a1c2b4d") == "LICENSE.3f9a1c2b"
+
+    def test_passthrough_opt_in(self, tmp_path):
+        (tmp_path / "style.css").write_text("body {}")
+        (tmp_path / "logo.png").write_bytes(b"png")
+        (tmp_path / ".meta").write_text('{"wildcard_metadata": [["*.css", {"fingerprint": true}]]}')
+        tree = MetaTree(str(tmp_path), {"uuid-oid-root": "test"})
+        chains = ProcessorChains()
+        names = {}
+        for name in ("style.css", "logo.png"):
+            path = str(tmp_path / name)
+            chain = chains.get_chain_for_file((), chains.resolve_type(path), path, tree.get_metadata(name))
+            names[name] = chain.output_filename
+        digest = content_digest(str(tmp_path / "style.css"))
+        assert names == {"style.css": "style.{}.css".format(digest[:8]), "logo.png": "logo.png"}
+        (tmp_path / "style.css").write_text("body { color: red }")
+        assert content_digest(str(tmp_path / "style.css")) != digest
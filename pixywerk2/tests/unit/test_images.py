@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+from pixywerk2 import images
+from pixywerk2.images import Variant, VariantWriter, variant_filename, variant_size, variants_for
+
+
+class TestImages:
+    def test_variants_from_metadata(self):
+        ctx = {"image-variants": {"small": {"width": 480}, "thumb": {"width": 64, "height": 64, "quality": 70}}}
+        assert variants_for("photo.jpg", {}) == []
+        assert variants_for("notes.txt", ctx) == []
+        small, thumb = variants_for("photo.JPG", ctx)
+        assert small == Variant("small", 480, None, "jpeg", ".JPG", images.DEFAULT_QUALITY)
+        assert variant_filename("photo.JPG", thumb) == "photo.thumb.JPG"
+        webp = variants_for("photo.png", dict(ctx, **{"image-webp": True}))
+        assert [(x.name, x.format) for x in webp] == [
+            ("small", "png"),
+            ("small", "webp"),
+            ("thumb", "png"),
+            ("thumb", "webp"),
+        ]
+
+    def test_variant_size_fits_box_without_enlarging(self):
+        assert variant_size((800, 600), Variant("small", 200, None, "jpeg", ".jpg", 85)) == (200, 150)
+        assert variant_size((800, 600), Variant("thumb", 64, 64, "jpeg", ".jpg", 85)) == (64, 48)
+        assert variant_size((100, 50), Variant("large", 1200, None, "jpeg", ".jpg", 85)) == (100, 50)
+
+    def test_variants_generated_once(self, tmp_path):
+        pil_image = pytest.importorskip("PIL.Image")
+        source = tmp_path / "photo.png"
+        pil_image.new("RGB", (400, 200), "red").save(str(source))
+        variants = variants_for("photo.png", {"image-variants": {"small": {"width": 100}}, "image-webp": True})
+        published = []
+        for _ in range(3):
+            writer = VariantWriter(str(tmp_path / "cache"), workers=1)
+            writer.submit(str(source), str(tmp_path), variants)
+            writer.close()
+            st = os.stat(str(tmp_path / "photo.small.png"))
+            published.append((st.st_ino, st.st_mtime_ns))
+        assert (writer.generated, writer.reused) == (0, 2)
+        # reused variants which are already published are not copied again
+        assert published[1] == published[2]
+        with pil_image.open(str(tmp_path / "photo.small.webp")) as small:
+            assert small.size == (100, 50) and small.format == "WEBP"
+        assert os.path.exists(str(tmp_path / "photo.small.png"))
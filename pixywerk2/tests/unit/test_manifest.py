@@ -0,0 +1,94 @@
+import os
+
+from pixywerk2.dependencies import record_file, record_glob, recording
+from pixywerk2.manifest import BuildManifest, metadata_digest
+
+
+class TestBuildManifest:
+    def _tree(self, make_tree):
+        base = make_tree({"src/index.thtml": "hello", "publish/index.html": "rendered"})
+        return str(base / "src"), str(base / "publish"), str(base / "publish.manifest.json")
+
+    def test_unchanged_is_current(self, make_tree):
+        root, output, path = self._tree(make_tree)
+        manifest = BuildManifest(path, root, output)
+        manifest.record("index.html", "index.thtml", "template-html", "abc")
+        manifest.save()
+
+        manifest = BuildManifest(path, root, output)
+        assert manifest.is_current("index.html", "index.thtml", "template-html", "abc")
+        assert not manifest.is_current("index.html", "index.thtml", "template-html", "def")
+        assert not manifest.is_current("index.html", "index.thtml", "markdown", "abc")
+
+    def test_touched_source_is_current(self, make_tree):
+        root, output, path = self._tree(make_tree)
+        manifest = BuildManifest(path, root, output)
+        manifest.record("index.html", "index.thtml", "template-html", "abc")
+        source = os.path.join(root, "index.thtml")
+        os.utime(source, (1, 1))
+        assert manifest.is_current("index.html", "index.thtml", "template-html", "abc")
+
+    def test_changed_source_is_stale(self, make_tree):
+        root, output, path = self._tree(make_tree)
+        manifest = BuildManifest(path, root, output)
+        manifest.record("index.html", "index.thtml", "template-html", "abc")
+        with open(os.path.join(root, "index.thtml"), "w") as outfile:
+            outfile.write("jello")
+        os.utime(os.path.join(root, "index.thtml"), (1, 1))
+        assert not manifest.is_current("index.html", "index.thtml", "template-html", "abc")
+
+    def test_missing_output_is_stale(self, make_tree):
+        root, output, path = self._tree(make_tree)
+        manifest = BuildManifest(path, root, output)
+        manifest.record("index.html", "index.thtml", "template-html", "abc")
+        os.unlink(os.path.join(output, "index.html"))
+        assert not manifest.is_current("index.html", "index.thtml", "template-html", "abc")
+
+
+class TestMetadataDigest:
+    def test_ignores_volatile_keys(self):
+        assert metadata_digest({"title": "a", "build-time": 1}) == metadata_digest({"title": "a", "build-time": 2})
+        assert metadata_digest({"title": "a"}) != metadata_digest({"title": "b"})
+
+
+class TestManifestDependencies:
+    def test_changed_dependency_is_stale(self, tmp_path):
+        root = tmp_path / "src"
+        output = tmp_path / "publish"
+        root.mkdir()
+        output.mkdir()
+        (root / "index.thtml").write_text("hello")
+        (root / "default.jinja2").write_text("{{ content }}")
+        (output / "index.html").write_text("rendered")
+        manifest = BuildManifest(str(tmp_path / "manifest.json"), str(root), str(output))
+
+        with recording() as deps:
+            record_file(str(root / "default.jinja2"))
+            record_glob("*.md")
+        manifest.record("index.html", "index.thtml", "template-html", "abc", deps)
+        manifest.save()
+        assert BuildManifest(str(tmp_path / "manifest.json"), str(root), str(output)).is_current(
+            "index.html", "index.thtml", "template-html", "abc"
+        )
+
+        (root / "default.jinja2").write_text("<p>{{ content }}</p>")
+        manifest = BuildManifest(str(tmp_path / "manifest.json"), str(root), str(output))
+        assert not manifest.is_current("index.html", "index.thtml", "template-html", "abc")
+
+    def test_new_glob_match_is_stale(self, tmp_path):
+        root = tmp_path / "src"
+        output = tmp_path / "publish"
+        root.mkdir()
+        output.mkdir()
+        (root / "index.thtml").write_text("hello")
+        (output / "index.html").write_text("rendered")
+        manifest = BuildManifest(str(tmp_path / "manifest.json"), str(root), str(output))
+
+        with recording() as deps:
+            record_glob("*.md")
+        manifest.record("index.html", "index.thtml", "template-html", "abc", deps)
+        manifest.save()
+
+        (root / "post.md").write_text("# post")
+        manifest = BuildManifest(str(tmp_path / "manifest.json"), str(root), str(output))
+        assert not manifest.is_current("index.html", "index.thtml", "template-html", "abc")
@@ -0,0 +1,65 @@
+import os
+
+from pixywerk2.manifest import metadata_digest
+from pixywerk2.metadata import MetaTree
+from pixywerk2.processchain import ProcessorChains
+
+
+class TestMetaTree:
+    def _tree(self, make_tree):
+        root = make_tree(
+            {
+                ".meta": '{"title": "site", "wildcard_metadata": [["*.md", {"kind": "markdown"}]]}',
+                "posts/.meta": '{"template": "post.jinja2"}',
+                "posts/a.md": "# a",
+                "posts/a.md.meta": '{"title": "a"}',
+                "posts/b.thtml": "b",
+            }
+        )
+        return MetaTree(str(root), {"template": "default.jinja2", "uuid-oid-root": "test"})
+
+    def test_merges_levels(self, make_tree):
+        tree = self._tree(make_tree)
+        meta = tree.get_metadata("posts/a.md")
+        assert meta["title"] == "a"
+        assert meta["template"] == "post.jinja2"
+        assert meta["kind"] == "markdown"
+        assert meta["file_name"] == "a.md"
+        assert meta["dir"] == "posts"
+
+        meta = tree.get_metadata("posts/b.thtml")
+        assert meta["title"] == "site"
+        assert "kind" not in meta
+
+    def test_revalidates_on_new_build(self, tmp_path, make_tree):
+        tree = self._tree(make_tree)
+        assert tree.get_metadata("posts/b.thtml")["template"] == "post.jinja2"
+        (tmp_path / "posts" / ".meta").write_text('{"template": "other.jinja2"}')
+        os.utime(str(tmp_path / "posts" / ".meta"), (1e10, 1e10))
+        assert tree.get_metadata("posts/b.thtml")["template"] == "post.jinja2"
+        tree.new_build()
+        assert tree.get_metadata("posts/b.thtml")["template"] == "other.jinja2"
+
+    def test_layered_and_lazy(self, make_tree):
+        tree = self._tree(make_tree)
+        meta = tree.get_metadata("posts/a.md")
+        assert metadata_digest(meta) == metadata_digest(tree.get_metadata("posts/a.md"))
+        assert "stat" not in meta._values and "uuid" not in meta._values
+        assert meta["stat"]["size"] == 3
+        assert meta["mime-type"] == meta["guessed-type"]
+        meta["title"] = "changed"
+        del meta["kind"]
+        assert meta["title"] == "changed" and "kind" not in meta and "kind" not in dict(meta)
+        # nothing is shared with the directory's metadata or with other files
+        assert tree.get_metadata("posts/a.md")["title"] == "a"
+        assert tree.get_metadata("posts/a.md")["kind"] == "markdown"
+        assert list(meta).count("title") == 1
+
+    def test_overlay_stays_lazy(self, make_tree):
+        tree = self._tree(make_tree)
+        meta = tree.get_metadata("posts/a.md")
+        chains = ProcessorChains()
+        chains.pipelines["default"] = chains.pipelines["default"]._replace(fingerprint=True)
+        ctx = chains.get_chain_for_file((), "css", "style.css", meta)._ctx
+        assert ctx is not meta and ctx["fingerprint"] is True and "fingerprint" not in meta
+        assert "uuid" not in ctx._values and ctx["title"] == "a"
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+from pixywerk2.assets import publish_asset
+from pixywerk2.output import iter_chunks, write_output
+
+
+class TestOutput:
+    def test_chunks_iterables(self):
+        chunks = list(iter_chunks(("ab" for _ in range(10)), buffer_size=5))
+        assert b"".join(chunks) == b"ab" * 10
+        assert all(len(x) >= 5 for x in chunks[:-1])
+
+    def test_write_output(self, tmp_path):
+        target = str(tmp_path / "out.html")
+        assert write_output(target, "héllo", buffer_size=2) == 6
+        assert open(target, "rb").read() == "héllo".encode("utf-8")
+        write_output(target, [b"a", "b", b"c"])
+        assert open(target, "rb").read() == b"abc"
+
+    def test_write_output_replaces_hardlinked_target(self, tmp_path, make_tree):
+        source = make_tree({"setup.py": "source"}) / "setup.py"
+        target = str(tmp_path / "out.py")
+        publish_asset(str(source), target, "hardlink")
+        write_output(target, "rendered")
+        assert source.read_text() == "source"
+        assert open(target).read() == "rendered"
+        assert sorted(os.listdir(str(tmp_path))) == ["out.py", "setup.py"]
+
+    def test_write_output_keeps_target_on_error(self, tmp_path):
+        target = str(tmp_path / "out.html")
+        write_output(target, "old")
+
+        def failing():
+            yield "new"
+            raise ValueError("render failed")
+
+        with pytest.raises(ValueError):
+            write_output(target, failing())
+        assert open(target).read() == "old"
+        assert os.listdir(str(tmp_path)) == ["out.html"]
@@ -0,0 +1,22 @@
+import io
+
+from pixywerk2.processors import process_md
+
+
+class TestMarkdownProcessor:
+    def test_converter_per_configuration(self):
+        key, converter = process_md.get_converter(["extra"], {})
+        assert process_md.get_converter(["extra"], {}) == (key, converter)
+        other = process_md.get_converter(["toc"], {"toc": {"permalink": True}})
+        assert other[0] != key and other[1] is not converter
+
+    def test_process(self):
+        processor = process_md.MarkdownProcessor()
+        html = "".join(processor.process(io.StringIO("# Title\n\n*[HTML]: Hyper\n\nSome HTML.\n"), {}))
+        assert '<abbr title="Hyper">HTML</abbr>' in html
+        # a converter is reset between documents, so the abbreviation doesn't leak into the next one
+        assert "<abbr" not in "".join(processor.process(io.StringIO("More HTML.\n"), {}))
+        ctx = {"markdown-extensions": ["toc"], "markdown-extension-configs": {"toc": {"permalink": True}}}
+        html = "".join(processor.process(io.StringIO("# Title\n"), ctx))
+        assert 'class="headerlink"' in html
+        assert "".join(processor.process(io.StringIO("# Title\n"), ctx)) == html
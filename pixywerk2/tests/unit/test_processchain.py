@@ -1,6 +1,61 @@
+import pytest
+
+from pixywerk2.processchain import ProcessorChains
+
+
 class TestProcessChain:
-    def test_process_chain(self):
-        pass
+    def test_compiled_pipelines(self):
+        chains = ProcessorChains()
+        first = chains.get_chain_for_file(["# a"], "md", "posts/a.md", {"file_name": "a.md"})
+        second = chains.get_chain_for_file(["# b"], "md", "posts/b.md", {"file_name": "b.md"})
+        assert first._processors is second._processors is chains.pipelines["markdown"].processors
+        assert (first.output_filename, second.output_filename, first.output_mime) == ("a.html", "b.html", "text/html")
+        assert chains.is_passthrough("default") and not chains.is_passthrough("markdown")
+        # chains without a file name no longer get a random one
+        nameless = [chains.get_chain_for_file([], "md").output_filename for _ in range(2)]
+        assert nameless[0] == nameless[1]
+        with pytest.raises(NotImplementedError):
+            chains.get_chain_for_file([], "bb", "a.bb")
+
+    def test_names_without_opening(self, tmp_path, make_tree):
+        chains = ProcessorChains()
+        # nothing is opened, so files which don't exist still have names
+        assert chains.output_filenames([(str(tmp_path / "a.md"), None), (str(tmp_path / "b.css"), None)]) == [
+            "a.html",
+            "b.css",
+        ]
+        make_tree({"c.md": "*c*"})
+        chain = chains.get_chain_for_filename(str(tmp_path / "c.md"), {"templates": str(tmp_path)})
+        (tmp_path / "c.md").write_text("*changed*")
+        assert "".join(chain._file_data) == "*changed*"
+
+    def test_split_chains_share_steps(self, tmp_path, make_tree, monkeypatch):
+        config = (
+            "default: {extension: default, chain: [passthrough]}\n"
+            "markdown: {extension: [md], chain: ['split (source)', jinja2, process_md, 'split (fragment)', jinja2]}\n"
+            "source: {extension: null, chain: [passthrough]}\n"
+            "fragment: {extension: null, suffix: fragment, chain: []}\n"
+        )
+        make_tree({"chains.yaml": config, "a.md": "*{{ 6 * 7 }}*"})
+        chains = ProcessorChains(str(tmp_path / "chains.yaml"))
+        assert chains.all_output_filenames(str(tmp_path / "a.md")) == ["a.html", "a.md", "a.fragment.html"]
+        markdown = chains.pipelines["markdown"].processors[1]
+        calls = []
+        process = markdown.process
+        monkeypatch.setattr(markdown, "process", lambda *args: calls.append(1) or process(*args))
+        ctx = {"templates": str(tmp_path), "globals": {}, "filters": {}}
+        chain = chains.get_chain_for_filename(str(tmp_path / "a.md"), ctx)
+        source, fragment = chain.branches
+        assert source.file_type == "source" and chains.is_passthrough(source.file_type)
+        assert fragment.output_mime == "text/html"
+        assert "".join(chain.output) == "".join(fragment.output) == "<p><em>42</em></p>"
+        assert len(calls) == 1
 
-    def test_processor_chain(self):
-        pass
+    def test_split_into_itself(self, make_tree):
+        config = (
+            "default: {extension: default, chain: [passthrough]}\n"
+            "loop: {extension: [x], chain: [jinja2, 'split (loop)']}\n"
+        )
+        root = make_tree({"chains.yaml": config})
+        with pytest.raises(ValueError):
+            ProcessorChains(str(root / "chains.yaml"))
@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+from pixywerk2.processchain import ProcessorChain, ProcessorChains
+from pixywerk2.processors import processors
+from pixywerk2.processors.processors import (
+    INPUT_BYTES,
+    INPUT_PATH,
+    INPUT_TEXT,
+    Processor,
+    ProcessorException,
+    SourceFile,
+    prepare_input,
+)
+from pixywerk2.rendercache import RenderCache
+
+
+class HexDump(Processor):
+    input_kind = INPUT_BYTES
+
+    def filename(self, oldname, ctx=None):
+        return oldname
+
+    def mime_type(self, oldname, ctx=None):
+        return "text/plain"
+
+    def extension(self, oldname, ctx=None):
+        return ""
+
+    def process(self, input_file, ctx=None):
+        return bytes(input_file).hex()
+
+
+class TestProcessorInput:
+    def test_source_file(self, tmp_path, monkeypatch):
+        (tmp_path / "small.txt").write_bytes("caf\xe9".encode("latin-1"))
+        source = SourceFile(str(tmp_path / "small.txt"), "latin-1")
+        assert prepare_input(source, INPUT_TEXT) == "caf\xe9"
+        assert prepare_input(source, INPUT_BYTES) == b"caf\xe9"
+        assert prepare_input(source, INPUT_PATH) == str(tmp_path / "small.txt")
+
+        monkeypatch.setattr(processors, "MMAP_THRESHOLD", 4)
+        (tmp_path / "large.txt").write_text("line one\nline two\n")
+        large = SourceFile(str(tmp_path / "large.txt"))
+        assert isinstance(large.buffer(), memoryview)
+        assert list(large) == ["line one\nline two\n"]
+
+    def test_conversions(self):
+        assert prepare_input(iter(["a", "b"]), INPUT_BYTES, "utf-16-le") == "ab".encode("utf-16-le")
+        assert prepare_input(b"ab", INPUT_BYTES) == b"ab"
+        with pytest.raises(ProcessorException):
+            prepare_input("text", INPUT_PATH)
+
+    def test_encoding_from_metadata(self, tmp_path):
+        (tmp_path / "page.md").write_bytes("*caf\xe9*".encode("latin-1"))
+        chain = ProcessorChains().get_chain_for_filename(
+            str(tmp_path / "page.md"), {"encoding": "latin-1", "templates": str(tmp_path)}
+        )
+        markdown = chain._processors[1]
+        html = markdown.process(prepare_input(chain._file_data, markdown.input_kind), {}).read()
+        assert html == "<p><em>caf\xe9</em></p>"
+
+    def test_bytes_processor_with_render_cache(self, tmp_path):
+        # not valid UTF-8, so the source must reach the processor undecoded
+        (tmp_path / "blob.bin").write_bytes(b"\xff\x00\xfe")
+        for _ in range(2):
+            cache = RenderCache(str(tmp_path / "cache"), str(tmp_path))
+            source = SourceFile(str(tmp_path / "blob.bin"))
+            chain = ProcessorChain([HexDump()], "blob.bin", source, "hex", {}, cache)
+            assert "".join(chain.output) == "ff00fe"
+        assert len(os.listdir(str(tmp_path / "cache"))) == 1
@@ -0,0 +1,54 @@
+import time
+
+from pixywerk2 import profiler
+
+
+class Upper:
+    def process(self, input_file, ctx=None):
+        return (x.upper() for x in input_file)
+
+
+class Join:
+    def process(self, input_file, ctx=None):
+        return "".join(input_file)
+
+
+class TestProfiler:
+    def setup_method(self):
+        profiler.reset()
+        profiler.enable()
+
+    def teardown_method(self):
+        profiler.enable(False)
+        profiler.reset()
+
+    def test_profile_chain(self):
+        output = profiler.profile_chain([Upper(), Join()], ["a", "b"], {"file_path": "x.md"})
+        assert output == "AB"
+        totals = profiler.report()["totals"]["processor"]
+        assert totals["test_profiler"]["calls"] == 2
+        assert all(x["ph"] == "X" and x["args"]["file"] == "x.md" for x in profiler.drain()["events"])
+
+    def test_drain_and_merge(self):
+        profiler.count("cache.hit")
+        with profiler.span("render", "file", file="a.md"):
+            pass
+        data = profiler.drain()
+        assert profiler.report()["files"] == []
+        profiler.merge(data)
+        profiler.merge(data)
+        summary = profiler.report()
+        assert [x["file"] for x in summary["files"]] == ["a.md", "a.md"]
+        assert summary["counters"] == {"cache.hit": 2}
+        assert summary["totals"]["file"]["render"]["calls"] == 2
+
+    def test_stream_span_covers_iteration(self):
+        def slow():
+            time.sleep(0.05)
+            yield "a"
+
+        output = profiler.stream_span("slow", "processor", slow, file="x.md")
+        assert profiler.report()["totals"] == {}
+        assert list(output) == ["a"]
+        totals = profiler.report()["totals"]["processor"]["slow"]
+        assert totals["calls"] == 1 and totals["wall"] >= 0.05
@@ -0,0 +1,35 @@
+from pixywerk2 import profiler
+from pixywerk2.pygments import pygments_get_css, pygments_highlighter, pygments_markup_contents_html
+
+CODE = "def answer():\n    return 42\n"
+
+
+class TestPygments:
+    def setup_method(self):
+        profiler.reset()
+        profiler.enable()
+
+    def teardown_method(self):
+        profiler.enable(False)
+        profiler.reset()
+
+    def test_lexer_lookups(self):
+        by_filename = pygments_markup_contents_html(CODE, "answer.py")
+        assert by_filename == pygments_markup_contents_html(CODE, "python")
+        assert by_filename == pygments_markup_contents_html(CODE, "text/x-python")
+        assert '<span class="k">def</span>' in by_filename
+        assert pygments_get_css() is pygments_get_css("default")
+
+    def test_disk_cache(self, tmp_path):
+        highlight = pygments_highlighter(str(tmp_path))
+        html = highlight("unique = {}\n".format(id(tmp_path)), "python", "monokai")
+        assert len(list(tmp_path.glob("*/*"))) == 1
+        (cached,) = tmp_path.glob("*/*")
+        cached.write_text("from disk")
+        # fragments in memory don't touch the disk, so clear them to check the copy on disk is used
+        from pixywerk2 import pygments
+
+        pygments._highlighted.clear()
+        assert highlight("unique = {}\n".format(id(tmp_path)), "python", "monokai") == "from disk"
+        assert html != "from disk"
+        assert profiler.report()["counters"]["pygments.disk.hit"] == 1
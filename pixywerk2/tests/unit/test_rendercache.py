@@ -0,0 +1,92 @@
+import os
+
+from pixywerk2 import profiler
+from pixywerk2.build import Site
+from pixywerk2.dependencies import DependencyRecord, recording
+from pixywerk2.rendercache import RenderCache, prune, stats
+
+
+class TestRenderCache:
+    def setup_method(self):
+        profiler.reset()
+        profiler.enable()
+
+    def teardown_method(self):
+        profiler.enable(False)
+        profiler.reset()
+
+    def test_dependencies_are_validated(self, tmp_path):
+        (tmp_path / "part.html").write_text("one")
+        cache = RenderCache(str(tmp_path / "cache"), str(tmp_path))
+        key = cache.key("jinja2", "{{ get_raw('part.html') }}", "abc")
+        assert key != cache.key("jinja2", "{{ get_raw('part.html') }}", "def")
+        deps = DependencyRecord()
+        deps.files.add(str(tmp_path / "part.html"))
+        cache.put(key, "one", deps)
+        with recording() as replayed:
+            assert cache.get(key) == "one"
+        assert replayed.files == deps.files
+        (tmp_path / "part.html").write_text("three")
+        assert cache.get(key) is None
+        cache.lookup = False
+        (tmp_path / "part.html").write_text("one")
+        assert cache.get(key) is None
+
+    def test_template_change_reuses_earlier_steps(self, tmp_path):
+        root = tmp_path / "src"
+        (root / "templates").mkdir(parents=True)
+        (root / "templates" / "default.jinja2").write_text("<main>{{ content }}</main>")
+        (root / "post.md").write_text("# {{ 6 * 7 }}\n")
+        cache_dir = str(tmp_path / "cache")
+        Site(str(root), str(root / "templates"), cache_dir=cache_dir).render("post.md", str(tmp_path / "a.html"))
+        assert profiler.report()["counters"]["render_cache.miss"] == 3
+
+        (root / "templates" / "default.jinja2").write_text("<article>{{ content }}</article>")
+        profiler.reset()
+        Site(str(root), str(root / "templates"), cache_dir=cache_dir).render("post.md", str(tmp_path / "b.html"))
+        counters = profiler.report()["counters"]
+        assert (counters["render_cache.hit"], counters["render_cache.stale"]) == (2, 1)
+        assert (tmp_path / "b.html").read_text() == "<article><h1>42</h1></article>"
+
+    def test_volatile_values_are_validated(self, tmp_path, make_tree):
+        root = make_tree(
+            {"src/templates/default.jinja2": "{{ content }}", "src/page.thtml": "{{ metadata['build-time'] }}"}
+        )
+        cache_dir = str(tmp_path / "cache")
+        for build_time in (1, 1, 2):
+            site = Site(str(root / "src"), str(root / "src" / "templates"), build_time=build_time, cache_dir=cache_dir)
+            site.render("page.thtml", str(tmp_path / "page.html"))
+            assert (tmp_path / "page.html").read_text() == str(build_time)
+        counters = profiler.report()["counters"]
+        # the second build reuses both steps, the third reruns the one which read the build time
+        assert (counters["render_cache.hit"], counters["render_cache.stale"]) == (2, 1)
+
+    def test_prune(self, tmp_path):
+        cache = RenderCache(str(tmp_path), str(tmp_path), max_size=0)
+        for number in range(3):
+            cache.put(cache.key("jinja2", str(number), ""), "x" * 100, DependencyRecord())
+            os.utime(cache._entry_path(cache.key("jinja2", str(number), "")), (number, number))
+        assert stats(str(tmp_path))["entries"] == 3
+        size = stats(str(tmp_path))["bytes"] // 3
+        assert prune(str(tmp_path), size * 2) == (1, size)
+        assert cache.get(cache.key("jinja2", "0", "")) is None
+        assert cache.get(cache.key("jinja2", "2", "")) == "x" * 100
+        assert cache.prune() == (2, size * 2)
+
+    def test_last_step_streams(self, tmp_path):
+        root = tmp_path / "src"
+        (root / "templates").mkdir(parents=True)
+        (root / "templates" / "default.jinja2").write_text("<main>{{ content }}</main>")
+        (root / "page.thtml").write_text("{{ 6 * 7 }}")
+        site = Site(str(root), str(root / "templates"), cache_dir=str(tmp_path / "cache"))
+        chain = site.get_chain("page.thtml", site.meta_tree.get_metadata("page.thtml"))
+        output = chain.output
+        assert not isinstance(output, str)
+        # the page template step is stored once its output has been written, along with the template it read
+        assert stats(str(tmp_path / "cache" / "render"))["entries"] == 1
+        assert "".join(output) == "<main>42</main>"
+        assert stats(str(tmp_path / "cache" / "render"))["entries"] == 2
+        (root / "templates" / "default.jinja2").write_text("<article>{{ content }}</article>")
+        assert "".join(site.get_chain("page.thtml", site.meta_tree.get_metadata("page.thtml")).output) == (
+            "<article>42</article>"
+        )
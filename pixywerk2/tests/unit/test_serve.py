@@ -0,0 +1,46 @@
+from pixywerk2.build import Site
+from pixywerk2.serve import Asset, OnDemandSite
+
+
+class TestOnDemandSite:
+    def _pages(self, make_tree):
+        root = make_tree(
+            {
+                "templates/default.jinja2": "<body>{{ content }}</body>",
+                "posts/hello.thtml": "hello {{ metadata.title }}",
+                "posts/hello.thtml.meta": '{"title": "world"}',
+                "logo.png": b"\x89PNG",
+            }
+        )
+        return OnDemandSite(Site(str(root), str(root / "templates")))
+
+    def test_resolves_output_names(self, tmp_path, make_tree):
+        pages = self._pages(make_tree)
+        assert pages.resolve("posts/hello.html") == "posts/hello.thtml"
+        assert pages.resolve("posts/hello.thtml") is None
+        assert pages.resolve("missing/hello.html") is None
+        asset = pages.get("logo.png")
+        assert isinstance(asset, Asset) and asset.path == str(tmp_path / "logo.png")
+
+    def test_renders_and_invalidates(self, tmp_path, make_tree):
+        pages = self._pages(make_tree)
+        response = pages.get("posts/hello.html")
+        assert response.body == b"<body>hello world</body>"
+        assert pages.get("posts/hello.html") is response
+        pages.invalidate([str(tmp_path / "logo.png")])
+        assert pages.get("posts/hello.html") is response
+        (tmp_path / "posts" / "hello.thtml.meta").write_text('{"title": "again"}')
+        pages.invalidate([str(tmp_path / "posts" / "hello.thtml.meta")])
+        assert pages.get("posts/hello.html").body == b"<body>hello again</body>"
+
+    def test_invalidates_only_changed_directories(self, tmp_path, make_tree):
+        pages = self._pages(make_tree)
+        assert pages.resolve("posts/hello.html") and pages.resolve("logo.png")
+        root_map = pages._dir_maps[""]
+        make_tree({"posts/new.thtml": "new"})
+        pages.invalidate([str(tmp_path / "posts" / "new.thtml")])
+        assert pages.resolve("posts/new.html") == "posts/new.thtml"
+        assert pages._dir_maps[""] is root_map
+        make_tree({".meta": '{"type": "passthrough"}'})
+        pages.invalidate([str(tmp_path / ".meta")])
+        assert pages._dir_maps == {}
@@ -0,0 +1,40 @@
+import os
+
+from pixywerk2.build import Site
+from pixywerk2.template_env import TrackingEnvironment, get_environment
+
+
+class TestTemplateEnv:
+    def _ctx(self, tmp_path, **extra):
+        return dict({"templates": str(tmp_path), "globals": {"answer": 42}, "filters": {}}, **extra)
+
+    def test_shared_per_site(self, tmp_path, make_tree):
+        make_tree({"src/templates/default.jinja2": "{{ content }}", "src/a.md": "a", "src/b.md": "b"})
+        site = Site(str(tmp_path / "src"), str(tmp_path / "src" / "templates"))
+        first = get_environment(site.meta_tree.get_metadata("a.md"))
+        assert get_environment(site.meta_tree.get_metadata("b.md")) is first
+        other = Site(str(tmp_path / "src"), str(tmp_path / "src" / "templates"))
+        assert get_environment(other.meta_tree.get_metadata("a.md")) is not first
+        # without a site, nothing is kept
+        ctx = self._ctx(tmp_path)
+        assert get_environment(ctx) is not get_environment(ctx)
+
+    def test_cached_from_string(self, tmp_path):
+        template_env = get_environment(self._ctx(tmp_path))
+        template = template_env.cached_from_string("{{ answer }}")
+        assert template_env.cached_from_string("{{ answer }}") is template
+        assert template.render() == "42"
+        assert template_env.cached_from_string("{{ answer + 1 }}").render() == "43"
+
+    def test_bytecode_cache(self, tmp_path, monkeypatch):
+        cache_dir = str(tmp_path / "cache")
+        ctx = self._ctx(tmp_path, **{"template-cache": cache_dir})
+        assert get_environment(ctx).cached_from_string("{{ answer }}").render() == "42"
+        assert len(os.listdir(cache_dir)) == 1
+
+        def compile_(*args, **kwargs):
+            raise AssertionError("compiled again")
+
+        # a new environment loads the compiled source from the cache
+        monkeypatch.setattr(TrackingEnvironment, "compile", compile_)
+        assert get_environment(ctx).cached_from_string("{{ answer }}").render() == "42"
@@ -0,0 +1,15 @@
+from pixywerk2.utils import LRUCache
+
+
+class TestUtils:
+    def test_lru_cache(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        assert cache.get("a") == 1
+        # b is now the least recently used entry
+        cache.put("c", 3)
+        assert "b" not in cache and cache.get("b") is None
+        assert cache.get("a") == 1 and cache.get("c") == 3 and len(cache) == 2
+        cache.clear()
+        assert len(cache) == 0
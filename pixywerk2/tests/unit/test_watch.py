@@ -0,0 +1,27 @@
+import os
+
+from pixywerk2.watch import PollingWatcher, changes, make_watcher
+
+
+class TestWatch:
+    def _touch(self, path, content="x"):
+        with open(path, "w") as f:
+            f.write(content)
+
+    def test_polling_reports_changes(self, tmp_path):
+        os.mkdir(tmp_path / "out")
+        watcher = PollingWatcher([str(tmp_path)], ignore=[str(tmp_path / "out")], interval=0.01)
+        assert watcher.poll(0) == set()
+        self._touch(tmp_path / "page.md")
+        self._touch(tmp_path / "out" / "page.html")
+        self._touch(tmp_path / "page.md~")
+        assert watcher.poll(0) == {str(tmp_path / "page.md")}
+
+    def test_changes_are_batched(self, tmp_path):
+        watcher = make_watcher([str(tmp_path)])
+        self._touch(tmp_path / "a.md")
+        self._touch(tmp_path / "b.md")
+        batches = list(changes(watcher, debounce=0.05, timeout=0.2))
+        watcher.close()
+        assert len(batches) == 1
+        assert {str(tmp_path / "a.md"), str(tmp_path / "b.md")} <= batches[0]
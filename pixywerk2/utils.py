@@ -1,7 +1,12 @@
+import collections
+import contextlib
+import glob
 import mimetypes
 import os
 
-from typing import Dict, Optional
+from typing import Any, Dict, Hashable, Iterator, List, Optional
+
+from .fileindex import FileIndex
 
 
 def merge_dicts(dict_a: Dict, dict_b: Dict) -> Dict:
@@ -20,17 +25,21 @@ def merge_dicts(dict_a: Dict, dict_b: Dict) -> Dict:
     return dict_z
 
 
-def guess_mime(path: str) -> Optional[str]:
+def guess_mime(path: str, index: Optional[FileIndex] = None) -> Optional[str]:
     """Guess the mime type for a given path.
 
     Arguments:
-        root (str): the root path of the file tree
-        path (str): the sub-path within the file tree
+        path (str): the path of the file
+        index (FileIndex, optional): an index of the source tree, which answers for the paths inside it without any
+            syscalls
 
     Returns:
         str: the guessed mime-type
 
     """
+    if index is not None and index.covers(path):
+        entry = index.get_os_path(path)
+        return entry.mime if entry is not None else "application/octet-stream"
     mtypes = mimetypes.guess_type(path)
     ftype = None
     if os.path.isdir(path):
@@ -40,3 +49,139 @@ def guess_mime(path: str) -> Optional[str]:
     else:
         ftype = "application/octet-stream"
     return ftype
+
+
+def glob_files(root: str, path_glob: str) -> List[str]:
+    """Find the source files matching a glob.
+
+    Directories, metadata and backup files are never matched.
+
+    Arguments:
+        root (str): the root path of the file tree
+        path_glob (str): the glob, relative to the root
+
+    Returns:
+        list: the sorted paths of the matching files, relative to the root
+
+    """
+    result = []
+    for fil in glob.glob(os.path.join(root, path_glob)):
+        if os.path.isdir(fil):
+            continue
+        if fil.endswith(".meta") or fil.endswith("~"):
+            continue
+        result.append(os.path.relpath(fil, root))
+    return sorted(result)
+
+
+class GlobMatches:
+    """Find and remember the source files matching each glob, e.g. to check recorded glob dependencies against."""
+
+    def __init__(self, root: str, index: Optional[FileIndex] = None):
+        """Initialize the matches.
+
+        Arguments:
+            root (str): the root path of the file tree
+            index (FileIndex, optional): an index of the tree to answer glob queries from
+
+        """
+        self._root = root
+        self._index = index
+        self._matches: Dict[str, List[str]] = {}
+
+    def clear(self) -> None:
+        """Forget the matches found so far, e.g. at the start of another build."""
+        self._matches = {}
+
+    def get(self, pattern: str) -> List[str]:
+        """Return the files matching a glob, as glob_files would.
+
+        Arguments:
+            pattern (str): the glob, relative to the root
+
+        Returns:
+            list: the sorted paths of the matching files, relative to the root
+
+        """
+        if pattern not in self._matches:
+            if self._index is not None:
+                self._matches[pattern] = self._index.glob(pattern)
+            else:
+                self._matches[pattern] = glob_files(self._root, pattern)
+        return self._matches[pattern]
+
+
+@contextlib.contextmanager
+def replacing(path: str) -> Iterator[str]:
+    """Yield a temporary path to write a file to, which is renamed over ``path`` when the context exits.
+
+    Each process writes its own temporary file, so several can write the same path, and an existing file is replaced
+    rather than written through (it may be a hardlink to a source file). The temporary file is removed on error.
+
+    Arguments:
+        path (str): the path of the file
+
+    Yields:
+        str: the temporary path
+
+    """
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class LRUCache:
+    """A memo which keeps only its most recently used entries."""
+
+    def __init__(self, size: int):
+        """Initialize the memo.
+
+        Arguments:
+            size (int): the number of entries to keep
+
+        """
+        self.size = size
+        self._entries: collections.OrderedDict = collections.OrderedDict()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any:
+        """Return an entry, marking it as used.
+
+        Arguments:
+            key (hashable): the key of the entry
+
+        Returns:
+            misc: the value of the entry, or None if there is none
+
+        """
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Add an entry, dropping the least recently used one if there are too many.
+
+        Arguments:
+            key (hashable): the key of the entry
+            value (misc): the value of the entry
+
+        """
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop every entry."""
+        self._entries.clear()
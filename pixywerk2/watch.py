@@ -0,0 +1,271 @@
+"""Watch source and template directories for changes, with inotify where available and stat polling elsewhere."""
+
+import abc
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import time
+
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# from sys/inotify.h
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+
+_EVENT = struct.Struct("iIII")
+
+
+def _ignored(path: str, ignore: Tuple[str, ...]) -> bool:
+    if path.endswith("~"):
+        return True
+    for prefix in ignore:
+        if path == prefix or path.startswith(prefix + os.sep):
+            return True
+    return False
+
+
+class Watcher(abc.ABC):
+    """Report the paths which changed under a set of directories."""
+
+    def __init__(self, paths: Iterable[str], ignore: Iterable[str] = ()):
+        """Initialize the watcher.
+
+        Arguments:
+            paths (iterable): The directories to watch, recursively.
+            ignore (iterable, optional): Paths (e.g. the output directory) whose changes are not reported.
+
+        """
+        self.paths = [os.path.abspath(x) for x in paths]
+        self.ignore = tuple(os.path.abspath(x) for x in ignore)
+
+    @abc.abstractmethod
+    def poll(self, timeout: float) -> Set[str]:
+        """Wait up to ``timeout`` seconds for changes.
+
+        Returns:
+            set: the changed paths, empty if nothing changed.
+
+        """
+
+    def close(self) -> None:
+        """Release any resources held by the watcher."""
+
+
+class InotifyWatcher(Watcher):
+    """Watch directories with Linux inotify, called through ctypes."""
+
+    def __init__(self, paths: Iterable[str], ignore: Iterable[str] = ()):
+        """Initialize the watcher.
+
+        Arguments:
+            paths (iterable): The directories to watch, recursively.
+            ignore (iterable, optional): Paths (e.g. the output directory) whose changes are not reported.
+
+        Raises:
+            OSError: if inotify is not available.
+
+        """
+        super().__init__(paths, ignore)
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on linux")
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs: Dict[int, str] = {}
+        for path in self.paths:
+            self._add_tree(path)
+
+    def _add_tree(self, top: str) -> None:
+        for path, dirs, _ in os.walk(top):
+            if _ignored(path, self.ignore):
+                dirs[:] = []
+                continue
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                logger.warning("cannot watch %s: %s", path, os.strerror(ctypes.get_errno()))
+                continue
+            self._dirs[wd] = path
+
+    def poll(self, timeout: float) -> Set[str]:
+        """Wait up to ``timeout`` seconds for changes.
+
+        Returns:
+            set: the changed paths, empty if nothing changed.
+
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            start = offset + _EVENT.size
+            end = start + length
+            name = os.fsdecode(data[start:end].rstrip(b"\0"))
+            offset = end
+            if mask & IN_Q_OVERFLOW:
+                # events were lost, so everything may have changed
+                changed.update(self.paths)
+                continue
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, name) if name else directory
+            if _ignored(path, self.ignore):
+                continue
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_tree(path)
+            changed.add(path)
+        return changed
+
+    def close(self) -> None:
+        """Close the inotify descriptor."""
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatcher(Watcher):
+    """Watch directories by comparing snapshots of their stat results."""
+
+    def __init__(self, paths: Iterable[str], ignore: Iterable[str] = (), interval: float = 0.25):
+        """Initialize the watcher.
+
+        Arguments:
+            paths (iterable): The directories to watch, recursively.
+            ignore (iterable, optional): Paths (e.g. the output directory) whose changes are not reported.
+            interval (float, optional): The time between snapshots, in seconds.
+
+        """
+        super().__init__(paths, ignore)
+        self.interval = interval
+        self._snapshot = self._take_snapshot()
+
+    def _take_snapshot(self) -> Dict[str, Tuple[int, int]]:
+        snapshot = {}
+        pending: List[str] = list(self.paths)
+        while pending:
+            path = pending.pop()
+            try:
+                with os.scandir(path) as it:
+                    for dirent in it:
+                        if _ignored(dirent.path, self.ignore):
+                            continue
+                        try:
+                            st = dirent.stat()
+                        except FileNotFoundError:
+                            continue
+                        snapshot[dirent.path] = (st.st_mtime_ns, st.st_size)
+                        if dirent.is_dir(follow_symlinks=False):
+                            pending.append(dirent.path)
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+        return snapshot
+
+    def poll(self, timeout: float) -> Set[str]:
+        """Wait up to ``timeout`` seconds for changes.
+
+        Returns:
+            set: the changed paths, empty if nothing changed.
+
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            snapshot = self._take_snapshot()
+            old = self._snapshot
+            self._snapshot = snapshot
+            changed = {x for x in snapshot.keys() | old.keys() if snapshot.get(x) != old.get(x)}
+            remaining = deadline - time.monotonic()
+            if changed or remaining <= 0:
+                return changed
+            time.sleep(min(self.interval, remaining))
+
+
+def make_watcher(paths: Iterable[str], ignore: Iterable[str] = (), polling: bool = False) -> Watcher:
+    """Create the best available watcher: inotify, falling back to stat polling.
+
+    Arguments:
+        paths (iterable): The directories to watch, recursively.
+        ignore (iterable, optional): Paths (e.g. the output directory) whose changes are not reported.
+        polling (bool, optional): Always use stat polling.
+
+    Returns:
+        Watcher: the watcher.
+
+    """
+    paths = list(paths)
+    if not polling:
+        try:
+            return InotifyWatcher(paths, ignore)
+        except (OSError, AttributeError) as ex:
+            logger.info("inotify unavailable (%s), falling back to polling", ex)
+    return PollingWatcher(paths, ignore)
+
+
+def changes(watcher: Watcher, debounce: float = 0.1, timeout: Optional[float] = None) -> Iterator[Set[str]]:
+    """Yield batches of changed paths, waiting until no change has arrived for ``debounce`` seconds.
+
+    Saving a file from an editor usually produces a burst of events (write, rename, attribute change...) which
+    should only trigger a single rebuild.
+
+    Arguments:
+        watcher (Watcher): The watcher to read changes from.
+        debounce (float, optional): The quiet time which ends a batch, in seconds.
+        timeout (float, optional): Stop after this many seconds without any changes (default: never)
+
+    Yields:
+        set: the paths changed in the batch.
+
+    """
+    while True:
+        batch = watcher.poll(1.0 if timeout is None else timeout)
+        if not batch:
+            if timeout is not None:
+                return
+            continue
+        while True:
+            more = watcher.poll(debounce)
+            if not more:
+                break
+            batch |= more
+        yield batch